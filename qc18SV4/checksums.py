@@ -0,0 +1,264 @@
+"""
+checksums.py
+
+Compute MD5 and SHA-256 checksums of output files while they are written, or while they
+are read to count their records, so results can be copied to the CyVerse data store
+without hashing hundreds of GB again.
+
+Pipeline.run writes two checksum files to the work directory listing every output file
+still in a step manifest at the end of the run:
+
+    checksums.tsv   path relative to the work directory, size, mtime_ns, md5, sha256,
+                    record_count, and base_count of each file
+    checksums.md5   the same files in the format of md5sum, so they can be checked with
+                    $ cd work_dir && md5sum -c checksums.md5
+
+Files written by a tool whose records are counted by the pipeline are hashed in the
+same pass as the count. A file without a checksum from either pass is hashed when the
+checksum files are written.
+
+A copy of the results can be checked with
+
+    $ verify_checksums work-*
+
+which finds checksums.tsv in each directory and below it, as written for each amplicon,
+and re-reads only the files whose size or modification time is not what was recorded.
+Use --full to re-read every file.
+"""
+import argparse
+from collections import namedtuple
+import glob
+import hashlib
+import io
+import logging
+import os
+import sys
+
+
+checksums_file_name = 'checksums.tsv'
+md5sum_file_name = 'checksums.md5'
+
+FileChecksums = namedtuple('FileChecksums', ['size', 'md5', 'sha256'])
+
+ChecksumEntry = namedtuple(
+    'ChecksumEntry', ['path', 'size', 'mtime_ns', 'md5', 'sha256', 'record_count', 'base_count'])
+
+
+class ChecksumFile(io.BufferedIOBase):
+    """A binary file that computes the size, MD5, and SHA-256 of the bytes written to or read from it.
+
+    A compressed file written or read through a ChecksumFile, see open_compressed, has
+    the checksums of the compressed bytes on disk:
+
+        with ChecksumFile(fp, 'wb') as checksum_file, open_compressed(fp, 'wb', fileobj=checksum_file) as f:
+            f.write(data)
+        file_checksums = checksum_file.checksums
+    """
+    def __init__(self, fp, mode='rb'):
+        super().__init__()
+        self.raw_file = open(fp, mode)
+        # gzip writes the name to the gzip header
+        self.name = fp
+        self.mode = mode
+        self.size = 0
+        self.md5 = hashlib.md5()
+        self.sha256 = hashlib.sha256()
+
+    def update(self, data):
+        # hashlib releases the GIL for large buffers
+        self.md5.update(data)
+        self.sha256.update(data)
+        self.size += memoryview(data).nbytes
+
+    def readable(self):
+        return self.raw_file.readable()
+
+    def writable(self):
+        return self.raw_file.writable()
+
+    def read(self, size=-1):
+        data = self.raw_file.read(size)
+        self.update(data)
+        return data
+
+    def read1(self, size=-1):
+        return self.read(size)
+
+    def readinto(self, buffer):
+        byte_count = self.raw_file.readinto(buffer)
+        self.update(memoryview(buffer)[:byte_count])
+        return byte_count
+
+    def write(self, data):
+        byte_count = self.raw_file.write(data)
+        self.update(data)
+        return byte_count
+
+    def flush(self):
+        if not self.raw_file.closed:
+            self.raw_file.flush()
+
+    def close(self):
+        if not self.closed:
+            try:
+                super().close()
+            finally:
+                self.raw_file.close()
+
+    def read_to_end(self, chunk_size=2**20):
+        """Read the rest of the file, for readers that stop at the end of the compressed data."""
+        while len(self.read(chunk_size)) > 0:
+            pass
+
+    @property
+    def checksums(self):
+        return FileChecksums(size=self.size, md5=self.md5.hexdigest(), sha256=self.sha256.hexdigest())
+
+
+def get_file_checksums(fp, chunk_size=2**20):
+    with ChecksumFile(fp, 'rb') as checksum_file:
+        checksum_file.read_to_end(chunk_size=chunk_size)
+    return checksum_file.checksums
+
+
+def get_checksum_entries(work_dp, output_files):
+    """Return a ChecksumEntry for each of the output files that exists, in the order of output_files.
+
+    Files with no checksums, or whose size has changed since they were hashed, are hashed here.
+
+    :param output_files: OutputFiles of the step manifests
+    """
+    log = logging.getLogger(name=__name__)
+    entries = []
+    for output_file in output_files:
+        if not os.path.exists(output_file.fp):
+            continue
+        file_checksums = output_file.checksums
+        stat = os.stat(output_file.fp)
+        if file_checksums is None or file_checksums.size != stat.st_size:
+            log.info('hashing "%s"', output_file.fp)
+            file_checksums = get_file_checksums(output_file.fp)
+            stat = os.stat(output_file.fp)
+        entries.append(
+            ChecksumEntry(
+                path=os.path.relpath(output_file.fp, work_dp),
+                size=file_checksums.size,
+                mtime_ns=stat.st_mtime_ns,
+                md5=file_checksums.md5,
+                sha256=file_checksums.sha256,
+                record_count=output_file.record_count,
+                base_count=output_file.base_count))
+    return entries
+
+
+def write_checksums(work_dp, output_files):
+    """Write checksums.tsv and checksums.md5 to the work directory.
+
+    :return: list of ChecksumEntry
+    """
+    entries = get_checksum_entries(work_dp, output_files)
+    with open(os.path.join(work_dp, checksums_file_name), 'wt') as checksums_file:
+        checksums_file.write('\t'.join(ChecksumEntry._fields))
+        checksums_file.write('\n')
+        for entry in entries:
+            checksums_file.write('\t'.join('' if value is None else str(value) for value in entry))
+            checksums_file.write('\n')
+    with open(os.path.join(work_dp, md5sum_file_name), 'wt') as md5sum_file:
+        for entry in entries:
+            md5sum_file.write('{}  {}\n'.format(entry.md5, entry.path))
+    return entries
+
+
+def read_checksums(checksums_fp):
+    """Return the list of ChecksumEntry in a checksums.tsv file."""
+    def to_int(value):
+        return None if value == '' else int(value)
+
+    entries = []
+    with open(checksums_fp, 'rt') as checksums_file:
+        header = checksums_file.readline().rstrip('\n').split('\t')
+        for line in checksums_file:
+            if len(line.strip()) == 0:
+                continue
+            values = dict(zip(header, line.rstrip('\n').split('\t')))
+            entries.append(
+                ChecksumEntry(
+                    path=values['path'],
+                    size=int(values['size']),
+                    mtime_ns=int(values['mtime_ns']),
+                    md5=values['md5'],
+                    sha256=values['sha256'],
+                    record_count=to_int(values['record_count']),
+                    base_count=to_int(values['base_count'])))
+    return entries
+
+
+ChecksumResult = namedtuple('ChecksumResult', ['fp', 'status'])
+
+
+def verify_checksums(checksums_fp, full=False):
+    """Check the files listed in a checksums.tsv file.
+
+    A file whose size and modification time are as recorded is taken to be unchanged
+    unless full is True.
+
+    :return: list of ChecksumResult with status 'unchanged', 'ok', 'changed', or 'missing'
+    """
+    checksums_dp = os.path.dirname(checksums_fp)
+    results = []
+    for entry in read_checksums(checksums_fp):
+        fp = os.path.join(checksums_dp, entry.path)
+        if not os.path.exists(fp):
+            status = 'missing'
+        else:
+            stat = os.stat(fp)
+            if not full and stat.st_size == entry.size and stat.st_mtime_ns == entry.mtime_ns:
+                status = 'unchanged'
+            elif get_file_checksums(fp) == FileChecksums(size=entry.size, md5=entry.md5, sha256=entry.sha256):
+                status = 'ok'
+            else:
+                status = 'changed'
+        results.append(ChecksumResult(fp=fp, status=status))
+    return results
+
+
+def find_checksums_files(dp_list):
+    """Return the checksums.tsv files in each directory and its subdirectories."""
+    checksums_fp_list = []
+    for dp in dp_list:
+        checksums_fp_list.extend(sorted(glob.glob(os.path.join(dp, '**', checksums_file_name), recursive=True)))
+    return checksums_fp_list
+
+
+def get_args(argv=None):
+    arg_parser = argparse.ArgumentParser(
+        description='check output files against the {} files of pipeline work directories'.format(
+            checksums_file_name))
+    arg_parser.add_argument('work_dp', nargs='+', help='pipeline work directories')
+    arg_parser.add_argument('--full', action='store_true', help='re-read every file, not only files whose size or modification time changed')
+    args = arg_parser.parse_args(args=argv)
+    return args
+
+
+def main():
+    args = get_args()
+    checksums_fp_list = find_checksums_files(args.work_dp)
+    if len(checksums_fp_list) == 0:
+        print('no {} in {}'.format(checksums_file_name, ' '.join(args.work_dp)), file=sys.stderr)
+        sys.exit(1)
+
+    status_counts = {}
+    for checksums_fp in checksums_fp_list:
+        for result in verify_checksums(checksums_fp, full=args.full):
+            status_counts[result.status] = status_counts.get(result.status, 0) + 1
+            if result.status in ('changed', 'missing'):
+                print('{}\t{}'.format(result.status, result.fp))
+    print(
+        ', '.join('{} {}'.format(count, status) for status, count in sorted(status_counts.items())),
+        file=sys.stderr)
+    if status_counts.get('changed', 0) + status_counts.get('missing', 0) > 0:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
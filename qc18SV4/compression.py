@@ -0,0 +1,262 @@
+"""
+compression.py
+
+Choose how pipeline output files are compressed and read compressed files of either format.
+
+Intermediate files are read once by a later step and are often deleted, so they are
+compressed quickly, with a low gzip level or with zstd. Files that no step reads are
+kept as results and are compressed with gzip at a configurable level so they can be
+read by any tool. The final FASTA file is always gzipped.
+
+Readers detect gzip and zstd from the first bytes of a file rather than from its name.
+
+zstd requires the zstandard package. Install it with
+    $ pip install qc18SV4[zstd]
+
+The CPU time and bytes written by each compression policy can be compared on any
+FASTQ or FASTA files with
+
+    $ benchmark_compression test/data/*.fastq
+
+zstd policies are left out of the default set when zstandard is not installed.
+"""
+import argparse
+from collections import namedtuple
+import gzip
+import io
+import logging
+import os
+import sys
+import time
+
+from qc18SV4.exceptions import PipelineException
+
+
+compression_extensions = {
+    'gzip': '.gz',
+    'zstd': '.zst',
+}
+
+compression_magic_numbers = {
+    'gzip': b'\x1f\x8b',
+    'zstd': b'\x28\xb5\x2f\xfd',
+}
+
+default_compression_levels = {
+    'gzip': 1,
+    'zstd': 3,
+}
+
+
+class CompressionPolicy(namedtuple('CompressionPolicy', ['intermediate_format', 'intermediate_level', 'output_level'])):
+    """Compression of files read by a later step (intermediate) and of files kept as results (output).
+
+    intermediate_format -- 'gzip' or 'zstd'
+    intermediate_level  -- compression level for intermediate files
+    output_level        -- gzip compression level for output files
+    """
+    __slots__ = ()
+
+    @classmethod
+    def create(cls, intermediate_format='gzip', intermediate_level=None, output_level=9):
+        if intermediate_format not in compression_extensions:
+            raise PipelineException('unknown compression format "{}"'.format(intermediate_format))
+        if intermediate_level is None:
+            intermediate_level = default_compression_levels[intermediate_format]
+        return cls(
+            intermediate_format=intermediate_format,
+            intermediate_level=int(intermediate_level),
+            output_level=int(output_level))
+
+
+# the policies compared by benchmark_compression, 'gzip-9' is how every file was compressed before policies
+compression_policies = {
+    'gzip-9': CompressionPolicy.create(intermediate_format='gzip', intermediate_level=9, output_level=9),
+    'gzip-6': CompressionPolicy.create(intermediate_format='gzip', intermediate_level=6, output_level=9),
+    'gzip-1': CompressionPolicy.create(intermediate_format='gzip', intermediate_level=1, output_level=9),
+    'zstd-1': CompressionPolicy.create(intermediate_format='zstd', intermediate_level=1, output_level=9),
+    'zstd-3': CompressionPolicy.create(intermediate_format='zstd', intermediate_level=3, output_level=9),
+}
+
+
+def import_zstandard():
+    try:
+        import zstandard
+    except ImportError as e:
+        raise PipelineException(
+            'zstd compression requires zstandard, install it with "pip install qc18SV4[zstd]"') from e
+    return zstandard
+
+
+def get_compression(fp):
+    """Return 'gzip', 'zstd', or None for an uncompressed file based on the first bytes of the file."""
+    with open(fp, 'rb') as f:
+        head = f.read(4)
+    for compression, magic_number in compression_magic_numbers.items():
+        if head.startswith(magic_number):
+            return compression
+    return None
+
+
+def is_compressed_file_name(fp):
+    return any(fp.endswith(extension) for extension in compression_extensions.values())
+
+
+def strip_compression_extension(fp):
+    for extension in compression_extensions.values():
+        if fp.endswith(extension):
+            return fp[:-len(extension)]
+    return fp
+
+
+def open_compressed(fp, mode='rb', compression=None, level=None, fileobj=None):
+    """Open a file that may be compressed with gzip or zstd.
+
+    When reading, the compression is detected from the file. When writing, the
+    compression is given or taken from the file name.
+
+    :param fp: (str) path to the file
+    :param mode: 'rb', 'rt', 'wb', or 'wt'
+    :param compression: 'gzip', 'zstd', or None
+    :param level: compression level, or None for the default of the compression format
+    :param fileobj: binary file object of fp to read or write through, for example a ChecksumFile,
+                    which the caller closes after the returned file; an uncompressed fileobj is
+                    returned itself, or wrapped for text, and is closed with the returned file
+    :return: a file object
+    """
+    if mode.startswith('r'):
+        compression = get_compression(fp)
+    elif compression is None:
+        compression = next(
+            (c for c, extension in compression_extensions.items() if fp.endswith(extension)),
+            None)
+
+    if compression is None:
+        if fileobj is None:
+            return open(fp, mode)
+        elif mode.endswith('t'):
+            return io.TextIOWrapper(fileobj)
+        else:
+            return fileobj
+    elif compression == 'gzip':
+        return gzip.open(fp if fileobj is None else fileobj, mode, compresslevel=9 if level is None else level)
+    else:
+        zstandard = import_zstandard()
+        if fileobj is None:
+            fileobj = fp
+            closefd = True
+        else:
+            # leave fileobj open so the caller can read to its end or take its checksums
+            closefd = False
+        if mode.startswith('r'):
+            return zstandard.open(fileobj, mode, closefd=closefd)
+        else:
+            cctx = zstandard.ZstdCompressor(level=default_compression_levels['zstd'] if level is None else level)
+            return zstandard.open(fileobj, mode, cctx=cctx, closefd=closefd)
+
+
+BenchmarkResult = namedtuple(
+    'BenchmarkResult',
+    ['policy', 'compression', 'level', 'input_bytes', 'output_bytes', 'compress_seconds', 'decompress_seconds'])
+
+
+def benchmark_compression(fp, compression, level, chunk_size=2**20):
+    """Compress and decompress one file and measure the CPU time of each.
+
+    :return: (output bytes, compression CPU seconds, decompression CPU seconds)
+    """
+    compressed_fp = fp + '.benchmark' + compression_extensions[compression]
+    try:
+        start = time.process_time()
+        with open(fp, 'rb') as src, open_compressed(compressed_fp, 'wb', compression=compression, level=level) as dst:
+            for chunk in iter(lambda: src.read(chunk_size), b''):
+                dst.write(chunk)
+        compress_seconds = time.process_time() - start
+
+        start = time.process_time()
+        with open_compressed(compressed_fp, 'rb') as src:
+            for _ in iter(lambda: src.read(chunk_size), b''):
+                pass
+        decompress_seconds = time.process_time() - start
+
+        return os.path.getsize(compressed_fp), compress_seconds, decompress_seconds
+    finally:
+        if os.path.exists(compressed_fp):
+            os.remove(compressed_fp)
+
+
+def benchmark_compression_policies(fp_list, policies=None):
+    """Compress every file as an intermediate file with each policy.
+
+    :param fp_list: paths to uncompressed files
+    :param policies: dictionary of policy name to CompressionPolicy, by default compression_policies
+    :return: list of BenchmarkResult, one per policy, with totals for all files
+    """
+    if policies is None:
+        policies = compression_policies
+    results = []
+    for policy_name, policy in policies.items():
+        totals = [0, 0, 0.0, 0.0]
+        for fp in fp_list:
+            output_bytes, compress_seconds, decompress_seconds = benchmark_compression(
+                fp, compression=policy.intermediate_format, level=policy.intermediate_level)
+            for i, value in enumerate((os.path.getsize(fp), output_bytes, compress_seconds, decompress_seconds)):
+                totals[i] += value
+        results.append(BenchmarkResult(policy_name, policy.intermediate_format, policy.intermediate_level, *totals))
+    return results
+
+
+def write_benchmark_results(output_file, results):
+    output_file.write(
+        'policy\tcompression\tlevel\tinput_bytes\toutput_bytes\tratio\tcompress_seconds\tdecompress_seconds\n')
+    for result in results:
+        output_file.write(
+            '{}\t{}\t{}\t{}\t{}\t{:.3f}\t{:.3f}\t{:.3f}\n'.format(
+                result.policy,
+                result.compression,
+                result.level,
+                result.input_bytes,
+                result.output_bytes,
+                result.output_bytes / result.input_bytes if result.input_bytes > 0 else 0.0,
+                result.compress_seconds,
+                result.decompress_seconds))
+
+
+def get_args(argv=None):
+    arg_parser = argparse.ArgumentParser(
+        description='compare CPU time and compressed size of each compression policy on uncompressed files')
+    arg_parser.add_argument('fp', nargs='+', help='uncompressed FASTQ or FASTA files')
+    arg_parser.add_argument(
+        '--policy', action='append', choices=sorted(compression_policies), help='policy to benchmark, default is all that can be used')
+    args = arg_parser.parse_args(args=argv)
+    return args
+
+
+def get_benchmark_policies(policy_names=None):
+    """Return the named compression policies, or every policy that can be used if no names are given.
+
+    A PipelineException is raised before any file is compressed if a named policy needs
+    zstandard and it is not installed.
+    """
+    if policy_names is not None:
+        policies = {name: compression_policies[name] for name in policy_names}
+        if any(policy.intermediate_format == 'zstd' for policy in policies.values()):
+            import_zstandard()
+        return policies
+    try:
+        import_zstandard()
+        return dict(compression_policies)
+    except PipelineException as e:
+        logging.getLogger(name=__name__).warning('%s, zstd policies are not benchmarked', e)
+        return {name: policy for name, policy in compression_policies.items() if policy.intermediate_format != 'zstd'}
+
+
+def main():
+    logging.basicConfig(level=logging.WARNING)
+    args = get_args()
+    write_benchmark_results(
+        sys.stdout, benchmark_compression_policies(args.fp, get_benchmark_policies(args.policy)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,249 @@
+"""
+demultiplex.py
+
+Split the read pairs of a run that combines several amplicons, for example 18S V4 and
+16S V4-V5, into one pair of FASTQ files per amplicon in a single pass over the reads.
+
+Amplicons are read from a tab-separated primer table with a header line:
+
+    amplicon    forward_primer          reverse_primer
+    18SV4       CCAGCASCYGCGGTAATTCC    TYRATCAAGAACGAAAGT
+    16SV4V5     GTGYCAGCMGCCGCGGTAA     CCGYCAATTYMTTTRAGTTT
+
+Primers may contain IUPAC ambiguity codes and reverse primers are written as for the
+pipeline's --reverse-primer. All primers are compiled into one bit-parallel matcher, so
+the start of each read is scanned once no matter how many amplicons there are. A read
+pair is assigned to an amplicon when one read starts with its forward primer and the other
+with its reverse primer, allowing up to max_primer_offset extra bases before the primer.
+An N in a read matches any primer base, otherwise matches are exact. Read pairs that
+match no amplicon, or more than one, are written to unassigned files.
+
+Read pairs are read with record_batches, and the primers are matched against the bytes of
+each read in its batch without building a string for the read.
+"""
+from collections import OrderedDict, namedtuple
+import itertools
+import os
+
+from qc18SV4.checksums import ChecksumFile
+from qc18SV4.compression import open_compressed
+from qc18SV4.exceptions import PipelineException
+from qc18SV4.manifest import RecordCounts
+from qc18SV4.record_batches import RecordBatchWriter, read_records
+
+
+# bit masks of the bases matched by each IUPAC code, a read base matches a primer base if their masks intersect
+iupac_masks = {
+    'A': 1, 'C': 2, 'G': 4, 'T': 8,
+    'R': 1 | 4, 'Y': 2 | 8, 'S': 2 | 4, 'W': 1 | 8, 'K': 4 | 8, 'M': 1 | 2,
+    'B': 2 | 4 | 8, 'D': 1 | 4 | 8, 'H': 1 | 2 | 8, 'V': 1 | 2 | 4, 'N': 1 | 2 | 4 | 8,
+}
+
+iupac_complements = {
+    'A': 'T', 'C': 'G', 'G': 'C', 'T': 'A',
+    'R': 'Y', 'Y': 'R', 'S': 'S', 'W': 'W', 'K': 'M', 'M': 'K',
+    'B': 'V', 'D': 'H', 'H': 'D', 'V': 'B', 'N': 'N',
+}
+
+max_primer_offset = 3
+
+unassigned = 'unassigned'
+
+Amplicon = namedtuple('Amplicon', ['name', 'forward_primer', 'reverse_primer'])
+
+
+def read_primer_table(primer_table_fp):
+    """Read amplicon names and primers from a tab-separated file with a header line.
+
+    :return: list of Amplicon in table order
+    """
+    amplicons = []
+    with open(primer_table_fp, 'rt') as primer_table_file:
+        header = primer_table_file.readline().rstrip('\n').split('\t')
+        if header[:3] != ['amplicon', 'forward_primer', 'reverse_primer']:
+            raise PipelineException(
+                'primer table "{}" must begin with columns amplicon, forward_primer, reverse_primer'.format(
+                    primer_table_fp))
+        for line in primer_table_file:
+            if len(line.strip()) == 0:
+                continue
+            name, forward_primer, reverse_primer = line.rstrip('\n').split('\t')[:3]
+            amplicons.append(
+                Amplicon(name=name, forward_primer=forward_primer.upper(), reverse_primer=reverse_primer.upper()))
+
+    names = [amplicon.name for amplicon in amplicons]
+    if len(names) == 0:
+        raise PipelineException('primer table "{}" has no amplicons'.format(primer_table_fp))
+    elif len(set(names)) < len(names) or unassigned in names:
+        raise PipelineException(
+            'amplicon names in "{}" must be unique and not "{}"'.format(primer_table_fp, unassigned))
+    return amplicons
+
+
+def reverse_complement(primer):
+    return ''.join(iupac_complements[base] for base in reversed(primer))
+
+
+class PrimerMatcher:
+    """Find which of many labelled primers start within max_offset bases of the start of a sequence.
+
+    All primers are compiled into one bit-parallel shift-and automaton: each primer owns a
+    run of bits in a single integer, one bit per primer position, and one pass over the
+    start of a sequence advances every primer at once. Each primer position is a mask of
+    the bases its IUPAC code matches, so degenerate primers are not expanded, and an N in
+    a read matches any primer base.
+    """
+    def __init__(self, labelled_primers, max_offset=max_primer_offset):
+        """
+        :param labelled_primers: iterable of (label, primer with IUPAC codes)
+        :param max_offset: (int) most bases allowed before a primer
+        """
+        self.max_offset = max_offset
+        self.base_masks = {base: 0 for base in iupac_masks}
+        self.start_bits = 0
+        # (bit of the last position of a primer, label)
+        self.end_bits = []
+        self.max_primer_length = 0
+
+        bit = 0
+        for label, primer in labelled_primers:
+            if len(primer) == 0:
+                raise PipelineException('primer for "{}" is empty'.format(label))
+            self.max_primer_length = max(self.max_primer_length, len(primer))
+            self.start_bits |= 1 << bit
+            for primer_base in primer:
+                try:
+                    primer_mask = iupac_masks[primer_base]
+                except KeyError as e:
+                    raise PipelineException(
+                        'primer "{}" has a base that is not an IUPAC code: {}'.format(primer, primer_base)) from e
+                for read_base, read_mask in iupac_masks.items():
+                    if primer_mask & read_mask:
+                        self.base_masks[read_base] |= 1 << bit
+                bit += 1
+            self.end_bits.append((1 << (bit - 1), label))
+        self.end_mask = sum(end_bit for end_bit, _ in self.end_bits)
+        # the bases of a bytes-like sequence are ints
+        self.base_masks.update({ord(base): mask for base, mask in self.base_masks.items()})
+
+    def match(self, sequence):
+        """Return the set of labels of primers starting within max_offset bases of the start of sequence.
+
+        :param sequence: str or bytes-like sequence, such as a memoryview of a RecordBatch
+        """
+        state = 0
+        matched = 0
+        # bits shifted out of the end of one primer must not enter the next primer
+        not_start_bits = ~self.start_bits
+        for position, base in enumerate(sequence[:self.max_primer_length + self.max_offset]):
+            state = (state << 1) & not_start_bits
+            if position <= self.max_offset:
+                state |= self.start_bits
+            state &= self.base_masks.get(base, 0)
+            matched |= state & self.end_mask
+            if state == 0 and position >= self.max_offset:
+                break
+        return {label for end_bit, label in self.end_bits if matched & end_bit}
+
+
+class AmpliconClassifier:
+    """Assign read pairs to amplicons by the primers at the start of both reads.
+
+    Reverse primers are written as for the pipeline's --reverse-primer, so a read from
+    the reverse end of an amplicon starts with the reverse complement of the primer.
+    Read pairs are accepted in either orientation.
+    """
+    def __init__(self, amplicons, max_offset=max_primer_offset):
+        labelled_primers = []
+        for amplicon in amplicons:
+            labelled_primers.append(((amplicon.name, 'forward'), amplicon.forward_primer))
+            labelled_primers.append(((amplicon.name, 'reverse'), reverse_complement(amplicon.reverse_primer)))
+        self.matcher = PrimerMatcher(labelled_primers, max_offset=max_offset)
+
+    def classify(self, forward_sequence, reverse_sequence):
+        """Return the name of the one amplicon whose primers start both reads, or 'unassigned'."""
+        forward_labels = self.matcher.match(forward_sequence)
+        if len(forward_labels) == 0:
+            return unassigned
+        reverse_labels = self.matcher.match(reverse_sequence)
+        names = {
+            name
+            for name, end
+            in forward_labels
+            if (name, 'reverse' if end == 'forward' else 'forward') in reverse_labels
+        }
+        if len(names) == 1:
+            return names.pop()
+        else:
+            return unassigned
+
+
+DemultiplexedFiles = namedtuple('DemultiplexedFiles', ['forward_fp', 'reverse_fp', 'forward_counts', 'reverse_counts'])
+
+
+def demultiplex_read_pairs(
+        forward_fp, reverse_fp, amplicons, output_dp, max_offset=max_primer_offset, file_checksums=None):
+    """Write the read pairs of each amplicon to <output_dp>/<amplicon>/ with the input file names.
+
+    :param file_checksums: dictionary to which the FileChecksums of the output files are added, or None
+    :return: OrderedDict of amplicon name (or 'unassigned') to DemultiplexedFiles
+    """
+    classifier = AmpliconClassifier(amplicons, max_offset=max_offset)
+    names = [amplicon.name for amplicon in amplicons] + [unassigned]
+    output_fps = OrderedDict(
+        (
+            name,
+            (
+                os.path.join(output_dp, name, os.path.basename(forward_fp)),
+                os.path.join(output_dp, name, os.path.basename(reverse_fp))
+            )
+        )
+        for name
+        in names
+    )
+    output_files = []
+    writers = {}
+    checksum_files = []
+    try:
+        for name, (amplicon_forward_fp, amplicon_reverse_fp) in output_fps.items():
+            os.makedirs(os.path.join(output_dp, name), exist_ok=True)
+            amplicon_writers = []
+            for amplicon_fp in (amplicon_forward_fp, amplicon_reverse_fp):
+                checksum_file = ChecksumFile(amplicon_fp, 'wb')
+                checksum_files.append(checksum_file)
+                output_file = open_compressed(amplicon_fp, 'wb', level=1, fileobj=checksum_file)
+                output_files.append(output_file)
+                amplicon_writers.append(RecordBatchWriter(output_file, 'fastq'))
+            writers[name] = amplicon_writers
+
+        for (forward_batch, i), (reverse_batch, j) in zip(
+                read_records(forward_fp, 'fastq'), read_records(reverse_fp, 'fastq')):
+            name = classifier.classify(forward_batch.sequence(i), reverse_batch.sequence(j))
+            forward_writer, reverse_writer = writers[name]
+            # records are copied so a writer that fills slowly does not hold the buffers of many batches
+            forward_writer.write_record_bytes(forward_batch.record(i).tobytes(), forward_batch.sequence_length(i))
+            reverse_writer.write_record_bytes(reverse_batch.record(j).tobytes(), reverse_batch.sequence_length(j))
+        for writer in itertools.chain.from_iterable(writers.values()):
+            writer.flush()
+    finally:
+        for output_file in output_files:
+            output_file.close()
+        for checksum_file in checksum_files:
+            checksum_file.close()
+    if file_checksums is not None:
+        file_checksums.update((checksum_file.name, checksum_file.checksums) for checksum_file in checksum_files)
+
+    return OrderedDict(
+        (
+            name,
+            DemultiplexedFiles(
+                forward_fp=amplicon_forward_fp,
+                reverse_fp=amplicon_reverse_fp,
+                forward_counts=RecordCounts(
+                    record_count=writers[name][0].record_count, base_count=writers[name][0].base_count),
+                reverse_counts=RecordCounts(
+                    record_count=writers[name][1].record_count, base_count=writers[name][1].base_count))
+        )
+        for name, (amplicon_forward_fp, amplicon_reverse_fp)
+        in output_fps.items()
+    )
@@ -0,0 +1,68 @@
+"""
+disk_usage.py
+
+Keep a running total of the bytes a pipeline has written to its work directory and
+the peak of that total. Files are added when they are written and removed when they
+are deleted so no directory scans are needed. Tasks of a step graph running at the same
+time may share one tracker, and each of them can track its own peak.
+"""
+import os
+import threading
+
+
+class DiskUsageTracker:
+    def __init__(self):
+        self.file_sizes = {}
+        self.current_bytes = 0
+        self.peak_bytes = 0
+        self.step_peaks = []
+        self._lock = threading.Lock()
+
+    def add(self, *fp_list):
+        """Record the size of files that have been written or have changed."""
+        sizes = [(fp, os.path.getsize(fp)) for fp in fp_list]
+        with self._lock:
+            for fp, size in sizes:
+                self.current_bytes += size - self.file_sizes.get(fp, 0)
+                self.file_sizes[fp] = size
+            self.peak_bytes = max(self.peak_bytes, self.current_bytes)
+            for step_peak in self.step_peaks:
+                step_peak.peak_bytes = max(step_peak.peak_bytes, self.current_bytes)
+
+    def add_dir(self, dir_path):
+        """Record the size of every file under dir_path, for example FastQC results."""
+        for entry_dir_path, _, file_names in os.walk(dir_path):
+            self.add(*[os.path.join(entry_dir_path, file_name) for file_name in file_names])
+
+    def remove(self, *fp_list):
+        """Forget files that are about to be deleted. Untracked files are ignored."""
+        with self._lock:
+            for fp in fp_list:
+                self.current_bytes -= self.file_sizes.pop(fp, 0)
+
+    def start_step(self):
+        """Begin tracking the peak for a step and return the StepPeak to pass to stop_step.
+
+        Steps running at the same time each have their own StepPeak.
+        """
+        with self._lock:
+            step_peak = StepPeak(self.current_bytes)
+            self.step_peaks.append(step_peak)
+        return step_peak
+
+    def stop_step(self, step_peak):
+        """Stop tracking the peak for a step and return the peak bytes while it ran."""
+        with self._lock:
+            self.step_peaks.remove(step_peak)
+        return step_peak.peak_bytes
+
+
+class StepPeak:
+    def __init__(self, peak_bytes):
+        self.peak_bytes = peak_bytes
+
+
+def write_disk_usage(disk_usage_fp, sample, disk_usage):
+    with open(disk_usage_fp, 'wt') as disk_usage_file:
+        disk_usage_file.write('sample\tpeak_disk_bytes\tfinal_disk_bytes\n')
+        disk_usage_file.write('{}\t{}\t{}\n'.format(sample, disk_usage.peak_bytes, disk_usage.current_bytes))
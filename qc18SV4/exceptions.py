@@ -0,0 +1,10 @@
+"""
+exceptions.py
+
+Exceptions are defined in this module, which has no dependencies, so command line programs
+such as write_launcher_job_file can use them without importing the pipeline's dependencies.
+"""
+
+
+class PipelineException(Exception):
+    pass
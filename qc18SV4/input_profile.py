@@ -0,0 +1,289 @@
+"""
+input_profile.py
+
+Check the input files of a sample, or of every sample in an input directory, before
+any tool runs. Only the first records of each forward and reverse read file are read,
+so a wrong --phred, wrong primers, or a --min-overlap the reads cannot meet stop a
+batch within seconds rather than after Trimmomatic has run on every sample.
+
+From the sampled records the profile infers:
+
+    phred               33 or 64 from the range of quality bytes, or None if the range fits both
+    read lengths        minimum, median, and maximum
+    primer rate         fraction of read pairs starting with the forward and reverse primers, if primers are given
+    overlap             median overlap of the forward read and the reverse complement of the reverse read
+    join rate           fraction of read pairs with an overlap of at least --min-overlap
+
+The quality range is taken over the concatenated quality lines of all sampled records,
+so the minimum and maximum are computed by bytes builtins rather than a Python loop.
+Records are read with record_batches in chunks of sample_chunk_size bytes, so only the
+start of each file is decompressed.
+
+    $ profile_input -i input_dir -p "^(?P<prefix>[a-zA-Z0-9_]+)_L001_R[12]" --phred 33 --min-overlap 20
+"""
+import argparse
+from collections import namedtuple
+import logging
+import statistics
+import sys
+
+from qc18SV4.demultiplex import Amplicon, AmpliconClassifier, reverse_complement, unassigned
+from qc18SV4.exceptions import PipelineException
+from qc18SV4.record_batches import read_record_batches
+from qc18SV4.write_launcher_job_file import get_forward_reverse_read_pairs
+
+
+default_sample_record_count = 1000
+
+# bytes read at a time from each file, enough for the sampled records of most runs in one read
+sample_chunk_size = 2**20
+
+# lowest and highest quality bytes of each encoding, phred 64 includes Solexa scores down to -5
+phred_quality_ranges = {
+    '33': (33, 33 + 41),
+    '64': (64 - 5, 64 + 41),
+}
+
+# overlaps are seeded with k-mers from the end of the forward read, the mismatch rate
+# allows for the low quality ends of untrimmed reads
+overlap_seed_length = 12
+overlap_seed_count = 8
+overlap_max_mismatch_rate = 0.2
+
+min_primer_rate = 0.5
+min_join_rate = 0.5
+
+
+InputProfile = namedtuple(
+    'InputProfile',
+    [
+        'forward_fp', 'reverse_fp', 'pair_count',
+        'min_quality_byte', 'max_quality_byte', 'phred',
+        'min_read_length', 'median_read_length', 'max_read_length',
+        'primer_rate', 'median_overlap', 'overlaps',
+    ])
+
+
+def read_sequences_and_qualities(fastq_fp, record_count, chunk_size=sample_chunk_size):
+    """Return lists of the sequences and quality lines, as bytes, of the first record_count records."""
+    sequences = []
+    qualities = []
+    try:
+        for batch in read_record_batches(fastq_fp, 'fastq', chunk_size=chunk_size):
+            for i in range(min(len(batch), record_count - len(sequences))):
+                sequences.append(batch.sequence(i).tobytes())
+                qualities.append(batch.quality(i).tobytes())
+            if len(sequences) >= record_count:
+                break
+    except PipelineException as e:
+        raise PipelineException('"{}" is not a FASTQ file: {}'.format(fastq_fp, e)) from e
+    return sequences, qualities
+
+
+def infer_phred(min_quality_byte, max_quality_byte):
+    """Return '33' or '64' if only one encoding fits the range of quality bytes, None if both fit.
+
+    :raises PipelineException: if neither encoding fits
+    """
+    fitting_phreds = [
+        phred
+        for phred, (lowest, highest)
+        in sorted(phred_quality_ranges.items())
+        if lowest <= min_quality_byte and max_quality_byte <= highest
+    ]
+    if len(fitting_phreds) == 0:
+        raise PipelineException(
+            'quality bytes {} to {} fit neither phred 33 nor phred 64'.format(min_quality_byte, max_quality_byte))
+    elif len(fitting_phreds) == 1:
+        return fitting_phreds[0]
+    else:
+        return None
+
+
+def get_overlap(forward_sequence, reverse_sequence):
+    """Estimate the overlap of the forward read with the reverse complement of the reverse read.
+
+    A k-mer near the end of the forward read is found in the reverse complement of the
+    reverse read and the implied overlap is accepted if few bases of it mismatch. Several
+    k-mers are tried since the ends of reads often have errors.
+
+    :return: (int) overlap or None if none was found
+    """
+    reverse_complement_sequence = reverse_complement(reverse_sequence)
+    for seed_index in range(overlap_seed_count):
+        seed_end = len(forward_sequence) - seed_index * overlap_seed_length
+        seed = forward_sequence[seed_end - overlap_seed_length:seed_end]
+        if len(seed) < overlap_seed_length or 'N' in seed:
+            continue
+        position = reverse_complement_sequence.find(seed)
+        if position < 0:
+            continue
+        overlap = position + len(forward_sequence) - seed_end + overlap_seed_length
+        if overlap > min(len(forward_sequence), len(reverse_complement_sequence)):
+            continue
+        mismatch_count = sum(
+            f != r
+            for f, r
+            in zip(forward_sequence[len(forward_sequence) - overlap:], reverse_complement_sequence[:overlap]))
+        if mismatch_count <= overlap_max_mismatch_rate * overlap:
+            return overlap
+    return None
+
+
+def profile_read_pair(
+        forward_fp, reverse_fp, forward_primer, reverse_primer, record_count=default_sample_record_count):
+    """Profile the first record_count read pairs of a forward and reverse read file.
+
+    The primer rate is None if either primer is None.
+    """
+    forward_sequences, forward_qualities = read_sequences_and_qualities(forward_fp, record_count)
+    reverse_sequences, reverse_qualities = read_sequences_and_qualities(reverse_fp, record_count)
+    if len(forward_sequences) != len(reverse_sequences):
+        raise PipelineException(
+            'read {} forward reads from "{}" but {} reverse reads from "{}"'.format(
+                len(forward_sequences), forward_fp, len(reverse_sequences), reverse_fp))
+    elif len(forward_sequences) == 0:
+        raise PipelineException('no reads in "{}"'.format(forward_fp))
+
+    all_qualities = b''.join(forward_qualities + reverse_qualities)
+    min_quality_byte = min(all_qualities)
+    max_quality_byte = max(all_qualities)
+
+    read_lengths = sorted(len(sequence) for sequence in forward_sequences + reverse_sequences)
+
+    forward_sequences = [sequence.decode('ascii').upper() for sequence in forward_sequences]
+    reverse_sequences = [sequence.decode('ascii').upper() for sequence in reverse_sequences]
+    if forward_primer is None or reverse_primer is None:
+        primer_rate = None
+    else:
+        classifier = AmpliconClassifier(
+            [Amplicon(name='primers', forward_primer=forward_primer.upper(), reverse_primer=reverse_primer.upper())])
+        primer_rate = sum(
+            classifier.classify(forward_sequence, reverse_sequence) != unassigned
+            for forward_sequence, reverse_sequence
+            in zip(forward_sequences, reverse_sequences)) / len(forward_sequences)
+
+    overlaps = [
+        get_overlap(forward_sequence, reverse_sequence)
+        for forward_sequence, reverse_sequence
+        in zip(forward_sequences, reverse_sequences)
+    ]
+    found_overlaps = [overlap for overlap in overlaps if overlap is not None]
+
+    return InputProfile(
+        forward_fp=forward_fp,
+        reverse_fp=reverse_fp,
+        pair_count=len(forward_sequences),
+        min_quality_byte=min_quality_byte,
+        max_quality_byte=max_quality_byte,
+        phred=infer_phred(min_quality_byte, max_quality_byte),
+        min_read_length=read_lengths[0],
+        median_read_length=statistics.median_low(read_lengths),
+        max_read_length=read_lengths[-1],
+        primer_rate=primer_rate,
+        median_overlap=statistics.median_low(found_overlaps) if len(found_overlaps) > 0 else None,
+        overlaps=overlaps)
+
+
+def get_join_rate(input_profile, min_overlap):
+    """Return the fraction of sampled read pairs with an overlap of at least min_overlap."""
+    return sum(
+        overlap is not None and overlap >= min_overlap
+        for overlap
+        in input_profile.overlaps) / input_profile.pair_count
+
+
+def check_input_profile(input_profile, phred='auto', min_overlap=20, min_read_length=50):
+    """Compare an input profile with the pipeline arguments.
+
+    :param phred: '33', '64', or 'auto'
+    :return: list of problems, empty if the arguments suit the input
+    """
+    problems = []
+    if phred == 'auto':
+        if input_profile.phred is None:
+            problems.append(
+                'phred can not be inferred from quality bytes {} to {}, specify --phred'.format(
+                    input_profile.min_quality_byte, input_profile.max_quality_byte))
+    elif input_profile.phred is not None and input_profile.phred != str(phred):
+        problems.append(
+            '--phred is {} but quality bytes {} to {} are phred {}'.format(
+                phred, input_profile.min_quality_byte, input_profile.max_quality_byte, input_profile.phred))
+
+    if input_profile.median_read_length < min_read_length:
+        problems.append(
+            'median read length {} is less than the minimum length {}'.format(
+                input_profile.median_read_length, min_read_length))
+
+    if input_profile.primer_rate is not None and input_profile.primer_rate < min_primer_rate:
+        problems.append(
+            'only {:.1%} of read pairs start with the forward and reverse primers'.format(input_profile.primer_rate))
+
+    join_rate = get_join_rate(input_profile, min_overlap)
+    if join_rate < min_join_rate:
+        problems.append(
+            'only {:.1%} of read pairs overlap by at least --min-overlap {}, median overlap is {}'.format(
+                join_rate, min_overlap, input_profile.median_overlap))
+
+    return problems
+
+
+def get_args(argv=None):
+    arg_parser = argparse.ArgumentParser(
+        description='check the first reads of each sample in an input directory before running the pipeline')
+    arg_parser.add_argument('-i', '--input-dp', required=True, help='directory of input files')
+    arg_parser.add_argument('--forward-primer', default='CCAGCASCYGCGGTAATTCC', help='forward primer to be clipped')
+    arg_parser.add_argument('--reverse-primer', default='TYRATCAAGAACGAAAGT', help='reverse primer to be clipped')
+    arg_parser.add_argument('--min-overlap', type=int, default=20, help='minimum overlap for joining paired ends')
+    arg_parser.add_argument('--phred', default='auto', help='33, 64, or auto')
+    arg_parser.add_argument('-n', '--record-count', type=int, default=default_sample_record_count, help='number of read pairs to read from each sample')
+    arg_parser.add_argument('--all', action='store_true', default=False, help='check every sample rather than stopping at the first problem')
+    args = arg_parser.parse_args(argv)
+    return args
+
+
+def main():
+    logging.basicConfig(level=logging.INFO)
+    args = get_args()
+
+    print('\t'.join(
+        ('forward_fp', 'pair_count', 'quality_bytes', 'phred', 'read_length', 'primer_rate', 'median_overlap', 'problems')))
+    problem_count = 0
+    phreds = set()
+    for forward_fp, reverse_fp in sorted(get_forward_reverse_read_pairs(args.input_dp)):
+        try:
+            input_profile = profile_read_pair(
+                forward_fp, reverse_fp, args.forward_primer, args.reverse_primer, record_count=args.record_count)
+            problems = check_input_profile(input_profile, phred=args.phred, min_overlap=args.min_overlap)
+        except PipelineException as e:
+            input_profile = None
+            problems = [str(e)]
+
+        if input_profile is None:
+            print('{}\t\t\t\t\t\t\t{}'.format(forward_fp, '; '.join(problems)))
+        else:
+            phreds.add(input_profile.phred)
+            print('\t'.join((
+                forward_fp,
+                str(input_profile.pair_count),
+                '{}-{}'.format(input_profile.min_quality_byte, input_profile.max_quality_byte),
+                str(input_profile.phred),
+                '{}/{}/{}'.format(
+                    input_profile.min_read_length, input_profile.median_read_length, input_profile.max_read_length),
+                '{:.3f}'.format(input_profile.primer_rate),
+                str(input_profile.median_overlap),
+                '; '.join(problems))))
+        if len(problems) > 0:
+            problem_count += 1
+            if not args.all:
+                break
+
+    if args.phred == 'auto' and len(phreds - {None}) > 1:
+        print('samples have different phred encodings, run them in separate batches', file=sys.stderr)
+        problem_count += 1
+    if problem_count > 0:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,624 @@
+"""
+jvm_worker.py
+
+Run TrimmomaticPE and FastQC in long-lived Java worker processes rather than starting a
+new JVM for each command. A sample runs Trimmomatic once and FastQC up to three times,
+so for many small samples most of the time of these tools is JVM start up and JIT warm
+up. A worker loads the tools once and keeps their compiled code for every later sample.
+
+A batch runner starts a pool of workers before its tasks and stops it at the end:
+
+    $ run_job_file -i input_dir -w work-{prefix} -p "^(?P<prefix>[a-zA-Z0-9_]+)_L001_R[12]" -c 4 --jvm-workers 4
+
+The pool writes its files to a worker directory whose path reaches each pipeline in the
+environment variable QC18SV4_JVM_WORKER_DP. For worker i the directory has
+
+    worker-i.endpoint   loopback port and a random token, written by the worker when it is ready
+    worker-i.lock       locked by a pipeline while its command runs in worker i
+    worker-i.log        output of the worker itself
+
+run_cmd sends a TrimmomaticPE or fastqc command to the first worker it can lock and waits
+for its exit status while the tool's output is appended to the step's log. Each worker
+runs one command at a time since System.exit, standard output, and FastQC's settings
+are global to a JVM. The command runs as a subprocess, as without workers, if the
+variable is not set, every worker is busy or not running, or a worker can not load the
+tool. Workers are restarted after max_requests commands to release threads FastQC
+leaves behind, and when they exit for any other reason.
+
+The worker is a small Java class, ToolWorker, compiled with javac into the worker
+directory. It calls the main method of each tool in a new thread group and turns the
+tool's call to System.exit into its exit status with a SecurityManager, so Java 24 and
+later, which can not install one, run the tools as subprocesses. Java tools in workers
+are not restricted to the cores of their task.
+
+A worker replies with the CPU time of its JVM and its peak resident set size during the
+command, which run_java_tool adds to the step metrics of the running step as run_process
+does for a subprocess. The CPU time includes the JVM's own threads, as it does for a
+subprocess, and the peak is reset before each command on Linux.
+"""
+import fcntl
+import glob
+import logging
+import os
+import re
+import shutil
+import socket
+import subprocess
+import threading
+import time
+
+from qc18SV4.exceptions import PipelineException
+from qc18SV4.step_metrics import get_task_usage
+
+
+jvm_worker_env_var = 'QC18SV4_JVM_WORKER_DP'
+
+java_tool_names = ('TrimmomaticPE', 'fastqc')
+
+default_max_requests = 50
+default_java_options = ('-Xmx2g', '-Djava.awt.headless=true')
+
+# options of TrimmomaticPE and fastqc whose values are file or directory paths
+path_options = ('-trimlog', '-summary', '-basein', '-baseout', '--outdir', '-o')
+value_options = ('-threads', '--threads', '-t')
+trimmomatic_step_pattern = re.compile(r'^[A-Z][A-Z0-9]*(:|$)')
+
+tool_worker_class_name = 'ToolWorker'
+
+tool_worker_java_source = r'''
+import java.io.BufferedReader;
+import java.io.File;
+import java.io.FileOutputStream;
+import java.io.FileReader;
+import java.io.IOException;
+import java.io.InputStreamReader;
+import java.io.OutputStreamWriter;
+import java.io.PrintStream;
+import java.io.Writer;
+import java.lang.management.ManagementFactory;
+import java.lang.management.OperatingSystemMXBean;
+import java.lang.reflect.Constructor;
+import java.lang.reflect.Field;
+import java.lang.reflect.InvocationTargetException;
+import java.lang.reflect.Method;
+import java.net.InetAddress;
+import java.net.ServerSocket;
+import java.net.Socket;
+import java.nio.charset.StandardCharsets;
+import java.security.Permission;
+import java.util.ArrayList;
+import java.util.List;
+import java.util.UUID;
+
+/**
+ * Run TrimmomaticPE and FastQC commands sent over a loopback socket in this JVM.
+ *
+ * A request is the token, the log file path, the number of arguments, and the arguments,
+ * one per line. The reply is "fallback" if the command should be run as a subprocess, or
+ * the exit status, the CPU time of the worker during the command in nanoseconds, and the
+ * peak resident set size of the worker during the command in kilobytes, -1 if unknown.
+ */
+public class ToolWorker {
+    static class ExitTrappedException extends SecurityException {
+        ExitTrappedException(int status) {
+            super("System.exit(" + status + ")");
+        }
+    }
+
+    static final Object exitLock = new Object();
+    static volatile ThreadGroup requestThreadGroup = null;
+    static volatile Integer exitStatus = null;
+    static volatile boolean exiting = false;
+
+    static boolean inRequestThreadGroup() {
+        ThreadGroup requestGroup = requestThreadGroup;
+        for (ThreadGroup group = Thread.currentThread().getThreadGroup(); group != null; group = group.getParent()) {
+            if (group == requestGroup) {
+                return true;
+            }
+        }
+        return false;
+    }
+
+    public static void main(String[] args) throws Exception {
+        File endpointFile = new File(args[0]);
+        int maxRequests = Integer.parseInt(args[1]);
+        String token = UUID.randomUUID().toString();
+
+        // tools call System.exit when they are done, which must end the request rather than the worker
+        System.setSecurityManager(new SecurityManager() {
+            @Override
+            public void checkPermission(Permission permission) {
+            }
+
+            @Override
+            public void checkPermission(Permission permission, Object context) {
+            }
+
+            @Override
+            public void checkExit(int status) {
+                if (exiting) {
+                    return;
+                }
+                // threads left running by an earlier request do not end the current one
+                if (inRequestThreadGroup()) {
+                    synchronized (exitLock) {
+                        if (exitStatus == null) {
+                            exitStatus = status;
+                        }
+                        exitLock.notifyAll();
+                    }
+                }
+                throw new ExitTrappedException(status);
+            }
+        });
+
+        ServerSocket server = new ServerSocket(0, 50, InetAddress.getLoopbackAddress());
+        File temporaryEndpointFile = new File(endpointFile.getPath() + ".tmp");
+        try (Writer writer = new OutputStreamWriter(new FileOutputStream(temporaryEndpointFile), StandardCharsets.UTF_8)) {
+            writer.write(server.getLocalPort() + " " + token + "\n");
+        }
+        if (!temporaryEndpointFile.renameTo(endpointFile)) {
+            throw new IllegalStateException("failed to write " + endpointFile);
+        }
+
+        PrintStream workerOut = System.out;
+        PrintStream workerErr = System.err;
+        int requestCount = 0;
+        boolean shutdown = false;
+        while (!shutdown && requestCount < maxRequests) {
+            try (Socket socket = server.accept()) {
+                BufferedReader reader = new BufferedReader(
+                    new InputStreamReader(socket.getInputStream(), StandardCharsets.UTF_8));
+                Writer writer = new OutputStreamWriter(socket.getOutputStream(), StandardCharsets.UTF_8);
+                if (!token.equals(reader.readLine())) {
+                    continue;
+                }
+                String logPath = reader.readLine();
+                int argCount = Integer.parseInt(reader.readLine());
+                List<String> command = new ArrayList<>();
+                for (int i = 0; i < argCount; i++) {
+                    command.add(reader.readLine());
+                }
+
+                String reply;
+                if (command.get(0).equals("shutdown")) {
+                    reply = "0";
+                    shutdown = true;
+                } else {
+                    requestCount++;
+                    long startCpuNanos = processCpuNanos();
+                    resetPeakMemory();
+                    try (PrintStream log = new PrintStream(new FileOutputStream(logPath, true), true, "UTF-8")) {
+                        System.setOut(log);
+                        System.setErr(log);
+                        try {
+                            reply = runTool(command);
+                        } catch (Throwable t) {
+                            t.printStackTrace(log);
+                            reply = "1";
+                        } finally {
+                            System.setOut(workerOut);
+                            System.setErr(workerErr);
+                        }
+                    }
+                    if (!reply.equals("fallback")) {
+                        long cpuNanos = startCpuNanos < 0 ? -1 : processCpuNanos() - startCpuNanos;
+                        reply = reply + " " + cpuNanos + " " + peakMemoryKilobytes();
+                    }
+                }
+                workerOut.println(command + " " + reply);
+                writer.write(reply + "\n");
+                writer.flush();
+            } catch (Exception e) {
+                e.printStackTrace(workerErr);
+            }
+        }
+        endpointFile.delete();
+        exiting = true;
+        System.exit(0);
+    }
+
+    /** Return the CPU time of this JVM in nanoseconds, which runs one command at a time, or -1. */
+    static long processCpuNanos() {
+        OperatingSystemMXBean bean = ManagementFactory.getOperatingSystemMXBean();
+        if (bean instanceof com.sun.management.OperatingSystemMXBean) {
+            return ((com.sun.management.OperatingSystemMXBean) bean).getProcessCpuTime();
+        }
+        return -1;
+    }
+
+    /** Reset the peak resident set size of this JVM on Linux, otherwise it stays the peak of every command. */
+    static void resetPeakMemory() {
+        try (FileOutputStream clearRefs = new FileOutputStream("/proc/self/clear_refs")) {
+            clearRefs.write("5".getBytes(StandardCharsets.US_ASCII));
+        } catch (IOException e) {
+        }
+    }
+
+    /** Return the peak resident set size of this JVM in kilobytes, or -1. */
+    static long peakMemoryKilobytes() {
+        try (BufferedReader status = new BufferedReader(new FileReader("/proc/self/status"))) {
+            for (String line = status.readLine(); line != null; line = status.readLine()) {
+                if (line.startsWith("VmHWM:")) {
+                    return Long.parseLong(line.replaceAll("[^0-9]", ""));
+                }
+            }
+        } catch (IOException | NumberFormatException e) {
+        }
+        return -1;
+    }
+
+    static String runTool(List<String> command) throws Exception {
+        String toolName = new File(command.get(0)).getName();
+        String[] toolArgs = command.subList(1, command.size()).toArray(new String[0]);
+        if (toolName.equals("TrimmomaticPE")) {
+            Method main = getMain("org.usadellab.trimmomatic.TrimmomaticPE");
+            return main == null ? "fallback" : String.valueOf(runMain(main, toolArgs));
+        } else if (toolName.equals("fastqc")) {
+            return runFastQC(toolArgs);
+        } else {
+            return "fallback";
+        }
+    }
+
+    static Method getMain(String className) {
+        try {
+            return Class.forName(className).getMethod("main", String[].class);
+        } catch (ReflectiveOperationException | LinkageError e) {
+            return null;
+        }
+    }
+
+    /** Run FastQC as the fastqc script would, which passes its options as system properties. */
+    static String runFastQC(String[] args) throws Exception {
+        List<String> files = new ArrayList<>();
+        for (int i = 0; i < args.length; i++) {
+            if (args[i].equals("--threads") || args[i].equals("-t")) {
+                System.setProperty("fastqc.threads", args[++i]);
+            } else if (args[i].equals("--outdir") || args[i].equals("-o")) {
+                System.setProperty("fastqc.output_dir", args[++i]);
+            } else if (args[i].equals("--quiet") || args[i].equals("-q")) {
+                System.setProperty("fastqc.quiet", "true");
+            } else if (args[i].startsWith("-")) {
+                return "fallback";
+            } else {
+                files.add(args[i]);
+            }
+        }
+        Method main = getMain("uk.ac.babraham.FastQC.FastQCApplication");
+        if (main == null || !resetFastQCConfig()) {
+            return "fallback";
+        }
+        return String.valueOf(runMain(main, files.toArray(new String[0])));
+    }
+
+    /** FastQCConfig reads the fastqc system properties once, so each run gets a new instance. */
+    static boolean resetFastQCConfig() {
+        try {
+            Class<?> configClass = Class.forName("uk.ac.babraham.FastQC.FastQCConfig");
+            Constructor<?> constructor = configClass.getDeclaredConstructor();
+            constructor.setAccessible(true);
+            Field instanceField = configClass.getDeclaredField("instance");
+            instanceField.setAccessible(true);
+            instanceField.set(null, constructor.newInstance());
+            return true;
+        } catch (ReflectiveOperationException | RuntimeException | LinkageError e) {
+            return false;
+        }
+    }
+
+    /** Run a main method in a new thread group until it returns or calls System.exit, return the exit status. */
+    static int runMain(final Method main, final String[] args) throws InterruptedException {
+        final ThreadGroup threadGroup = new ThreadGroup("request");
+        final Throwable[] failure = new Throwable[1];
+        Thread thread = new Thread(threadGroup, () -> {
+            try {
+                main.invoke(null, (Object) args);
+            } catch (InvocationTargetException e) {
+                if (!(e.getCause() instanceof ExitTrappedException)) {
+                    failure[0] = e.getCause();
+                }
+            } catch (IllegalAccessException e) {
+                failure[0] = e;
+            }
+        }, "tool");
+        thread.setDaemon(true);
+        synchronized (exitLock) {
+            exitStatus = null;
+            requestThreadGroup = threadGroup;
+        }
+        thread.start();
+        synchronized (exitLock) {
+            // FastQC calls System.exit from an analysis thread while its main thread waits
+            while (exitStatus == null && thread.isAlive()) {
+                exitLock.wait(100);
+            }
+            requestThreadGroup = null;
+            if (exitStatus != null) {
+                return exitStatus;
+            }
+        }
+        if (failure[0] != null) {
+            failure[0].printStackTrace();
+            return 1;
+        }
+        return 0;
+    }
+}
+'''
+
+
+def get_worker_args(cmd_line_list):
+    """Return a TrimmomaticPE or fastqc command line with relative paths made absolute.
+
+    The worker does not share the working directory of the pipeline, so paths given as
+    arguments, as values of path options, and in Trimmomatic's ILLUMINACLIP step are
+    made absolute. Trimmomatic steps and option values are kept as they are.
+    """
+    worker_args = [str(cmd_line_list[0])]
+    args = [str(arg) for arg in cmd_line_list[1:]]
+    for previous_arg, arg in zip([None] + args[:-1], args):
+        if previous_arg in path_options:
+            worker_args.append(os.path.abspath(arg))
+        elif previous_arg in value_options or arg.startswith('-'):
+            worker_args.append(arg)
+        elif arg.startswith('ILLUMINACLIP:'):
+            step_name, adapter_fp, step_settings = arg.split(':', 2)
+            worker_args.append(':'.join((step_name, os.path.abspath(adapter_fp), step_settings)))
+        elif trimmomatic_step_pattern.match(arg):
+            worker_args.append(arg)
+        else:
+            worker_args.append(os.path.abspath(arg))
+    return worker_args
+
+
+def get_worker_fps(worker_dp, worker_index):
+    """Return the endpoint, lock, and log file paths of a worker."""
+    worker_fp_prefix = os.path.join(worker_dp, 'worker-{}'.format(worker_index))
+    return worker_fp_prefix + '.endpoint', worker_fp_prefix + '.lock', worker_fp_prefix + '.log'
+
+
+def send_request(endpoint_fp, lines, connect_timeout=5.0):
+    """Send a request to the worker of an endpoint file and return its reply.
+
+    :raises OSError: if the worker is not running
+    """
+    with open(endpoint_fp, 'rt') as endpoint_file:
+        port, token = endpoint_file.read().split()
+    with socket.create_connection(('127.0.0.1', int(port)), timeout=connect_timeout) as worker_socket:
+        # tools may run for hours
+        worker_socket.settimeout(None)
+        request = '\n'.join([token] + [str(line) for line in lines]) + '\n'
+        worker_socket.sendall(request.encode('utf-8'))
+        with worker_socket.makefile('r', encoding='utf-8') as reply_file:
+            reply = reply_file.readline().strip()
+    if len(reply) == 0:
+        raise ConnectionError('no reply from worker "{}"'.format(endpoint_fp))
+    return reply
+
+
+def run_java_tool(cmd_line_list, log_fp, worker_dp=None):
+    """Run a TrimmomaticPE or fastqc command in a free JVM worker.
+
+    :param worker_dp: worker directory, default is the value of QC18SV4_JVM_WORKER_DP
+    :return: subprocess.CompletedProcess, or None if the command should be run as a subprocess
+    """
+    log = logging.getLogger(name=__name__)
+    if worker_dp is None:
+        worker_dp = os.environ.get(jvm_worker_env_var)
+    if not worker_dp or os.path.basename(str(cmd_line_list[0])) not in java_tool_names:
+        return None
+
+    worker_args = get_worker_args(cmd_line_list)
+    for endpoint_fp in sorted(glob.glob(os.path.join(worker_dp, 'worker-*.endpoint'))):
+        lock_fp = endpoint_fp[:-len('.endpoint')] + '.lock'
+        with open(lock_fp, 'a') as lock_file:
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                # another pipeline is using this worker
+                continue
+            try:
+                reply = send_request(endpoint_fp, [os.path.abspath(log_fp), len(worker_args)] + worker_args)
+            except (OSError, ValueError) as e:
+                log.warning('JVM worker "%s" is not available: %s', endpoint_fp, e)
+                continue
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+        if reply == 'fallback':
+            log.info('JVM worker "%s" can not run %s', endpoint_fp, cmd_line_list[0])
+            return None
+        status, *usage = reply.split()
+        log.info('ran %s in JVM worker "%s" with exit status %s', cmd_line_list[0], endpoint_fp, status)
+        add_worker_usage(cmd_line_list[0], *usage)
+        return subprocess.CompletedProcess(args=cmd_line_list, returncode=int(status))
+
+    log.info('no JVM worker is free for %s', cmd_line_list[0])
+    return None
+
+
+def add_worker_usage(tool_name, cpu_nanoseconds=-1, peak_memory_kilobytes=-1):
+    """Add the CPU time and peak memory a worker reported for a command to the step running in this thread.
+
+    run_process can not measure a command run in a worker, so the worker measures itself.
+    """
+    task_usage = get_task_usage()
+    if task_usage is None:
+        return
+    cpu_nanoseconds = int(cpu_nanoseconds)
+    peak_memory_kilobytes = int(peak_memory_kilobytes)
+    if cpu_nanoseconds < 0:
+        logging.getLogger(name=__name__).warning(
+            'the JVM worker did not report the CPU time of %s, it is not in the step metrics', tool_name)
+    task_usage.add(
+        cpu_seconds=max(0, cpu_nanoseconds) / 1e9,
+        peak_memory_bytes=1024 * max(0, peak_memory_kilobytes))
+
+
+def get_java_major_version(java='java'):
+    """Return the major version of a java executable, for example 8 for 1.8.0_292 and 17 for 17.0.2."""
+    output = subprocess.run(
+        [java, '-version'], stdout=subprocess.PIPE, stderr=subprocess.STDOUT, universal_newlines=True).stdout
+    m = re.search(r'version "(?P<version>[^"]+)"', output)
+    if m is None:
+        raise PipelineException('failed to find the version of "{}" in:\n{}'.format(java, output))
+    version_parts = m.group('version').split('.')
+    if version_parts[0] == '1' and len(version_parts) > 1:
+        return int(version_parts[1])
+    else:
+        return int(re.match(r'\d+', version_parts[0]).group())
+
+
+def find_trimmomatic_classpath():
+    """Return the Trimmomatic jar named by the TrimmomaticPE script on PATH, or of the Debian package."""
+    trimmomatic_fp = shutil.which('TrimmomaticPE')
+    if trimmomatic_fp is not None:
+        try:
+            with open(trimmomatic_fp, 'rt') as trimmomatic_file:
+                m = re.search(r'(\S+trimmomatic\S*\.jar)', trimmomatic_file.read(), flags=re.IGNORECASE)
+            if m is not None:
+                return [m.group(1)]
+        except (OSError, UnicodeDecodeError):
+            pass
+    return ['/usr/share/java/trimmomatic.jar']
+
+
+def find_fastqc_classpath():
+    """Return the FastQC directory and its jars, as the fastqc script builds its classpath."""
+    fastqc_fp = shutil.which('fastqc')
+    if fastqc_fp is None:
+        return []
+    fastqc_dp = os.path.dirname(os.path.realpath(fastqc_fp))
+    return [fastqc_dp] + sorted(glob.glob(os.path.join(fastqc_dp, '*.jar')))
+
+
+class JvmWorkerPool:
+    """Start JVM workers in a worker directory and restart them when they exit.
+
+    :param classpath: Trimmomatic and FastQC classpath, default is found from the tools on PATH
+    """
+    def __init__(
+            self, worker_dp, worker_count,
+            classpath=None, java='java', java_options=default_java_options,
+            max_requests=default_max_requests, start_timeout=60.0, poll_seconds=1.0):
+        self.worker_dp = worker_dp
+        self.worker_count = worker_count
+        if classpath is None:
+            classpath = find_trimmomatic_classpath() + find_fastqc_classpath()
+        self.classpath = [worker_dp] + list(classpath)
+        self.java = java
+        self.java_options = list(java_options)
+        self.max_requests = max_requests
+        self.start_timeout = start_timeout
+        self.poll_seconds = poll_seconds
+        self.processes = {}
+        self._stop_event = threading.Event()
+        self._monitor_thread = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.stop()
+
+    def compile_worker(self):
+        javac = shutil.which('javac')
+        if javac is None:
+            raise PipelineException('javac is needed to compile the JVM worker')
+        source_fp = os.path.join(self.worker_dp, tool_worker_class_name + '.java')
+        with open(source_fp, 'wt') as source_file:
+            source_file.write(tool_worker_java_source)
+        subprocess.run(
+            [javac, '-d', self.worker_dp, source_fp],
+            check=True, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, universal_newlines=True)
+
+    def start_worker(self, worker_index):
+        endpoint_fp, lock_fp, log_fp = get_worker_fps(self.worker_dp, worker_index)
+        if os.path.exists(endpoint_fp):
+            os.remove(endpoint_fp)
+        with open(log_fp, 'at') as log_file:
+            self.processes[worker_index] = subprocess.Popen(
+                [
+                    self.java,
+                    *self.java_options,
+                    '-cp', os.pathsep.join(self.classpath),
+                    tool_worker_class_name,
+                    endpoint_fp,
+                    str(self.max_requests)
+                ],
+                stdout=log_file,
+                stderr=subprocess.STDOUT)
+
+    def start(self):
+        """Compile and start the workers.
+
+        :return: number of workers that started, 0 if Java tools will run as subprocesses
+        """
+        log = logging.getLogger(name=self.__class__.__name__)
+        os.makedirs(self.worker_dp, exist_ok=True)
+        try:
+            # Java 18 to 23 install a SecurityManager only when allowed, Java 8 and 11 reject the option
+            if get_java_major_version(self.java) >= 12:
+                self.java_options.append('-Djava.security.manager=allow')
+            self.compile_worker()
+        except (OSError, subprocess.CalledProcessError, PipelineException) as e:
+            log.warning('JVM workers are not available, Java tools will run as subprocesses: %s', e)
+            return 0
+
+        for worker_index in range(self.worker_count):
+            self.start_worker(worker_index)
+        start_time = time.time()
+        started_worker_count = 0
+        while time.time() - start_time < self.start_timeout:
+            started_worker_count = sum(
+                os.path.exists(get_worker_fps(self.worker_dp, worker_index)[0])
+                for worker_index
+                in self.processes)
+            exited_worker_count = sum(process.poll() is not None for process in self.processes.values())
+            if started_worker_count + exited_worker_count >= self.worker_count:
+                break
+            time.sleep(0.1)
+        if started_worker_count == 0:
+            log.warning(
+                'no JVM worker started, Java tools will run as subprocesses, see "%s"',
+                get_worker_fps(self.worker_dp, 0)[2])
+            self.stop()
+            return 0
+
+        log.info('started %d JVM workers in "%s"', started_worker_count, self.worker_dp)
+        self._stop_event.clear()
+        self._monitor_thread = threading.Thread(target=self.monitor, daemon=True)
+        self._monitor_thread.start()
+        return started_worker_count
+
+    def monitor(self):
+        while not self._stop_event.wait(self.poll_seconds):
+            self.restart_exited_workers()
+
+    def restart_exited_workers(self):
+        """Restart workers that exited after max_requests commands or for any other reason."""
+        for worker_index, process in list(self.processes.items()):
+            if process.poll() is not None:
+                logging.getLogger(name=self.__class__.__name__).info(
+                    'restarting JVM worker %d, it exited with status %d', worker_index, process.returncode)
+                self.start_worker(worker_index)
+
+    def stop(self):
+        self._stop_event.set()
+        if self._monitor_thread is not None:
+            self._monitor_thread.join()
+            self._monitor_thread = None
+        for worker_index, process in self.processes.items():
+            if process.poll() is None:
+                process.terminate()
+                try:
+                    process.wait(timeout=10.0)
+                except subprocess.TimeoutExpired:
+                    process.kill()
+                    process.wait()
+            endpoint_fp = get_worker_fps(self.worker_dp, worker_index)[0]
+            if os.path.exists(endpoint_fp):
+                os.remove(endpoint_fp)
+        self.processes = {}
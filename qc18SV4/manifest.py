@@ -0,0 +1,225 @@
+"""
+manifest.py
+
+Each pipeline step returns a StepManifest listing exactly the files it produced.
+The next step reads its inputs from that manifest so no directory scans are
+needed to hand off files between steps.
+"""
+from collections import namedtuple
+import os
+
+from qc18SV4.checksums import ChecksumFile
+from qc18SV4.compression import is_compressed_file_name, open_compressed, strip_compression_extension
+
+
+class OutputFile(namedtuple('OutputFile', ['role', 'fp', 'size', 'record_count', 'base_count', 'checksums'])):
+    """One file produced by a pipeline step.
+
+    role         -- name of the file's purpose within its step, e.g. 'forward_paired' or 'joined'
+    fp           -- path to the file
+    size         -- size of the file in bytes
+    record_count -- number of FASTA or FASTQ records in the file
+    base_count   -- number of sequence bases in the file
+    checksums    -- FileChecksums of the file, or None if it was not hashed
+    """
+    __slots__ = ()
+
+    @property
+    def compressed(self):
+        return is_compressed_file_name(self.fp)
+
+    @property
+    def is_fastq(self):
+        return get_file_format(self.fp) == 'fastq'
+
+
+class StepManifest:
+    def __init__(self, step_name, output_dir, output_files=(), disk_usage=None, file_checksums=None):
+        self.step_name = step_name
+        self.output_dir = output_dir
+        self.output_files = list(output_files)
+        # a DiskUsageTracker or None
+        self.disk_usage = disk_usage
+        # a dictionary of file path to FileChecksums computed while files were written, or None to not hash files
+        self.file_checksums = file_checksums
+        # RecordCounts of the read pairs the step read, set by steps that count them while reading
+        self.input_counts = None
+
+    def __repr__(self):
+        return 'StepManifest(step_name={!r}, output_dir={!r}, output_files={!r})'.format(
+            self.step_name, self.output_dir, self.output_files)
+
+    def __iter__(self):
+        return iter(self.output_files)
+
+    def __len__(self):
+        return len(self.output_files)
+
+    def add(self, role, fp, counts=None):
+        """Describe a file and add it to the manifest.
+
+        If counts are not known they are counted here which requires reading the file.
+        Steps that write a file in Python should count records while they write. Checksums
+        are taken from file_checksums, or computed while the file is counted.
+
+        :param role: (str) purpose of the file within its step
+        :param fp: (str) path to the file
+        :param counts: (RecordCounts) numbers of records and bases in the file, or None
+        :return: the new OutputFile
+        """
+        checksums = None if self.file_checksums is None else self.file_checksums.get(fp)
+        if counts is None and self.file_checksums is not None and checksums is None:
+            counts, checksums = count_records_and_checksums(fp)
+            self.file_checksums[fp] = checksums
+        elif counts is None:
+            counts = count_records(fp)
+        if counts is None:
+            counts = RecordCounts(record_count=None, base_count=None)
+        output_file = OutputFile(
+            role=role,
+            fp=fp,
+            size=os.path.getsize(fp),
+            record_count=counts.record_count,
+            base_count=counts.base_count,
+            checksums=checksums)
+        self.output_files.append(output_file)
+        if self.disk_usage is not None:
+            self.disk_usage.add(fp)
+        return output_file
+
+    def remove(self, *fp_list):
+        """Drop entries for files that have been deleted."""
+        removed = set(fp_list)
+        self.output_files = [f for f in self.output_files if f.fp not in removed]
+
+    def files_for(self, role, compressed=None):
+        return [
+            f
+            for f
+            in self.output_files
+            if f.role == role and (compressed is None or f.compressed == compressed)
+        ]
+
+    def file_for(self, role, compressed=None):
+        output_files = self.files_for(role, compressed=compressed)
+        if len(output_files) != 1:
+            raise ManifestException(
+                'expected one {}file with role "{}" in manifest for "{}" but found {}'.format(
+                    '' if compressed is None else ('compressed ' if compressed else 'uncompressed '),
+                    role,
+                    self.step_name,
+                    len(output_files)))
+        return output_files[0]
+
+    def fasta_fastq_files(self):
+        return [f for f in self.output_files if get_file_format(f.fp) in ('fasta', 'fastq')]
+
+
+class ManifestException(Exception):
+    pass
+
+
+def get_file_format(fp):
+    """Return 'fasta', 'fastq' or None based on the file name, ignoring a trailing .gz or .zst."""
+    fp = strip_compression_extension(fp)
+    if fp.endswith('.fastq'):
+        return 'fastq'
+    elif fp.endswith('.fasta'):
+        return 'fasta'
+    else:
+        return None
+
+
+RecordCounts = namedtuple('RecordCounts', ['record_count', 'base_count'])
+
+
+class RecordCounter:
+    """Count FASTA or FASTQ records and bases in a stream of bytes fed in chunks of any size.
+
+    FASTQ records are four lines and the second line is the sequence. FASTA records begin
+    with a line starting with '>' followed by one or more sequence lines.
+    """
+    def __init__(self, file_format):
+        self.file_format = file_format
+        self.line_count = 0
+        self.header_count = 0
+        self.sequence_base_count = 0
+        # the last line of the stream so far, which may continue in the next chunk
+        self.partial_line = b''
+
+    def update(self, chunk):
+        lines = (self.partial_line + chunk).split(b'\n')
+        self.partial_line = lines.pop()
+        self._count_lines(lines)
+
+    def finish(self):
+        """Count a final line with no newline. This can be called more than once."""
+        if len(self.partial_line) > 0:
+            self._count_lines([self.partial_line])
+            self.partial_line = b''
+
+    def _count_lines(self, lines):
+        if self.file_format == 'fastq':
+            # index of the first sequence line in lines
+            first_sequence_line = (1 - self.line_count) % 4
+            self.sequence_base_count += sum(map(len, lines[first_sequence_line::4]))
+        elif self.file_format == 'fasta':
+            header_lines = [line for line in lines if line.startswith(b'>')]
+            self.header_count += len(header_lines)
+            self.sequence_base_count += sum(map(len, lines)) - sum(map(len, header_lines))
+        self.line_count += len(lines)
+
+    @property
+    def record_count(self):
+        self.finish()
+        if self.file_format == 'fastq':
+            return self.line_count // 4
+        elif self.file_format == 'fasta':
+            return self.header_count
+        else:
+            return None
+
+    @property
+    def base_count(self):
+        self.finish()
+        if self.file_format in ('fasta', 'fastq'):
+            return self.sequence_base_count
+        else:
+            return None
+
+    @property
+    def counts(self):
+        return RecordCounts(record_count=self.record_count, base_count=self.base_count)
+
+
+def count_records(fp, chunk_size=2**20):
+    """Count records and bases in a FASTA or FASTQ file, compressed or not.
+
+    :return: RecordCounts, or None for files that are neither FASTA nor FASTQ
+    """
+    file_format = get_file_format(fp)
+    if file_format is None:
+        return None
+    counter = RecordCounter(file_format)
+    with open_compressed(fp, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            counter.update(chunk)
+    return counter.counts
+
+
+def count_records_and_checksums(fp, chunk_size=2**20):
+    """Count records and bases as count_records and compute checksums of the file in the same pass.
+
+    :return: (RecordCounts or None, FileChecksums)
+    """
+    counter = RecordCounter(get_file_format(fp))
+    with ChecksumFile(fp, 'rb') as checksum_file:
+        if counter.file_format is None:
+            checksum_file.read_to_end(chunk_size=chunk_size)
+        else:
+            with open_compressed(fp, 'rb', fileobj=checksum_file) as f:
+                for chunk in iter(lambda: f.read(chunk_size), b''):
+                    counter.update(chunk)
+                # the gzip and zstd readers may stop before the end of the file
+                checksum_file.read_to_end(chunk_size=chunk_size)
+    return (None if counter.file_format is None else counter.counts), checksum_file.checksums
@@ -17,18 +17,43 @@ All output will be written to directory work-dp.
 
 """
 import argparse
-import glob
+from collections import OrderedDict
 import gzip
 import logging
 import os
 import re
 import subprocess
 import sys
+import time
 import traceback
 
-from Bio import SeqIO
-
-from qc18SV4.pipeline_util import delete_files, gzip_files, ungzip_files
+from qc18SV4.checksums import ChecksumFile, write_checksums
+from qc18SV4.compression import CompressionPolicy, get_compression, strip_compression_extension
+from qc18SV4.demultiplex import demultiplex_read_pairs, read_primer_table, unassigned
+from qc18SV4.disk_usage import DiskUsageTracker, write_disk_usage
+from qc18SV4.exceptions import PipelineException
+from qc18SV4.input_profile import check_input_profile, profile_read_pair
+from qc18SV4.jvm_worker import run_java_tool
+from qc18SV4.manifest import RecordCounts, StepManifest
+from qc18SV4.pipeline_util import compress_and_count_files, decompress_files, delete_files, map_files
+from qc18SV4.read_counts import (
+    StepReadCounts, get_input_read_counts, get_output_file_counts, get_read_pair_counts, get_surviving_read_counts,
+    read_counts_file_name, sum_counts, write_read_counts)
+from qc18SV4.record_batches import RecordBatchWriter, read_record_batches
+from qc18SV4.step_graph import StepGraph, StepRoles
+from qc18SV4.step_metrics import StepMetrics, fastqc_task_suffix, run_process, write_step_metrics
+from qc18SV4.subsample import default_seed, subsample_read_pairs
+from qc18SV4.thread_tuning import ThreadCounts, check_step_metrics, choose_thread_counts
+from qc18SV4.trace import get_tracer, is_tracing_requested, span, start_tracing, stop_tracing, trace_file_name
+
+
+# roles of intermediate files that --keep-roles can keep when disk use is minimized,
+# the later steps delete the uncompressed copies of the other roles
+keepable_roles = (
+    'subsampled_forward', 'subsampled_reverse',
+    'forward_paired', 'forward_unpaired', 'reverse_paired', 'reverse_unpaired',
+    'joined', 'unjoined_forward', 'unjoined_reverse',
+)
 
 
 def main():
@@ -46,15 +71,24 @@ def get_args():
     arg_parser.add_argument('--forward-primer', default='CCAGCASCYGCGGTAATTCC', help='forward primer to be clipped')
     arg_parser.add_argument('--reverse-primer', default='TYRATCAAGAACGAAAGT', help='reverse primer to be clipped')
     arg_parser.add_argument('--min-overlap', type=int, default=20, help='minimum overlap for joining paired ends')
-    arg_parser.add_argument('--phred', default='33', help='33 or 64')
+    arg_parser.add_argument('--phred', default='33', help='33, 64, or auto to infer it from the first reads')
+    arg_parser.add_argument('--check-input', action='store_true', help='check phred, read length, primers, and overlap on the first reads and stop if they do not suit the arguments')
+    arg_parser.add_argument('--auto-tune-threads', action='store_true', help='choose thread counts for each tool from the input size, using at most CORE_COUNT cores')
+    arg_parser.add_argument('--profile', action='store_true', help='profile each step and write .pstats and .collapsed files to the work directory')
+    arg_parser.add_argument('--write-read-table', action='store_true', help='write final reads and their quality to a Parquet file (requires pyarrow)')
+    arg_parser.add_argument('--minimize-disk', action='store_true', help='delete intermediate files as soon as no later step needs them')
+    arg_parser.add_argument('--keep-roles', nargs='+', default=(), choices=keepable_roles, help='roles of intermediate files to keep with --minimize-disk, for example unjoined_forward unjoined_reverse')
+    arg_parser.add_argument('--intermediate-compression', choices=('gzip', 'zstd'), default='gzip', help='compression of files read by a later step, zstd requires zstandard')
+    arg_parser.add_argument('--intermediate-compression-level', type=int, default=None, help='compression level of files read by a later step, default is 1 for gzip and 3 for zstd')
+    arg_parser.add_argument('--output-compression-level', type=int, default=9, help='gzip compression level of files kept as results')
+    arg_parser.add_argument('--trace', action='store_true', help='write begin and end times of steps, tools, and compression to {} in the work directory'.format(trace_file_name))
+    arg_parser.add_argument('--primer-table', default=None, help='tab-separated file of amplicon, forward_primer, reverse_primer to split reads by amplicon and process each amplicon separately')
+    arg_parser.add_argument('--max-read-pairs', type=int, default=None, help='randomly choose at most this many read pairs before the first step')
+    arg_parser.add_argument('--subsample-seed', type=int, default=default_seed, help='random seed for choosing read pairs, used with --max-read-pairs')
     args = arg_parser.parse_args()
     return args
 
 
-class PipelineException(Exception):
-    pass
-
-
 class Pipeline:
     def __init__(
             self,
@@ -65,7 +99,23 @@ class Pipeline:
             work_dp,
             core_count=1,
             trimmomatic_minlen=50,
-            min_overlap=20):
+            min_overlap=20,
+            auto_tune_threads=False,
+            profile=False,
+            write_read_table=False,
+            minimize_disk=False,
+            keep_roles=(),
+            intermediate_compression='gzip',
+            intermediate_compression_level=None,
+            output_compression_level=9,
+            primer_table=None,
+            check_input=False,
+            trace=False,
+            max_read_pairs=None,
+            subsample_seed=default_seed,
+            input_counts=None,
+            prefix=None,
+            sample_input_bytes=None):
 
         log = logging.getLogger(name=self.__class__.__name__)
 
@@ -79,70 +129,692 @@ class Pipeline:
         self.core_count = core_count
 
         self.trimmomatic_minlen = trimmomatic_minlen
-
-        self.prefix = self.get_reads_filename_prefix(forward_reads_fp)
+        self.auto_tune_threads = auto_tune_threads
+        self.write_read_table = write_read_table
+        self.check_input = check_input
+        self.max_read_pairs = max_read_pairs
+        self.subsample_seed = subsample_seed
+        # RecordCounts of the input read pairs if they were counted before the pipeline was created
+        self.input_counts = input_counts
+        # bytes of the sample's input files recorded with the step metrics, see run_pipeline
+        self.sample_input_bytes = sample_input_bytes
+        self.trace = trace or is_tracing_requested()
+        self.minimize_disk = minimize_disk
+        # output files of these roles are kept when intermediate files are deleted
+        self.kept_roles = self.final_roles + tuple(role for role in keep_roles if role not in self.final_roles)
+        self.disk_usage = DiskUsageTracker()
+        self.compression_policy = CompressionPolicy.create(
+            intermediate_format=intermediate_compression,
+            intermediate_level=intermediate_compression_level,
+            output_level=output_compression_level)
+
+        # the sample prefix written to sequence ids and result files
+        self.prefix = self.get_reads_filename_prefix(forward_reads_fp) if prefix is None else prefix
+
+        if primer_table is None:
+            self.amplicons = None
+        else:
+            self.amplicons = read_primer_table(primer_table)
+        self.amplicon_pipelines = OrderedDict()
 
         # if self.work_dp does not exist then create it
         if not os.path.exists(self.work_dp):
             os.makedirs(self.work_dp)
 
+        if auto_tune_threads:
+            self.thread_counts = choose_thread_counts(
+                input_bytes=self.get_input_bytes(),
+                core_count=self.core_count)
+        else:
+            self.thread_counts = ThreadCounts(
+                trimmomatic=int(self.core_count),
+                fastqc=int(self.core_count),
+                compression=1)
+        log.info('thread counts: %s', self.thread_counts)
+        self.step_metrics = []
+        self.step_read_counts = []
+        # FileChecksums of output files computed while they were written or counted
+        self.file_checksums = {}
+        self.manifests = []
+        # True while steps run as a StepGraph, which runs FastQC as separate tasks
+        self.defer_fastqc = False
+
+        if profile:
+            # cProfile and pstats are only imported when they are needed
+            from qc18SV4.profiling import StepProfiler
+            self.profiler = StepProfiler(output_dp=self.work_dp)
+        else:
+            self.profiler = None
+
         #self.fastq_join_binary_fp = os.environ.get('FASTQ_JOIN', 'fastq-join')
         #log.info('fastq_join binary: "%s"', self.fastq_join_binary_fp)
 
 
+    # the tools in ThreadCounts used by each step
+    step_thread_tools = {
+        'step_00_subsample_read_pairs': (),
+        'step_00_demultiplex_amplicons': (),
+        'step_01_trim_primers': ('trimmomatic', 'fastqc'),
+        'step_02_join_paired_end_reads': ('fastqc', 'compression'),
+        'step_03_quality_filter': ('fastqc', 'compression'),
+        'step_04_fasta_format': ('compression', ),
+        'step_05_length_filter': ('compression', ),
+        'step_06_rewrite_sequence_ids': (),
+        'step_07_write_read_table': (),
+    }
+
+    # roles of the files each step reads and writes and of the input files it deletes
+    step_file_roles = {
+        'step_00_subsample_read_pairs': StepRoles(
+            reads=(), writes=('subsampled_forward', 'subsampled_reverse'), deletes=()),
+        'step_01_trim_primers': StepRoles(
+            reads=('subsampled_forward', 'subsampled_reverse'),
+            writes=('forward_paired', 'forward_unpaired', 'reverse_paired', 'reverse_unpaired'),
+            deletes=()),
+        'step_02_join_paired_end_reads': StepRoles(
+            reads=('forward_paired', 'reverse_paired'),
+            writes=('joined', 'unjoined_forward', 'unjoined_reverse'),
+            deletes=()),
+        'step_03_quality_filter': StepRoles(reads=('joined', ), writes=('quality_filtered', ), deletes=()),
+        'step_04_fasta_format': StepRoles(
+            reads=('quality_filtered', ), writes=('fasta', ), deletes=('quality_filtered', )),
+        'step_05_length_filter': StepRoles(reads=('fasta', ), writes=('length_filtered', ), deletes=('fasta', )),
+        'step_06_rewrite_sequence_ids': StepRoles(reads=('length_filtered', ), writes=('id_rewritten', ), deletes=()),
+        'step_07_write_read_table': StepRoles(
+            reads=('id_rewritten', 'quality_filtered', 'forward_paired', 'reverse_paired'),
+            writes=('read_table', ),
+            deletes=()),
+    }
+
     def run(self):
-        output_dirs = []
-        output_dirs.append(self.step_01_trim_primers())
-        output_dirs.append(self.step_02_join_paired_end_reads(input_dir=output_dirs[-1]))
-        output_dirs.append(self.step_03_quality_filter(input_dir=output_dirs[-1]))
-        output_dirs.append(self.step_04_fasta_format(input_dir=output_dirs[-1]))
-        output_dirs.append(self.step_05_length_filter(input_dir=output_dirs[-1]))
-        output_dirs.append(self.step_06_rewrite_sequence_ids(input_dir=output_dirs[-1]))
+        # pipelines for each amplicon write to the trace of the pipeline that runs them
+        start_trace = self.trace and get_tracer() is None
+        if start_trace:
+            start_tracing(os.path.join(self.work_dp, trace_file_name), sample=self.prefix)
+        try:
+            with span('pipeline', 'pipeline', work_dp=self.work_dp, core_count=int(self.core_count)):
+                return self.run_pipeline()
+        finally:
+            if start_trace:
+                stop_tracing()
+
+    def run_pipeline(self):
+        self.manifests = []
+        if self.sample_input_bytes is None:
+            self.sample_input_bytes = self.get_input_bytes()
+        if self.check_input or self.phred == 'auto':
+            self.check_input_files()
+        if self.max_read_pairs is None:
+            subsample_manifest = None
+        else:
+            subsample_manifest = self.run_step(self.step_00_subsample_read_pairs)
+        if self.amplicons is None:
+            self.run_steps(input_manifest=subsample_manifest)
+        else:
+            self.run_step(self.step_00_demultiplex_amplicons, input_manifest=subsample_manifest)
+            self.run_amplicon_pipelines(self.manifests[-1])
 
-        return output_dirs
+        write_step_metrics(os.path.join(self.work_dp, 'step_metrics.tsv'), self.step_metrics)
+        write_read_counts(os.path.join(self.work_dp, read_counts_file_name), self.prefix, self.step_read_counts)
+        write_disk_usage(os.path.join(self.work_dp, 'disk_usage.tsv'), self.prefix, self.disk_usage)
+        write_checksums(self.work_dp, [output_file for manifest in self.manifests for output_file in manifest])
+        logging.getLogger(name=self.__class__.__name__).info(
+            'peak disk usage: %d bytes, final disk usage: %d bytes',
+            self.disk_usage.peak_bytes, self.disk_usage.current_bytes)
+        check_step_metrics(self.step_metrics)
 
-    def initialize_step(self):
-        function_name = sys._getframe(1).f_code.co_name
-        log = logging.getLogger(name=function_name)
-        output_dir = create_output_dir(output_parent_dir=self.work_dp, output_dir_name=function_name)
-        return log, output_dir
+        if self.profiler is not None:
+            print(self.profiler.get_hotspots())
 
+        return self.manifests
+
+    def run_steps(self, input_manifest=None):
+        """Run steps 01 and later as a StepGraph within core_count cores.
+
+        FastQC on the output of a step runs while the next steps run. When profiling, tasks
+        run one at a time so each profile covers only its own step. Input files that only
+        Trimmomatic reads are counted by a separate task so counting them does not delay step 02.
+
+        :param input_manifest: manifest of step_00_subsample_read_pairs, or None to read the input files
+        """
+        self.defer_fastqc = True
+        try:
+            results = self.get_step_graph(input_manifest=input_manifest).run(
+                core_count=1 if self.profiler is not None else self.core_count)
+        finally:
+            self.defer_fastqc = False
+        if 'count_input_reads' in results:
+            self.step_read_counts = [
+                step_read_counts._replace(input_counts=results['count_input_reads'])
+                if step_read_counts.step == 'step_01_trim_primers'
+                else step_read_counts
+                for step_read_counts
+                in self.step_read_counts
+            ]
 
-    def complete_step(self, log, output_dir):
-        output_fasta_fastq_file_glob = os.path.join(output_dir, '*.fast[aq].gz')
-        output_dir_list = sorted(glob.glob(output_fasta_fastq_file_glob))
-        if len(output_dir_list) == 0:
-            raise PipelineException('ERROR: no FASTA or FASTQ files in directory "{}"'.format(output_dir))
+    def get_step_graph(self, input_manifest=None):
+        graph = StepGraph()
+        # no step counts the input files when Trimmomatic reads them
+        count_input_reads = input_manifest is not None or self.input_counts is not None
+        self.add_step_tasks(
+            graph,
+            self.step_01_trim_primers,
+            lambda results: {'input_manifest': input_manifest, 'count_input_reads': count_input_reads})
+        if not count_input_reads:
+            graph.add(
+                'count_input_reads',
+                lambda results: self.count_input_reads(),
+                cores=self.thread_counts.compression)
+        self.add_step_tasks(
+            graph,
+            self.step_02_join_paired_end_reads,
+            lambda results: {'input_manifest': results['step_01_trim_primers']})
+        self.add_step_tasks(
+            graph,
+            self.step_03_quality_filter,
+            lambda results: {'input_manifest': results['step_02_join_paired_end_reads']})
+        self.add_step_tasks(
+            graph,
+            self.step_04_fasta_format,
+            lambda results: {'input_manifest': results['step_03_quality_filter']})
+        self.add_step_tasks(
+            graph,
+            self.step_05_length_filter,
+            lambda results: {'input_manifest': results['step_04_fasta_format']})
+        self.add_step_tasks(
+            graph,
+            self.step_06_rewrite_sequence_ids,
+            lambda results: {'input_manifest': results['step_05_length_filter']})
+        if self.write_read_table:
+            self.add_step_tasks(
+                graph,
+                self.step_07_write_read_table,
+                lambda results: {
+                    'input_manifest': results['step_06_rewrite_sequence_ids'],
+                    'quality_filtered_manifest': results['step_03_quality_filter'],
+                    'trimmed_manifest': results['step_01_trim_primers'],
+                })
+        return graph
+
+    def add_step_tasks(self, graph, step, get_step_kwargs):
+        """Add a step, FastQC on its output, and with minimize_disk the deletion of the files it was last to read.
+
+        :param get_step_kwargs: function of the results of earlier tasks returning the keyword arguments of the step
+        """
+        step_name = step.__name__
+        step_roles = self.step_file_roles[step_name]
+        graph.add(
+            step_name,
+            lambda results: self.run_step(step, release_files=False, **get_step_kwargs(results)),
+            reads=step_roles.reads,
+            writes=step_roles.writes,
+            deletes=step_roles.deletes,
+            cores=self.get_step_threads(step_name))
+        if 'fastqc' in self.step_thread_tools[step_name]:
+            graph.add(
+                step_name + fastqc_task_suffix,
+                lambda results: self.run_fastqc_task(results[step_name]),
+                reads=step_roles.writes,
+                cores=lambda results: self.get_fastqc_threads(results[step_name]))
+        if self.minimize_disk:
+            graph.add(
+                step_name + '_release',
+                lambda results: self.release_intermediate_files(list(self.manifests), completed_step_name=step_name),
+                deletes=self.get_released_roles(step_name))
+
+    def check_input_files(self):
+        """Profile the first reads of the input files and replace phred 'auto' with the inferred phred.
+
+        Problems found by the profile are raised if --check-input was given and logged otherwise.
+        With a primer table the primers are checked for each amplicon by demultiplexing, not here.
+        """
+        log = logging.getLogger(name=self.__class__.__name__)
+        input_profile = profile_read_pair(
+            forward_fp=self.forward_reads_fp,
+            reverse_fp=get_reverse_reads_fp(self.forward_reads_fp),
+            forward_primer=self.forward_primer if self.amplicons is None else None,
+            reverse_primer=self.reverse_primer if self.amplicons is None else None)
+        log.info('input profile: %s', input_profile._replace(overlaps=None))
+        problems = check_input_profile(
+            input_profile,
+            phred=self.phred,
+            min_overlap=self.min_overlap,
+            min_read_length=self.trimmomatic_minlen)
+        if self.check_input and len(problems) > 0:
+            raise PipelineException('input check failed for "{}":\n{}'.format(
+                self.forward_reads_fp, '\n'.join(problems)))
+        for problem in problems:
+            log.warning(problem)
+
+        if self.phred == 'auto':
+            if input_profile.phred is None:
+                raise PipelineException('failed to infer phred for "{}"'.format(self.forward_reads_fp))
+            log.info('inferred phred %s', input_profile.phred)
+            self.phred = input_profile.phred
+
+    def run_amplicon_pipelines(self, demultiplex_manifest):
+        """Run steps 01 and later on the reads of each amplicon in <work_dp>/<amplicon>.
+
+        :param demultiplex_manifest: manifest of step_00_demultiplex_amplicons
+        """
+        log = logging.getLogger(name=self.__class__.__name__)
+        forward_files = {
+            os.path.basename(os.path.dirname(f.fp)): f
+            for f
+            in demultiplex_manifest.files_for('amplicon_forward')
+        }
+        reverse_files = {
+            os.path.basename(os.path.dirname(f.fp)): f
+            for f
+            in demultiplex_manifest.files_for('amplicon_reverse')
+        }
+        for amplicon in self.amplicons:
+            forward_file = forward_files[amplicon.name]
+            if forward_file.record_count == 0:
+                log.warning('no read pairs for amplicon "%s"', amplicon.name)
+            else:
+                self.run_amplicon_pipeline(
+                    amplicon,
+                    forward_file.fp,
+                    input_counts=get_read_pair_counts([
+                        get_output_file_counts(forward_file),
+                        get_output_file_counts(reverse_files[amplicon.name])]))
+            if self.minimize_disk:
+                self.delete_tracked_files(forward_file.fp, get_reverse_reads_fp(forward_file.fp))
+
+    def run_amplicon_pipeline(self, amplicon, forward_reads_fp, input_counts=None):
+        amplicon_pipeline = self.create_amplicon_pipeline(amplicon, forward_reads_fp, input_counts=input_counts)
+        self.amplicon_pipelines[amplicon.name] = amplicon_pipeline
+        amplicon_pipeline.run()
+
+    def create_amplicon_pipeline(self, amplicon, forward_reads_fp, input_counts=None):
+        """Return a Pipeline for the reads of one amplicon with prefix <prefix>_<amplicon> so sequence ids
+        of different amplicons do not collide."""
+        return Pipeline(
+            forward_reads_fp=forward_reads_fp,
+            forward_primer=amplicon.forward_primer,
+            reverse_primer=amplicon.reverse_primer,
+            prefix_regex=self.prefix_pattern.pattern,
+            phred=self.phred,
+            work_dp=os.path.join(self.work_dp, amplicon.name),
+            core_count=self.core_count,
+            trimmomatic_minlen=self.trimmomatic_minlen,
+            min_overlap=self.min_overlap,
+            auto_tune_threads=self.auto_tune_threads,
+            profile=self.profiler is not None,
+            write_read_table=self.write_read_table,
+            minimize_disk=self.minimize_disk,
+            keep_roles=self.kept_roles[len(self.final_roles):],
+            intermediate_compression=self.compression_policy.intermediate_format,
+            intermediate_compression_level=self.compression_policy.intermediate_level,
+            output_compression_level=self.compression_policy.output_level,
+            input_counts=input_counts,
+            prefix='{}_{}'.format(self.prefix, amplicon.name),
+            sample_input_bytes=self.sample_input_bytes)
+
+    def run_step(self, step, input_manifest=None, release_files=True, count_input_reads=True, **kwargs):
+        """Run a step and record its metrics, read counts, and manifest.
+
+        :param count_input_reads: count the input files if the step does not count them, False when
+            a separate task counts them and the input counts are left empty until it is done
+        """
+        # count inputs before the step runs since some steps delete their input files
+        if input_manifest is None:
+            input_bytes = self.get_input_bytes()
+            # steps that read every input record count them, see StepManifest.input_counts
+            input_counts = self.input_counts
+        else:
+            input_bytes = sum(f.size for f in input_manifest)
+            input_counts = get_surviving_read_counts(input_manifest)
+        threads = self.get_step_threads(step.__name__)
+
+        step_kwargs = dict(kwargs)
+        if input_manifest is not None:
+            step_kwargs['input_manifest'] = input_manifest
+
+        step_peak = self.disk_usage.start_step()
+        step_start_time = time.time()
+        step_metrics = StepMetrics(
+            step=step.__name__,
+            input_bytes=input_bytes,
+            threads=threads,
+            sample_input_bytes=self.sample_input_bytes).start()
+        if self.profiler is None:
+            manifest = step(**step_kwargs)
         else:
-            log.info('output files:\n\t%s', '\n\t'.join(os.listdir(output_dir)))
-            # apply FastQC to all .fastq files
-            fastq_output_file_list = [
-                output_file
+            manifest = self.profiler.run(step.__name__, step, **step_kwargs)
+        self.step_metrics.append(
+            step_metrics.stop(
+                output_bytes=sum(f.size for f in manifest),
+                peak_disk_bytes=self.disk_usage.stop_step(step_peak)))
+        if input_counts is None:
+            input_counts = manifest.input_counts
+        if input_counts is None and count_input_reads:
+            # the input files are only read by a tool so they are counted here
+            input_counts = self.count_input_reads()
+        elif input_counts is None:
+            input_counts = RecordCounts(record_count=None, base_count=None)
+        if get_tracer() is not None:
+            get_tracer().add_event(
+                step.__name__, 'step', step_start_time, time.time(),
+                cpu_seconds=round(self.step_metrics[-1].cpu_seconds, 3),
+                threads=threads)
+        self.step_read_counts.append(
+            StepReadCounts(
+                step=step.__name__,
+                input_counts=input_counts,
+                output_counts=get_surviving_read_counts(manifest),
+                elapsed_seconds=self.step_metrics[-1].elapsed_seconds))
+
+        self.manifests.append(manifest)
+        if self.minimize_disk and release_files:
+            self.release_intermediate_files(self.manifests)
+
+        return manifest
+
+    def count_input_reads(self):
+        return get_input_read_counts(
+            self.forward_reads_fp,
+            get_reverse_reads_fp(self.forward_reads_fp),
+            thread_count=self.thread_counts.compression)
+
+    def get_step_threads(self, step_name):
+        """Return the most threads used by a tool of a step, not counting FastQC when it runs as a separate task."""
+        return max(
+            [
+                getattr(self.thread_counts, tool)
+                for tool
+                in self.step_thread_tools[step_name]
+                if not (tool == 'fastqc' and self.defer_fastqc)
+            ],
+            default=1)
+
+    # output files of these roles are always kept when intermediate files are deleted
+    final_roles = ('id_rewritten', 'read_table', 'unassigned_forward', 'unassigned_reverse')
+
+    def get_last_consumers(self):
+        """Return the name of the last step to read the output files of each role.
+
+        Files with a role that is not here are read by no step.
+        """
+        last_consumers = {
+            'subsampled_forward': 'step_01_trim_primers' if self.amplicons is None else 'step_00_demultiplex_amplicons',
+            'subsampled_reverse': 'step_01_trim_primers' if self.amplicons is None else 'step_00_demultiplex_amplicons',
+            'forward_paired': 'step_02_join_paired_end_reads',
+            'reverse_paired': 'step_02_join_paired_end_reads',
+            'joined': 'step_03_quality_filter',
+            'quality_filtered': 'step_04_fasta_format',
+            'fasta': 'step_05_length_filter',
+            'length_filtered': 'step_06_rewrite_sequence_ids',
+            # read by the pipeline of each amplicon, which deletes them when it is done
+            'amplicon_forward': None,
+            'amplicon_reverse': None,
+        }
+        if self.write_read_table:
+            for role in ('forward_paired', 'reverse_paired', 'quality_filtered'):
+                last_consumers[role] = 'step_07_write_read_table'
+        return last_consumers
+
+    def get_released_roles(self, step_name):
+        """Return the roles of the files deleted by release_intermediate_files when a step is done."""
+        last_consumers = self.get_last_consumers()
+        return tuple(
+            role
+            for writer_step_name, step_roles
+            in sorted(self.step_file_roles.items())
+            for role
+            in step_roles.writes
+            if role not in self.kept_roles and last_consumers.get(role, writer_step_name) == step_name
+        )
+
+    def release_intermediate_files(self, manifests, completed_step_name=None):
+        """Delete output files that no step after a completed step will read.
+
+        Final output files, FastQC results, and logs are kept.
+
+        :param manifests: manifests of all steps run so far in order
+        :param completed_step_name: name of the completed step, default is the step of the last manifest
+        """
+        if completed_step_name is None:
+            completed_step_name = manifests[-1].step_name
+        last_consumers = self.get_last_consumers()
+        for manifest in manifests:
+            released_file_list = [
+                output_file.fp
                 for output_file
-                in output_dir_list
-                if re.search(pattern=r'\.fastq(\.gz)?$', string=output_file)
+                in manifest
+                if output_file.role not in self.kept_roles
+                and last_consumers.get(output_file.role, manifest.step_name) == completed_step_name
             ]
+            self.delete_tracked_files(*released_file_list)
+            manifest.remove(*released_file_list)
 
-            if len(fastq_output_file_list) == 0:
-                log.info('no FASTQ files')
-            else:
-                fastqc_output_dir = os.path.join(output_dir, 'fastqc_results')
-                os.makedirs(fastqc_output_dir, exist_ok=True)
-                run_cmd(
-                    [
-                        'fastqc',
-                        '--threads', str(self.core_count),
-                        '--outdir', fastqc_output_dir,
-                        *fastq_output_file_list
-                    ],
-                    log_file=os.path.join(fastqc_output_dir, 'log')
-                )
+    def delete_tracked_files(self, *fp_list):
+        self.disk_usage.remove(*fp_list)
+        delete_files(*fp_list)
+
+    def get_compressed_intermediate_roles(self):
+        """Return the roles of output files whose compressed copies are read by a later step."""
+        if self.write_read_table:
+            return ('joined', 'length_filtered', 'quality_filtered')
+        else:
+            return ('joined', 'length_filtered')
+
+    def compress_and_count_files(self, role, *fp_list):
+        """Compress output files of one role as intermediate files or as files kept as results.
+
+        :return: list of (compressed file path, RecordCounts) in the order of fp_list
+        """
+        if role in self.get_compressed_intermediate_roles():
+            compression = self.compression_policy.intermediate_format
+            level = self.compression_policy.intermediate_level
+        else:
+            compression = 'gzip'
+            level = self.compression_policy.output_level
+        return compress_and_count_files(
+            *fp_list,
+            compression=compression,
+            level=level,
+            thread_count=self.thread_counts.compression,
+            file_checksums=self.file_checksums)
+
+    def initialize_step(self):
+        function_name = sys._getframe(1).f_code.co_name
+        log = logging.getLogger(name=function_name)
+        if len(self.step_thread_tools[function_name]) > 0:
+            log.info(
+                'thread counts: %s',
+                ', '.join(
+                    '{}={}'.format(tool, getattr(self.thread_counts, tool))
+                    for tool
+                    in self.step_thread_tools[function_name]))
+        output_dir = create_output_dir(output_parent_dir=self.work_dp, output_dir_name=function_name)
+        manifest = StepManifest(
+            step_name=function_name,
+            output_dir=output_dir,
+            disk_usage=self.disk_usage,
+            file_checksums=self.file_checksums)
+        return log, output_dir, manifest
+
+
+    def complete_step(self, log, manifest):
+        output_file_list = manifest.fasta_fastq_files()
+        if len(output_file_list) == 0:
+            raise PipelineException('ERROR: no FASTA or FASTQ files in directory "{}"'.format(manifest.output_dir))
+        else:
+            log.info(
+                'output files:\n\t%s',
+                '\n\t'.join(
+                    '{} ({} bytes, {} records)'.format(os.path.basename(f.fp), f.size, f.record_count)
+                    for f
+                    in manifest))
+            # a StepGraph runs FastQC as a separate task
+            if not self.defer_fastqc:
+                self.run_fastqc(manifest)
+
+        return manifest
+
+    def get_fastqc_file_list(self, manifest):
+        """Return the FASTQ files of a manifest for FastQC, using the gzipped copy if there are two."""
+        fastqc_preference = {'gzip': 0, None: 1, 'zstd': 2}
+        fastq_output_files = {}
+        for output_file in manifest.fasta_fastq_files():
+            if output_file.is_fastq:
+                uncompressed_fp = strip_compression_extension(output_file.fp)
+                fastq_output_files.setdefault(uncompressed_fp, []).append(output_file.fp)
+        return sorted(
+            min(fp_list, key=lambda fp: fastqc_preference[get_compression(fp)])
+            for fp_list
+            in fastq_output_files.values())
+
+    def get_fastqc_threads(self, manifest):
+        # FastQC uses at most one thread per file
+        return min(self.thread_counts.fastqc, max(1, len(self.get_fastqc_file_list(manifest))))
+
+    def run_fastqc_task(self, manifest):
+        """Apply FastQC to the FASTQ files of a step's manifest as a task of a StepGraph.
+
+        The task is measured on its own and recorded as <step>_fastqc in the step metrics
+        since it runs while the next steps run.
+        """
+        fastq_output_file_list = self.get_fastqc_file_list(manifest)
+        threads = self.get_fastqc_threads(manifest)
+        task_name = manifest.step_name + fastqc_task_suffix
+        step_peak = self.disk_usage.start_step()
+        task_start_time = time.time()
+        step_metrics = StepMetrics(
+            step=task_name,
+            input_bytes=sum(f.size for f in manifest if f.fp in fastq_output_file_list),
+            threads=threads,
+            sample_input_bytes=self.sample_input_bytes).start()
+        self.run_fastqc(manifest)
+        fastqc_output_dir = os.path.join(manifest.output_dir, 'fastqc_results')
+        self.step_metrics.append(
+            step_metrics.stop(
+                output_bytes=sum(
+                    os.path.getsize(os.path.join(entry_dir_path, file_name))
+                    for entry_dir_path, _, file_names
+                    in os.walk(fastqc_output_dir)
+                    for file_name
+                    in file_names),
+                peak_disk_bytes=self.disk_usage.stop_step(step_peak)))
+        if get_tracer() is not None:
+            get_tracer().add_event(
+                task_name, 'step', task_start_time, time.time(),
+                cpu_seconds=round(step_metrics.cpu_seconds, 3),
+                threads=threads)
+
+        return manifest
+
+    def run_fastqc(self, manifest):
+        """Apply FastQC to the FASTQ files of a step's manifest.
+
+        FastQC does not read zstd files so a temporary uncompressed copy is made in the
+        FastQC results directory of any FASTQ file that is only written with zstd. The copy
+        is not made next to the zstd file since the next step may be decompressing it there.
+        """
+        log = logging.getLogger(name=manifest.step_name)
+        fastq_output_file_list = self.get_fastqc_file_list(manifest)
+        temporary_fastq_file_list = []
+        if len(fastq_output_file_list) == 0:
+            log.info('no FASTQ files')
+        else:
+            fastqc_output_dir = os.path.join(manifest.output_dir, 'fastqc_results')
+            os.makedirs(fastqc_output_dir, exist_ok=True)
+            zstd_fastq_file_list = [fp for fp in fastq_output_file_list if get_compression(fp) == 'zstd']
+            temporary_fastq_file_list = decompress_files(
+                *zstd_fastq_file_list, thread_count=self.thread_counts.compression, output_dp=fastqc_output_dir)
+            fastq_output_file_list = sorted(
+                set(fastq_output_file_list).difference(zstd_fastq_file_list).union(temporary_fastq_file_list))
+            run_cmd(
+                [
+                    'fastqc',
+                    '--threads', str(self.get_fastqc_threads(manifest)),
+                    '--outdir', fastqc_output_dir,
+                    *fastq_output_file_list
+                ],
+                log_file=os.path.join(fastqc_output_dir, 'log')
+            )
+            self.disk_usage.add_dir(fastqc_output_dir)
+        self.delete_tracked_files(*temporary_fastq_file_list)
 
-    def step_01_trim_primers(self):
-        log, output_dir = self.initialize_step()
+        return manifest
 
-        forward_fastq_basename = os.path.basename(self.forward_reads_fp)
-        reverse_reads_fp = get_reverse_reads_fp(self.forward_reads_fp)
+    def step_00_subsample_read_pairs(self):
+        """
+        Choose at most max_read_pairs read pairs at random with subsample_seed. The next
+        step reads the subsampled files from this manifest in place of the input files.
+        They are compressed as intermediate files.
+
+        :return: manifest of output files
+        """
+        log, output_dir, manifest = self.initialize_step()
+
+        subsampled_files = subsample_read_pairs(
+            forward_fp=self.forward_reads_fp,
+            reverse_fp=get_reverse_reads_fp(self.forward_reads_fp),
+            max_read_pairs=self.max_read_pairs,
+            output_dp=output_dir,
+            seed=self.subsample_seed,
+            compression=self.compression_policy.intermediate_format,
+            level=self.compression_policy.intermediate_level,
+            file_checksums=self.file_checksums)
+        manifest.add(role='subsampled_forward', fp=subsampled_files.forward_fp, counts=subsampled_files.forward_counts)
+        manifest.add(role='subsampled_reverse', fp=subsampled_files.reverse_fp, counts=subsampled_files.reverse_counts)
+        manifest.input_counts = subsampled_files.input_counts
+        log.info(
+            'kept %d of %d read pairs',
+            subsampled_files.forward_counts.record_count, subsampled_files.input_counts.record_count)
+
+        return manifest
+
+    def step_00_demultiplex_amplicons(self, input_manifest=None):
+        """
+        Split read pairs by amplicon in one pass using the primers of each amplicon
+        in the primer table. Read pairs that match no amplicon are kept in the
+        'unassigned' directory.
+
+        :param input_manifest: manifest of step_00_subsample_read_pairs, or None to read the input files
+        :return: manifest of output files
+        """
+        log, output_dir, manifest = self.initialize_step()
+
+        forward_reads_fp, reverse_reads_fp = self.get_input_read_pair_fps(input_manifest)
+        demultiplexed_files = demultiplex_read_pairs(
+            forward_fp=forward_reads_fp,
+            reverse_fp=reverse_reads_fp,
+            amplicons=self.amplicons,
+            output_dp=output_dir,
+            file_checksums=self.file_checksums)
+        for name, files in demultiplexed_files.items():
+            role_prefix = 'unassigned' if name == unassigned else 'amplicon'
+            manifest.add(role=role_prefix + '_forward', fp=files.forward_fp, counts=files.forward_counts)
+            manifest.add(role=role_prefix + '_reverse', fp=files.reverse_fp, counts=files.reverse_counts)
+            log.info('%s: %d read pairs', name, files.forward_counts.record_count)
+        # every input read pair is written to one amplicon or to unassigned
+        manifest.input_counts = get_read_pair_counts([
+            sum_counts(files.forward_counts for files in demultiplexed_files.values()),
+            sum_counts(files.reverse_counts for files in demultiplexed_files.values())])
+
+        return manifest
+
+    def step_01_trim_primers(self, input_manifest=None):
+        """
+        :param input_manifest: manifest of step_00_subsample_read_pairs, or None to read the input files
+        :return: manifest of output files
+        """
+        log, output_dir, manifest = self.initialize_step()
+
+        forward_reads_fp, reverse_reads_fp = self.get_input_read_pair_fps(input_manifest)
+        # Trimmomatic does not read zstd files, such as subsampled files with zstd intermediate compression
+        zstd_reads_fp_list = [fp for fp in (forward_reads_fp, reverse_reads_fp) if get_compression(fp) == 'zstd']
+        uncompressed_reads_fp_list = decompress_files(
+            *zstd_reads_fp_list, thread_count=self.thread_counts.compression, output_dp=output_dir)
+        self.disk_usage.add(*uncompressed_reads_fp_list)
+        uncompressed_reads_fps = dict(zip(zstd_reads_fp_list, uncompressed_reads_fp_list))
+        forward_reads_fp = uncompressed_reads_fps.get(forward_reads_fp, forward_reads_fp)
+        reverse_reads_fp = uncompressed_reads_fps.get(reverse_reads_fp, reverse_reads_fp)
+        forward_fastq_basename = os.path.basename(forward_reads_fp)
         log.info('reverse reads: "%s"', reverse_reads_fp)
         reverse_fastq_basename = os.path.basename(reverse_reads_fp)
 
@@ -159,10 +831,12 @@ class Pipeline:
 
         with open(primer_fp, 'wt') as primer_file:
             primer_file.write('>Prefix/1\n{}\n>Prefix/2\n{}\n'.format(self.forward_primer, self.reverse_primer))
+        self.disk_usage.add(primer_fp)
 
         run_cmd([
                 'TrimmomaticPE',
-                self.forward_reads_fp, reverse_reads_fp,
+                '-threads', str(self.thread_counts.trimmomatic),
+                forward_reads_fp, reverse_reads_fp,
                 output1P_fp,
                 output1U_fp,
                 output2P_fp,
@@ -174,26 +848,32 @@ class Pipeline:
                 'ILLUMINACLIP:{}:2:30:10'.format(primer_fp)
             ], log_file=os.path.join(output_dir, 'log')
         )
+        self.delete_tracked_files(*uncompressed_reads_fp_list)
 
-        self.complete_step(log, output_dir)
-        return output_dir
+        # Trimmomatic writes gzipped output so the records must be counted here
+        manifest.add(role='forward_paired', fp=output1P_fp)
+        manifest.add(role='forward_unpaired', fp=output1U_fp)
+        manifest.add(role='reverse_paired', fp=output2P_fp)
+        manifest.add(role='reverse_unpaired', fp=output2U_fp)
 
+        return self.complete_step(log, manifest)
 
-    def step_02_join_paired_end_reads(self, input_dir):
-        log, output_dir = self.initialize_step()
+
+    def step_02_join_paired_end_reads(self, input_manifest):
+        log, output_dir, manifest = self.initialize_step()
 
         print('begin joined paired ends step')
 
-        trimmed_reads_file_glob = os.path.join(input_dir, '{}*.trim[12]p.fastq.gz'.format(self.prefix))
-        log.info('trimmed reads file glob: %s', trimmed_reads_file_glob)
-        trimmed_reads_files = glob.glob(trimmed_reads_file_glob)
-        log.info('trimmed reads files:\n\t%s', '\n\t'.join(trimmed_reads_files))
-        trimmed_forward_reads_fp, trimmed_reverse_reads_fp = sorted(trimmed_reads_files)
+        trimmed_forward_reads_fp = input_manifest.file_for('forward_paired').fp
+        trimmed_reverse_reads_fp = input_manifest.file_for('reverse_paired').fp
+        log.info('trimmed reads files:\n\t%s\n\t%s', trimmed_forward_reads_fp, trimmed_reverse_reads_fp)
 
-        uncompressed_trimmed_forward_reads_fp, uncompressed_trimmed_reverse_reads_fp = ungzip_files(
+        uncompressed_trimmed_forward_reads_fp, uncompressed_trimmed_reverse_reads_fp = decompress_files(
             trimmed_forward_reads_fp,
-            trimmed_reverse_reads_fp
+            trimmed_reverse_reads_fp,
+            thread_count=self.thread_counts.compression
         )
+        self.disk_usage.add(uncompressed_trimmed_forward_reads_fp, uncompressed_trimmed_reverse_reads_fp)
 
         joined_reads_pattern_fp = os.path.join(
             output_dir,
@@ -214,34 +894,49 @@ class Pipeline:
             log_file=os.path.join(output_dir, 'log')
         )
 
-        output_file_glob = os.path.join(output_dir, '{}*.trim.*.fastq'.format(self.prefix))
-        log.info('fastq-join output file glob: %s', output_file_glob)
-        output_file_list = glob.glob(output_file_glob)
+        # fastq-join replaces % in the output pattern with join, un1, and un2
+        roles = ('joined', 'unjoined_forward', 'unjoined_reverse')
+        output_file_list = [
+            joined_reads_pattern_fp.replace('%', fastq_join_name)
+            for fastq_join_name
+            in ('join', 'un1', 'un2')
+        ]
+        self.disk_usage.add(*output_file_list)
+        # the joined reads are compressed as an intermediate file and the unjoined reads as results
+        # unless they are deleted when this step is done, then FastQC reads the uncompressed files
+        released_roles = self.get_released_roles('step_02_join_paired_end_reads') if self.minimize_disk else ()
+        role_fp_list = list(zip(roles, output_file_list))
+        compressed_role_fp_list = [(role, fp) for role, fp in role_fp_list if role not in released_roles]
+        compressed_output_file_list = map_files(
+            lambda role_fp: self.compress_and_count_files(*role_fp)[0],
+            compressed_role_fp_list,
+            thread_count=self.thread_counts.compression)
+        for (role, _), (compressed_output_fp, counts) in zip(compressed_role_fp_list, compressed_output_file_list):
+            manifest.add(role=role, fp=compressed_output_fp, counts=counts)
+        for role, fp in role_fp_list:
+            if role in released_roles:
+                manifest.add(role=role, fp=fp)
         log.info('fastq-join output files:\n\t%s', '\n\t'.join(output_file_list))
 
-        gzip_files(*output_file_list)
-
-        delete_files(
+        self.delete_tracked_files(
             uncompressed_trimmed_forward_reads_fp,
             uncompressed_trimmed_reverse_reads_fp,
-            *output_file_list
+            *[fp for _, fp in compressed_role_fp_list]
         )
 
-        self.complete_step(log, output_dir)
-        return output_dir
+        return self.complete_step(log, manifest)
 
 
-    def step_03_quality_filter(self, input_dir):
-        log, output_dir = self.initialize_step()
+    def step_03_quality_filter(self, input_manifest):
+        log, output_dir, manifest = self.initialize_step()
 
         print('begin quality filtering step')
 
-        joined_reads_file_glob = os.path.join(input_dir, '{}*.join.fastq*'.format(self.prefix))
-        log.info('trimmed reads file glob: %s', joined_reads_file_glob)
-        joined_reads_fp = glob.glob(joined_reads_file_glob)[0]
+        joined_reads_fp = input_manifest.file_for('joined').fp
         log.info('joined reads file: %s', joined_reads_fp)
 
-        ungzipped_joined_reads_fp, *_ = ungzip_files(joined_reads_fp)
+        ungzipped_joined_reads_fp, *_ = decompress_files(joined_reads_fp)
+        self.disk_usage.add(ungzipped_joined_reads_fp)
 
         quality_filtered_reads_fp = os.path.join(
             output_dir,
@@ -264,15 +959,23 @@ class Pipeline:
             ], log_file=os.path.join(output_dir, 'log')
         )
 
-        delete_files(ungzipped_joined_reads_fp)
+        self.disk_usage.add(quality_filtered_reads_fp)
+        self.delete_tracked_files(ungzipped_joined_reads_fp)
 
-        gzip_files(quality_filtered_reads_fp)
+        # the uncompressed file is kept for the next step
+        # the compressed copy is only needed for the read table when disk use is minimized
+        if self.minimize_disk and not self.write_read_table:
+            manifest.add(role='quality_filtered', fp=quality_filtered_reads_fp)
+        else:
+            (compressed_quality_filtered_reads_fp, counts), = self.compress_and_count_files(
+                'quality_filtered', quality_filtered_reads_fp)
+            manifest.add(role='quality_filtered', fp=quality_filtered_reads_fp, counts=counts)
+            manifest.add(role='quality_filtered', fp=compressed_quality_filtered_reads_fp, counts=counts)
 
-        self.complete_step(log, output_dir)
-        return output_dir
+        return self.complete_step(log, manifest)
 
 
-    def step_04_fasta_format(self, input_dir):
+    def step_04_fasta_format(self, input_manifest):
         """
         fastq_to_fasta does not read gzipped files but it will write them,
         but in this step it writes uncompressed output files and they are
@@ -282,16 +985,18 @@ class Pipeline:
         This step reads uncompressed files from the previous step and
         then deletes them.
 
-        :param input_dir: directory of input files
-        :return: directory of output files
+        :param input_manifest: manifest of the previous step's output files
+        :return: manifest of output files
         """
-        log, output_dir = self.initialize_step()
+        log, output_dir, manifest = self.initialize_step()
 
         print('begin FASTA format step')
 
-        fastq_file_glob = os.path.join(input_dir, '{}*.fastq'.format(self.prefix))
-        log.info('FASTQ file glob: %s', fastq_file_glob)
-        ungzipped_fastq_file_list = glob.glob(fastq_file_glob)
+        ungzipped_fastq_file_list = [
+            f.fp
+            for f
+            in input_manifest.files_for('quality_filtered', compressed=False)
+        ]
         log.info('FASTQ file list:\n\t%s', '\n\t'.join(ungzipped_fastq_file_list))
 
         fasta_output_file_list = []
@@ -315,23 +1020,30 @@ class Pipeline:
                 ], log_file=os.path.join(output_dir, 'log')
             )
             fasta_output_file_list.append(fasta_fp)
+            self.disk_usage.add(fasta_fp)
 
-        delete_files(*ungzipped_fastq_file_list)
+        self.delete_tracked_files(*ungzipped_fastq_file_list)
+        input_manifest.remove(*ungzipped_fastq_file_list)
 
-        gzip_files(*fasta_output_file_list)
+        # no step reads the compressed copies so they are not written when disk use is minimized
+        if self.minimize_disk:
+            for fasta_fp in fasta_output_file_list:
+                manifest.add(role='fasta', fp=fasta_fp)
+        else:
+            gzipped_fasta_output_file_list = self.compress_and_count_files('fasta', *fasta_output_file_list)
+            for fasta_fp, (gzipped_fasta_fp, counts) in zip(fasta_output_file_list, gzipped_fasta_output_file_list):
+                manifest.add(role='fasta', fp=fasta_fp, counts=counts)
+                manifest.add(role='fasta', fp=gzipped_fasta_fp, counts=counts)
 
-        self.complete_step(log=log, output_dir=output_dir)
-        return output_dir
+        return self.complete_step(log=log, manifest=manifest)
 
 
-    def step_05_length_filter(self, input_dir):
-        log, output_dir = self.initialize_step()
+    def step_05_length_filter(self, input_manifest):
+        log, output_dir, manifest = self.initialize_step()
 
         print('begin FASTA format step')
 
-        fasta_file_glob = os.path.join(input_dir, '{}*.fasta'.format(self.prefix))
-        log.info('FASTA file glob: %s', fasta_file_glob)
-        fasta_file_list = glob.glob(fasta_file_glob)
+        fasta_file_list = [f.fp for f in input_manifest.files_for('fasta', compressed=False)]
         log.info('FASTA file list:\n\t%s', '\n\t'.join(fasta_file_list))
 
         length_filtered_file_list = []
@@ -356,23 +1068,25 @@ class Pipeline:
             )
 
             length_filtered_file_list.append(length_filtered_fp)
+            self.disk_usage.add(length_filtered_fp)
 
-        delete_files(*fasta_file_list)
-        gzip_files(*length_filtered_file_list)
-        delete_files(*length_filtered_file_list)
+        self.delete_tracked_files(*fasta_file_list)
+        input_manifest.remove(*fasta_file_list)
+        compressed_length_filtered_file_list = self.compress_and_count_files(
+            'length_filtered', *length_filtered_file_list)
+        for compressed_length_filtered_fp, counts in compressed_length_filtered_file_list:
+            manifest.add(role='length_filtered', fp=compressed_length_filtered_fp, counts=counts)
+        self.delete_tracked_files(*length_filtered_file_list)
 
-        self.complete_step(log=log, output_dir=output_dir)
-        return output_dir
+        return self.complete_step(log=log, manifest=manifest)
 
 
-    def step_06_rewrite_sequence_ids(self, input_dir):
-        log, output_dir = self.initialize_step()
+    def step_06_rewrite_sequence_ids(self, input_manifest):
+        log, output_dir, manifest = self.initialize_step()
 
         print('begin sequence id rewrite step')
 
-        fasta_file_glob = os.path.join(input_dir, '{}*.fasta.gz'.format(self.prefix))
-        log.info('FASTA file glob: %s', fasta_file_glob)
-        fasta_file_list = glob.glob(fasta_file_glob)
+        fasta_file_list = [f.fp for f in input_manifest.files_for('length_filtered', compressed=True)]
         log.info('FASTA file list:\n\t%s', '\n\t'.join(fasta_file_list))
 
         for fasta_fp in fasta_file_list:
@@ -380,22 +1094,78 @@ class Pipeline:
                 output_dir,
                 re.sub(
                     string=os.path.basename(fasta_fp),
-                    pattern='\.fasta.gz$',
+                    pattern=r'\.fasta(\.gz|\.zst)$',
                     repl='.id.fasta.gz'
                 )
             )
 
-            with gzip.open(fasta_fp, 'rt') as input_file, gzip.open(rewritten_sequence_id_fp, 'wt') as output_file:
-                for seq_record in SeqIO.parse(input_file, format='fasta'):
-                    seq_record.id = '{}_{}'.format(self.prefix, seq_record.id)
-                    # if description does not match id it will be printed
-                    # resulting in, for example,  >prefix_1 1 rather than >prefix_1
-                    seq_record.description = seq_record.id
-                    SeqIO.write(seq_record, output_file, format='fasta')
+            # the description is dropped so >1 length=253 becomes >prefix_1
+            # and sequences are wrapped at 60 bases as Biopython wrote them
+            id_prefix = '{}_'.format(self.prefix).encode('ascii')
+            with ChecksumFile(rewritten_sequence_id_fp, 'wb') as checksum_file, \
+                    gzip.open(checksum_file, 'wb', compresslevel=self.compression_policy.output_level) as output_file, \
+                    RecordBatchWriter(output_file, 'fasta', line_length=60) as writer:
+                for batch in read_record_batches(fasta_fp, 'fasta'):
+                    for i in range(len(batch)):
+                        writer.write_record(id_prefix + batch.id(i), batch.sequence(i))
+            self.file_checksums[rewritten_sequence_id_fp] = checksum_file.checksums
+
+            manifest.add(
+                role='id_rewritten',
+                fp=rewritten_sequence_id_fp,
+                counts=RecordCounts(record_count=writer.record_count, base_count=writer.base_count))
 
-        self.complete_step(log=log, output_dir=output_dir)
-        return output_dir
+        return self.complete_step(log=log, manifest=manifest)
+
+
+    def step_07_write_read_table(self, input_manifest, quality_filtered_manifest, trimmed_manifest=None):
+        """
+        Write the final reads to a Parquet file with their mean quality from the
+        quality-filtered FASTQ file and the overlap of the joined read pair.
+
+        :param input_manifest: manifest of step_06_rewrite_sequence_ids
+        :param quality_filtered_manifest: manifest of step_03_quality_filter
+        :param trimmed_manifest: manifest of step_01_trim_primers, or None to leave overlap empty
+        :return: manifest of output files
+        """
+        from qc18SV4.read_table import write_read_table
+
+        log, output_dir, manifest = self.initialize_step()
+
+        final_fasta_fp = input_manifest.file_for('id_rewritten').fp
+        quality_filtered_fastq_fp = quality_filtered_manifest.file_for('quality_filtered', compressed=True).fp
+        if trimmed_manifest is None:
+            forward_fastq_fp = reverse_fastq_fp = None
+        else:
+            forward_fastq_fp = trimmed_manifest.file_for('forward_paired').fp
+            reverse_fastq_fp = trimmed_manifest.file_for('reverse_paired').fp
+
+        read_table_fp = os.path.join(output_dir, '{}.reads.parquet'.format(self.prefix))
+        row_count = write_read_table(
+            prefix=self.prefix,
+            read_table_fp=read_table_fp,
+            final_fasta_fp=final_fasta_fp,
+            quality_filtered_fastq_fp=quality_filtered_fastq_fp,
+            forward_fastq_fp=forward_fastq_fp,
+            reverse_fastq_fp=reverse_fastq_fp,
+            phred_offset=int(self.phred))
+        manifest.add(role='read_table', fp=read_table_fp, counts=RecordCounts(record_count=row_count, base_count=None))
+        log.info('wrote %d reads to "%s"', row_count, read_table_fp)
+
+        return manifest
+
+    def get_input_read_pair_fps(self, input_manifest=None):
+        """Return the forward and reverse reads files of the pipeline, or of step_00_subsample_read_pairs."""
+        if input_manifest is None:
+            return self.forward_reads_fp, get_reverse_reads_fp(self.forward_reads_fp)
+        else:
+            return input_manifest.file_for('subsampled_forward').fp, input_manifest.file_for('subsampled_reverse').fp
 
+    def get_input_bytes(self):
+        return sum(
+            os.path.getsize(fp)
+            for fp
+            in (self.forward_reads_fp, get_reverse_reads_fp(self.forward_reads_fp)))
 
     def get_reads_filename_prefix(self, forward_reads_fp):
         forward_filename = os.path.basename(forward_reads_fp)
@@ -412,14 +1182,20 @@ class Pipeline:
 def run_cmd(cmd_line_list, log_file, **kwargs):
     log = logging.getLogger(name=__name__)
     try:
-        with open(log_file, 'at') as log_file:
+        with open(log_file, 'at') as log_file, span(os.path.basename(str(cmd_line_list[0])), 'tool'):
             log.info('executing "%s"', ' '.join((str(x) for x in cmd_line_list)))
-            output = subprocess.run(
-                cmd_line_list,
-                stdout=log_file,
-                stderr=subprocess.STDOUT,
-                universal_newlines=True,
-                **kwargs)
+            output = None
+            if len(kwargs) == 0:
+                # TrimmomaticPE and fastqc run in a JVM worker if a batch runner started them
+                output = run_java_tool(cmd_line_list, log_file.name)
+            if output is None:
+                # run_process counts the CPU time and memory of the tool in the metrics of the running step
+                output = run_process(
+                    cmd_line_list,
+                    stdout=log_file,
+                    stderr=subprocess.STDOUT,
+                    universal_newlines=True,
+                    **kwargs)
             log.info(output)
         return output
     except subprocess.CalledProcessError as c:
@@ -1,9 +1,17 @@
-import gzip
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
 import logging
 from operator import attrgetter
 import os.path
 import shutil
 
+from qc18SV4.checksums import ChecksumFile
+from qc18SV4.compression import (
+    compression_extensions, is_compressed_file_name, open_compressed, strip_compression_extension)
+from qc18SV4.manifest import RecordCounter, get_file_format
+from qc18SV4.step_metrics import get_task_usage, run_for_task
+from qc18SV4.trace import span
+
 
 def get_sorted_file_list(dir_path):
     return tuple(
@@ -26,36 +34,106 @@ def delete_files(*fp_list):
         os.remove(fp)
 
 
-def gzip_files(*fp_list):
-    log = logging.getLogger(name=__file__)
-    gzipped_file_list = []
-    for fp in fp_list:
-        dir_path, file_name = os.path.split(fp)
-        if fp.endswith('.gz'):
-            log.warning('file "%s" is already gzipped', file_name)
-            gzipped_file_list.append(fp)
-        else:
-            log.info('compressing "%s" with gzip', file_name)
-            gzipped_fp = os.path.join(dir_path, file_name + '.gz')
-            with open(fp, 'rt') as src, gzip.open(gzipped_fp, 'wt') as dst:
-                shutil.copyfileobj(fsrc=src, fdst=dst)
-            gzipped_file_list.append(gzipped_fp)
-    return gzipped_file_list
+def map_files(fn, fp_list, thread_count=1):
+    """Apply fn to each file path, using a pool of thread_count threads when there is more than one file.
+
+    zlib and zstandard release the GIL while they compress and decompress so threads run in parallel.
+    The CPU time of the pool threads is counted in the metrics of the step that called map_files.
+    """
+    if thread_count <= 1 or len(fp_list) <= 1:
+        return [fn(fp) for fp in fp_list]
+    else:
+        with ThreadPoolExecutor(max_workers=min(thread_count, len(fp_list))) as executor:
+            return list(executor.map(partial(run_for_task, get_task_usage(), fn), fp_list))
+
+
+def gzip_files(*fp_list, thread_count=1):
+    return [gzipped_fp for gzipped_fp, _ in gzip_and_count_files(*fp_list, thread_count=thread_count)]
+
+
+def gzip_and_count_files(*fp_list, thread_count=1):
+    """Compress files and count their records and bases.
+
+    :return: list of (gzipped file path, RecordCounts) in the order of fp_list
+    """
+    return map_files(gzip_file, fp_list, thread_count=thread_count)
+
+
+def gzip_file(fp, chunk_size=2**20):
+    return compress_file(fp, compression='gzip', level=9, chunk_size=chunk_size)
 
 
-def ungzip_files(*fp_list):
+def compress_and_count_files(*fp_list, compression='gzip', level=9, thread_count=1, file_checksums=None):
+    """Compress files with gzip or zstd and count their records and bases.
+
+    :return: list of (compressed file path, RecordCounts) in the order of fp_list
+    """
+    return map_files(
+        partial(compress_file, compression=compression, level=level, file_checksums=file_checksums),
+        fp_list,
+        thread_count=thread_count)
+
+
+def compress_file(fp, compression='gzip', level=9, chunk_size=2**20, file_checksums=None):
+    """Compress one file and count its FASTA or FASTQ records and bases in the same pass.
+
+    :param fp: (str) path to an uncompressed file
+    :param compression: 'gzip' or 'zstd'
+    :param level: compression level
+    :param file_checksums: dictionary to which the FileChecksums of the uncompressed and compressed files are added, or None
+    :return: (compressed file path, RecordCounts) where RecordCounts is None if
+             the file was already compressed or is neither FASTA nor FASTQ
+    """
     log = logging.getLogger(name=__file__)
-    ungzipped_file_list = []
-    for fp in fp_list:
-        dir_path, gzipped_file_name = os.path.split(fp)
-        if not fp.endswith('.gz'):
-            log.warning('file "%s" is not gzipped', gzipped_file_name)
-            ungzipped_file_list.append(fp)
+    dir_path, file_name = os.path.split(fp)
+    if is_compressed_file_name(fp):
+        log.warning('file "%s" is already compressed', file_name)
+        return fp, None
+    else:
+        log.info('compressing "%s" with %s level %d', file_name, compression, level)
+        compressed_fp = os.path.join(dir_path, file_name + compression_extensions[compression])
+        counter = RecordCounter(get_file_format(fp))
+        if file_checksums is None:
+            src = open(fp, 'rb')
+            dst_file = open(compressed_fp, 'wb')
+        else:
+            src = ChecksumFile(fp, 'rb')
+            dst_file = ChecksumFile(compressed_fp, 'wb')
+        with src, dst_file, \
+                open_compressed(compressed_fp, 'wb', compression=compression, level=level, fileobj=dst_file) as dst, \
+                span('compress', 'compression', file_name=file_name, compression=compression, level=level):
+            for chunk in iter(lambda: src.read(chunk_size), b''):
+                counter.update(chunk)
+                dst.write(chunk)
+        if file_checksums is not None:
+            file_checksums[fp] = src.checksums
+            file_checksums[compressed_fp] = dst_file.checksums
+        if counter.file_format is None:
+            return compressed_fp, None
         else:
-            log.info('uncompressing "%s" with gzip', gzipped_file_name)
-            ungzipped_fp = os.path.join(dir_path, gzipped_file_name[:-3])
-            with gzip.open(fp, 'rt') as src, open(ungzipped_fp, 'wt') as dst:
-                shutil.copyfileobj(fsrc=src, fdst=dst)
-            ungzipped_file_list.append(ungzipped_fp)
-    return ungzipped_file_list
+            return compressed_fp, counter.counts
 
+
+def decompress_files(*fp_list, thread_count=1, output_dp=None):
+    return map_files(partial(decompress_file, output_dp=output_dp), fp_list, thread_count=thread_count)
+
+
+def decompress_file(fp, chunk_size=2**20, output_dp=None):
+    """Write an uncompressed copy of a gzip or zstd file next to it or in output_dp.
+
+    :return: path to the uncompressed file, or fp if the file name has no compression extension
+    """
+    log = logging.getLogger(name=__file__)
+    dir_path, compressed_file_name = os.path.split(fp)
+    if not is_compressed_file_name(fp):
+        log.warning('file "%s" is not compressed', compressed_file_name)
+        return fp
+    else:
+        log.info('uncompressing "%s"', compressed_file_name)
+        uncompressed_fp = strip_compression_extension(fp)
+        if output_dp is not None:
+            uncompressed_fp = os.path.join(output_dp, os.path.basename(uncompressed_fp))
+        with open_compressed(fp, 'rb') as src, open(uncompressed_fp, 'wb') as dst, \
+                span('decompress', 'compression', file_name=compressed_file_name):
+            shutil.copyfileobj(fsrc=src, fdst=dst, length=chunk_size)
+        return uncompressed_fp
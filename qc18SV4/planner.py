@@ -0,0 +1,280 @@
+"""
+planner.py
+
+Estimate the runtime and peak memory of each sample in an input directory from the
+step metrics of past runs and recommend a SLURM allocation for a TACC Launcher job:
+the number of nodes, LAUNCHER_PPN, and the wall time.
+
+For each step a line is fitted to the elapsed seconds and to the peak memory of past
+runs as a function of the sample's input bytes, which are the forward and reverse read
+bytes recorded with the step metrics. Step metrics written before these bytes were
+recorded use the input bytes of step_01_trim_primers, and runs that subsampled or
+demultiplexed reads before step_01 are then skipped. Past runs should use the same
+core count per sample as the planned job. FastQC tasks run while the next steps run, so
+their time is not added to the runtime of a sample and their memory is added to the
+peak memory of the steps.
+
+Launcher starts each sample as soon as a slot is free, so the wall time is estimated by
+assigning samples, largest first, to the slot that becomes free first. The smallest
+number of nodes that finishes within the target time is recommended.
+
+    $ plan_slurm_job -i input_dir -m work-* --target-hours 4
+"""
+import argparse
+from collections import OrderedDict, namedtuple
+import heapq
+import logging
+import math
+import os
+
+from qc18SV4.exceptions import PipelineException
+from qc18SV4.step_metrics import fastqc_task_suffix, read_step_metrics
+from qc18SV4.write_launcher_job_file import get_forward_reverse_read_pairs
+
+
+first_step = 'step_01_trim_primers'
+
+
+class LinearModel(namedtuple('LinearModel', ['intercept', 'slope'])):
+    __slots__ = ()
+
+    def predict(self, x):
+        return max(0.0, self.intercept + self.slope * x)
+
+
+def fit_linear_model(points):
+    """Fit y = intercept + slope * x to (x, y) points by least squares.
+
+    If every point has the same x the line passes through the origin and their mean.
+    """
+    if len(points) == 0:
+        raise PipelineException('no points to fit')
+    n = len(points)
+    mean_x = sum(x for x, _ in points) / n
+    mean_y = sum(y for _, y in points) / n
+    variance_x = sum((x - mean_x) ** 2 for x, _ in points)
+    if variance_x == 0.0:
+        return LinearModel(intercept=0.0, slope=mean_y / mean_x if mean_x > 0 else 0.0)
+    else:
+        slope = sum((x - mean_x) * (y - mean_y) for x, y in points) / variance_x
+        return LinearModel(intercept=mean_y - slope * mean_x, slope=slope)
+
+
+StepModel = namedtuple('StepModel', ['step', 'runtime_model', 'memory_model'])
+
+
+def fit_step_models(step_metrics_lists):
+    """Fit runtime and memory models for each step.
+
+    :param step_metrics_lists: one list of StepMetrics for each past run
+    :return: OrderedDict of step name to StepModel in step order
+    """
+    log = logging.getLogger(name=__name__)
+    runtime_points = OrderedDict()
+    memory_points = OrderedDict()
+    for step_metrics_list in step_metrics_lists:
+        sample_input_bytes = get_sample_input_bytes(step_metrics_list)
+        if sample_input_bytes is None:
+            log.warning(
+                'skipping step metrics without the bytes of the sample input files, steps: %s',
+                ', '.join(m.step for m in step_metrics_list))
+            continue
+        for step_metrics in step_metrics_list:
+            runtime_points.setdefault(step_metrics.step, []).append(
+                (sample_input_bytes, step_metrics.elapsed_seconds))
+            memory_points.setdefault(step_metrics.step, []).append(
+                (sample_input_bytes, step_metrics.peak_memory_bytes))
+
+    if len(runtime_points) == 0:
+        raise PipelineException('found no step metrics with the bytes of the sample input files')
+
+    return OrderedDict(
+        (
+            step,
+            StepModel(
+                step=step,
+                runtime_model=fit_linear_model(runtime_points[step]),
+                memory_model=fit_linear_model(memory_points[step]))
+        )
+        for step
+        in runtime_points
+    )
+
+
+def get_sample_input_bytes(step_metrics_list):
+    """Return the bytes of the sample input files of one run, or None if they are not known."""
+    sample_input_bytes = next(
+        (m.sample_input_bytes for m in step_metrics_list if m.sample_input_bytes is not None), None)
+    if sample_input_bytes is None and not any(m.step.startswith('step_00') for m in step_metrics_list):
+        # older step metrics only have the input of step 01, which is the sample input if no step 00 ran
+        sample_input_bytes = next((m.input_bytes for m in step_metrics_list if m.step == first_step), None)
+    return sample_input_bytes
+
+
+class SamplePrediction(namedtuple('SamplePrediction', ['sample', 'input_bytes', 'step_seconds', 'step_memory_bytes'])):
+    __slots__ = ()
+
+    @property
+    def seconds(self):
+        return sum(seconds for step, seconds in self.step_seconds.items() if not step.endswith(fastqc_task_suffix))
+
+    @property
+    def peak_memory_bytes(self):
+        step_memory_bytes = [
+            memory_bytes for step, memory_bytes in self.step_memory_bytes.items()
+            if not step.endswith(fastqc_task_suffix)]
+        fastqc_memory_bytes = [
+            memory_bytes for step, memory_bytes in self.step_memory_bytes.items()
+            if step.endswith(fastqc_task_suffix)]
+        return max(step_memory_bytes, default=0) + max(fastqc_memory_bytes, default=0)
+
+
+def predict_sample(sample, input_bytes, step_models):
+    return SamplePrediction(
+        sample=sample,
+        input_bytes=input_bytes,
+        step_seconds=OrderedDict(
+            (step, model.runtime_model.predict(input_bytes)) for step, model in step_models.items()),
+        step_memory_bytes=OrderedDict(
+            (step, model.memory_model.predict(input_bytes)) for step, model in step_models.items()))
+
+
+def predict_samples(input_dp, step_models):
+    """Predict the runtime and memory of each read pair in input_dp.
+
+    :return: list of SamplePrediction
+    """
+    return [
+        predict_sample(
+            sample=os.path.basename(forward_fp),
+            input_bytes=os.path.getsize(forward_fp) + os.path.getsize(reverse_fp),
+            step_models=step_models)
+        for forward_fp, reverse_fp
+        in sorted(get_forward_reverse_read_pairs(input_dp))
+    ]
+
+
+def get_makespan(durations, slot_count):
+    """Return the time to run every task when each starts on the first free slot, longest task first."""
+    slots = [0.0] * max(1, slot_count)
+    for duration in sorted(durations, reverse=True):
+        heapq.heappush(slots, heapq.heappop(slots) + duration)
+    return max(slots)
+
+
+Plan = namedtuple('Plan', ['nodes', 'launcher_ppn', 'wall_seconds', 'meets_target'])
+
+
+def plan_allocation(
+        sample_predictions,
+        target_seconds,
+        cores_per_node,
+        memory_per_node_bytes,
+        cores_per_sample=1,
+        max_nodes=None,
+        safety_factor=1.25):
+    """Choose the fewest nodes that run every sample within target_seconds.
+
+    :param sample_predictions: list of SamplePrediction
+    :param target_seconds: (float) desired completion time of the job
+    :param cores_per_node: (int) cores on each node
+    :param memory_per_node_bytes: (int) memory on each node
+    :param cores_per_sample: (int) cores given to each pipeline with -c
+    :param max_nodes: (int) most nodes to recommend, or None for no limit
+    :param safety_factor: (float) multiplier for predicted runtime and memory
+    :return: Plan
+    """
+    if len(sample_predictions) == 0:
+        raise PipelineException('no samples to plan')
+    if max_nodes is not None and max_nodes < 1:
+        raise PipelineException('the most nodes to recommend must be at least 1, not {}'.format(max_nodes))
+
+    peak_memory_bytes = safety_factor * max(p.peak_memory_bytes for p in sample_predictions)
+    if peak_memory_bytes > memory_per_node_bytes:
+        raise PipelineException(
+            'a sample is predicted to use {:.0f} bytes of memory but a node has {} bytes'.format(
+                peak_memory_bytes, memory_per_node_bytes))
+    memory_slots = int(memory_per_node_bytes // peak_memory_bytes) if peak_memory_bytes > 0 else cores_per_node
+    launcher_ppn = max(1, min(cores_per_node // cores_per_sample, memory_slots))
+
+    durations = [safety_factor * p.seconds for p in sample_predictions]
+    # more nodes than this leave slots with no sample
+    useful_nodes = int(math.ceil(len(durations) / launcher_ppn))
+    if max_nodes is not None:
+        useful_nodes = min(useful_nodes, max_nodes)
+
+    for nodes in range(1, useful_nodes + 1):
+        wall_seconds = get_makespan(durations, nodes * launcher_ppn)
+        if wall_seconds <= target_seconds:
+            return Plan(nodes=nodes, launcher_ppn=launcher_ppn, wall_seconds=wall_seconds, meets_target=True)
+
+    return Plan(nodes=useful_nodes, launcher_ppn=launcher_ppn, wall_seconds=wall_seconds, meets_target=False)
+
+
+def format_wall_time(seconds):
+    """Format seconds as HH:MM:SS rounded up to the next minute."""
+    minutes = max(1, int(math.ceil(seconds / 60.0)))
+    return '{:02d}:{:02d}:00'.format(minutes // 60, minutes % 60)
+
+
+def get_step_metrics_fp_list(step_metrics_paths):
+    """Return step_metrics.tsv paths for files or work directories."""
+    step_metrics_fp_list = []
+    for path in step_metrics_paths:
+        if os.path.isdir(path):
+            path = os.path.join(path, 'step_metrics.tsv')
+        if os.path.exists(path):
+            step_metrics_fp_list.append(path)
+        else:
+            logging.getLogger(name=__name__).warning('"%s" does not exist', path)
+    return step_metrics_fp_list
+
+
+def get_args(argv=None):
+    arg_parser = argparse.ArgumentParser(
+        description='recommend nodes, LAUNCHER_PPN, and wall time for the samples in a directory')
+    arg_parser.add_argument('-i', '--input-dp', required=True, help='directory of input files')
+    arg_parser.add_argument(
+        '-m', '--step-metrics', nargs='+', required=True,
+        help='step_metrics.tsv files or work directories of past runs')
+    arg_parser.add_argument('--target-hours', type=float, required=True, help='desired completion time of the job')
+    arg_parser.add_argument('--cores-per-sample', type=int, default=1, help='cores given to each pipeline with -c')
+    arg_parser.add_argument('--cores-per-node', type=int, default=48, help='cores on each node')
+    arg_parser.add_argument('--memory-per-node-gb', type=float, default=192.0, help='memory on each node in GB')
+    arg_parser.add_argument('--max-nodes', type=int, default=None, help='most nodes to recommend')
+    arg_parser.add_argument('--safety-factor', type=float, default=1.25, help='multiplier for predicted runtime and memory')
+    args = arg_parser.parse_args(args=argv)
+    return args
+
+
+def main():
+    logging.basicConfig(level=logging.WARNING)
+    args = get_args()
+
+    step_models = fit_step_models(
+        [read_step_metrics(fp) for fp in get_step_metrics_fp_list(args.step_metrics)])
+    sample_predictions = predict_samples(args.input_dp, step_models)
+
+    print('sample\tinput_bytes\tpredicted_seconds\tpredicted_peak_memory_bytes')
+    for p in sample_predictions:
+        print('{}\t{}\t{:.0f}\t{:.0f}'.format(p.sample, p.input_bytes, p.seconds, p.peak_memory_bytes))
+
+    plan = plan_allocation(
+        sample_predictions,
+        target_seconds=args.target_hours * 3600.0,
+        cores_per_node=args.cores_per_node,
+        memory_per_node_bytes=args.memory_per_node_gb * 2**30,
+        cores_per_sample=args.cores_per_sample,
+        max_nodes=args.max_nodes,
+        safety_factor=args.safety_factor)
+    if not plan.meets_target:
+        print('the target of {} hours can not be met, the longest sample or the node limit sets the wall time'.format(
+            args.target_hours))
+    print('#SBATCH -N {}'.format(plan.nodes))
+    print('#SBATCH -n {}'.format(plan.nodes * plan.launcher_ppn))
+    print('#SBATCH -t {}'.format(format_wall_time(plan.wall_seconds)))
+    print('export LAUNCHER_PPN={}'.format(plan.launcher_ppn))
+
+
+if __name__ == '__main__':
+    main()
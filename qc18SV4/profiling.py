@@ -0,0 +1,88 @@
+"""
+profiling.py
+
+Profile pipeline steps. Each step is run under cProfile and a sampling profiler.
+For a step named step_0X the following files are written to the work directory:
+
+    step_0X.pstats     cProfile statistics, readable with the pstats module or snakeviz
+    step_0X.collapsed  sampled call stacks in collapsed format, one stack per line
+                       with a sample count, readable with flamegraph.pl or speedscope
+
+Profiling is off unless the pipeline is run with --profile.
+"""
+from collections import Counter
+import cProfile
+import io
+import os
+import pstats
+import sys
+import threading
+
+
+class StackSampler:
+    """Sample the call stack of one thread at a fixed interval from a background thread."""
+    def __init__(self, thread_id, interval=0.005):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stack_counts = Counter()
+        self._stop_event = threading.Event()
+        self._sampling_thread = None
+
+    def start(self):
+        self._sampling_thread = threading.Thread(target=self._sample, daemon=True)
+        self._sampling_thread.start()
+        return self
+
+    def stop(self):
+        self._stop_event.set()
+        self._sampling_thread.join()
+        return self
+
+    def _sample(self):
+        while not self._stop_event.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is not None:
+                self.stack_counts[get_collapsed_stack(frame)] += 1
+
+    def write_collapsed(self, collapsed_fp):
+        with open(collapsed_fp, 'wt') as collapsed_file:
+            for stack, count in self.stack_counts.most_common():
+                collapsed_file.write('{} {}\n'.format(stack, count))
+
+
+def get_collapsed_stack(frame):
+    """Return the stack ending at frame as 'outermost;...;innermost' with one function:file:line per entry."""
+    stack = []
+    while frame is not None:
+        code = frame.f_code
+        stack.append('{}:{}:{}'.format(code.co_name, os.path.basename(code.co_filename), code.co_firstlineno))
+        frame = frame.f_back
+    return ';'.join(reversed(stack))
+
+
+class StepProfiler:
+    def __init__(self, output_dp, sampling_interval=0.005):
+        self.output_dp = output_dp
+        self.sampling_interval = sampling_interval
+        self.pstats_fp_list = []
+
+    def run(self, step_name, step, *args, **kwargs):
+        """Call step(*args, **kwargs) under cProfile and a stack sampler and write the results."""
+        profile = cProfile.Profile()
+        sampler = StackSampler(thread_id=threading.get_ident(), interval=self.sampling_interval).start()
+        try:
+            return profile.runcall(step, *args, **kwargs)
+        finally:
+            sampler.stop()
+            pstats_fp = os.path.join(self.output_dp, step_name + '.pstats')
+            profile.dump_stats(pstats_fp)
+            self.pstats_fp_list.append(pstats_fp)
+            sampler.write_collapsed(os.path.join(self.output_dp, step_name + '.collapsed'))
+
+    def get_hotspots(self, count=20, sort_key='tottime'):
+        """Return a report of the functions with the most time in all profiled steps."""
+        report = io.StringIO()
+        if len(self.pstats_fp_list) > 0:
+            stats = pstats.Stats(*self.pstats_fp_list, stream=report)
+            stats.strip_dirs().sort_stats(sort_key).print_stats(count)
+        return report.getvalue()
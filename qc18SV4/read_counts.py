@@ -0,0 +1,237 @@
+"""
+read_counts.py
+
+Count the reads and bases that go into and come out of each pipeline step so the
+reads lost at each step can be compared across samples. Pipeline.run writes one
+row per sample to read_counts.tsv in the work directory with these columns:
+
+    sample                    sample prefix
+    step_0X_reads_in          reads read by step_0X
+    step_0X_bases_in          bases read by step_0X
+    step_0X_reads_out         reads written by step_0X that the next step reads
+    step_0X_bases_out         bases written by step_0X that the next step reads
+    step_0X_reads_per_second  reads read by step_0X per second of wall time
+    read_survival             fraction of input reads written by the last step
+
+The two optional steps numbered 00 can run in one pipeline, so each has a column prefix
+that names it: with --max-read-pairs the subsampling step has columns
+step_00_subsample_reads_in and so on, and with --primer-table the demultiplexing step has
+columns step_00_demultiplex_reads_in and so on. read_survival is then the fraction of the
+subsampled reads written by the last step.
+
+Until reads are joined in step_02 a read pair counts as one read and its bases are
+the bases of both reads. Counts come from the step manifests, which count records
+while files are compressed or written. The subsampling and demultiplexing steps count the
+input reads while they read them, otherwise the input files are counted by a task that
+runs alongside step_01.
+
+Rows from many work directories can be combined with
+
+    $ aggregate_read_counts -o all_read_counts.tsv work_dir_1 work_dir_2 ...
+"""
+import argparse
+from collections import namedtuple
+import os
+import sys
+
+from qc18SV4.manifest import RecordCounts, count_records
+from qc18SV4.pipeline_util import map_files
+
+
+read_counts_file_name = 'read_counts.tsv'
+
+# output files with these roles are read by the next step, the first role of each step counts reads
+step_surviving_roles = {
+    'step_00_subsample_read_pairs': ('subsampled_forward', 'subsampled_reverse'),
+    'step_00_demultiplex_amplicons': ('amplicon_forward', 'amplicon_reverse'),
+    'step_01_trim_primers': ('forward_paired', 'reverse_paired'),
+    'step_02_join_paired_end_reads': ('joined', ),
+    'step_03_quality_filter': ('quality_filtered', ),
+    'step_04_fasta_format': ('fasta', ),
+    'step_05_length_filter': ('length_filtered', ),
+    'step_06_rewrite_sequence_ids': ('id_rewritten', ),
+    'step_07_write_read_table': ('read_table', ),
+}
+
+step_read_counts_columns = ('reads_in', 'bases_in', 'reads_out', 'bases_out', 'reads_per_second')
+
+# column prefixes of steps whose step number is shared with another step that may run with it
+step_column_prefixes = {
+    'step_00_subsample_read_pairs': 'step_00_subsample',
+    'step_00_demultiplex_amplicons': 'step_00_demultiplex',
+}
+
+
+class StepReadCounts(namedtuple('StepReadCounts', ['step', 'input_counts', 'output_counts', 'elapsed_seconds'])):
+    __slots__ = ()
+
+    @property
+    def reads_per_second(self):
+        if self.input_counts.record_count is None or not self.elapsed_seconds:
+            return None
+        else:
+            return self.input_counts.record_count / self.elapsed_seconds
+
+    def as_row(self):
+        """Return a dictionary of column name to string value with columns prefixed by the step number."""
+        step_number = step_column_prefixes.get(self.step, self.step[:len('step_0X')])
+        values = (
+            self.input_counts.record_count,
+            self.input_counts.base_count,
+            self.output_counts.record_count,
+            self.output_counts.base_count,
+            None if self.reads_per_second is None else '{:.1f}'.format(self.reads_per_second),
+        )
+        return {
+            '{}_{}'.format(step_number, column): '' if value is None else str(value)
+            for column, value
+            in zip(step_read_counts_columns, values)
+        }
+
+
+def sum_counts(counts_list):
+    """Add record and base counts. The sum is None if any count is None."""
+    counts_list = list(counts_list)
+    if len(counts_list) == 0 or any(counts is None for counts in counts_list):
+        return RecordCounts(record_count=None, base_count=None)
+
+    def add(values):
+        return None if any(value is None for value in values) else sum(values)
+
+    return RecordCounts(
+        record_count=add([counts.record_count for counts in counts_list]),
+        base_count=add([counts.base_count for counts in counts_list]))
+
+
+def get_read_pair_counts(counts_list):
+    """Count the reads of the first file and the bases of all files."""
+    counts = sum_counts(counts_list)
+    if len(counts_list) == 0:
+        return counts
+    else:
+        return RecordCounts(record_count=counts_list[0].record_count, base_count=counts.base_count)
+
+
+def get_input_read_counts(forward_reads_fp, reverse_reads_fp, thread_count=1):
+    """Count read pairs and bases in the pipeline input files."""
+    return get_read_pair_counts(
+        map_files(count_records, [forward_reads_fp, reverse_reads_fp], thread_count=thread_count))
+
+
+def get_surviving_read_counts(manifest):
+    """Count reads and bases in the output files of a step that are read by the next step.
+
+    Files written both compressed and uncompressed are counted once.
+    """
+    counts_list = []
+    for role in step_surviving_roles[manifest.step_name]:
+        output_files = manifest.files_for(role, compressed=True) or manifest.files_for(role, compressed=False)
+        counts_list.append(sum_counts([get_output_file_counts(f) for f in output_files]))
+    return get_read_pair_counts(counts_list)
+
+
+def get_output_file_counts(output_file):
+    return RecordCounts(record_count=output_file.record_count, base_count=output_file.base_count)
+
+
+def get_read_counts_row(sample, step_read_counts_list):
+    row = {'sample': sample}
+    for step_read_counts in step_read_counts_list:
+        row.update(step_read_counts.as_row())
+
+    read_survival = None
+    # reads removed by subsampling are not counted as lost
+    step_read_counts_list = [c for c in step_read_counts_list if c.step != 'step_00_subsample_read_pairs']
+    if len(step_read_counts_list) > 0:
+        reads_in = step_read_counts_list[0].input_counts.record_count
+        reads_out = step_read_counts_list[-1].output_counts.record_count
+        if reads_in and reads_out is not None:
+            read_survival = reads_out / reads_in
+    row['read_survival'] = '' if read_survival is None else '{:.4f}'.format(read_survival)
+    return row
+
+
+def write_read_counts(read_counts_fp, sample, step_read_counts_list):
+    row = get_read_counts_row(sample, step_read_counts_list)
+    write_read_counts_rows(read_counts_fp, [row], columns=list(row.keys()))
+
+
+def write_read_counts_rows(read_counts_fp, rows, columns):
+    with open(read_counts_fp, 'wt') as read_counts_file:
+        write_read_counts_table(read_counts_file, rows, columns)
+
+
+def write_read_counts_table(read_counts_file, rows, columns):
+    read_counts_file.write('\t'.join(columns))
+    read_counts_file.write('\n')
+    for row in rows:
+        read_counts_file.write('\t'.join(row.get(column, '') for column in columns))
+        read_counts_file.write('\n')
+
+
+def read_read_counts(read_counts_fp):
+    """Return the header and a list of rows as dictionaries of column name to string value."""
+    with open(read_counts_fp, 'rt') as read_counts_file:
+        header = read_counts_file.readline().rstrip('\n').split('\t')
+        rows = [
+            dict(zip(header, line.rstrip('\n').split('\t')))
+            for line
+            in read_counts_file
+            if len(line.strip()) > 0
+        ]
+    return header, rows
+
+
+def aggregate_read_counts(read_counts_fp_list):
+    """Combine the rows of many read count files.
+
+    Samples run with different options may have different steps, so the columns of
+    the result are the union of all columns in order of first appearance and missing
+    values are empty.
+
+    :return: (columns, rows)
+    """
+    columns = []
+    rows = []
+    for read_counts_fp in read_counts_fp_list:
+        header, file_rows = read_read_counts(read_counts_fp)
+        columns.extend(column for column in header if column not in columns)
+        rows.extend(file_rows)
+    # keep read_survival last
+    if 'read_survival' in columns:
+        columns.remove('read_survival')
+        columns.append('read_survival')
+    return columns, rows
+
+
+def get_read_counts_fp_list(work_dp_list):
+    read_counts_fp_list = []
+    for work_dp in work_dp_list:
+        read_counts_fp = os.path.join(work_dp, read_counts_file_name)
+        if os.path.exists(read_counts_fp):
+            read_counts_fp_list.append(read_counts_fp)
+        else:
+            print('no {} in "{}"'.format(read_counts_file_name, work_dp), file=sys.stderr)
+    return read_counts_fp_list
+
+
+def get_args(argv=None):
+    arg_parser = argparse.ArgumentParser(
+        description='combine {} files from many pipeline work directories'.format(read_counts_file_name))
+    arg_parser.add_argument('work_dp', nargs='+', help='pipeline work directories')
+    arg_parser.add_argument('-o', '--output-fp', default=None, help='output file, default is standard output')
+    args = arg_parser.parse_args(args=argv)
+    return args
+
+
+def main():
+    args = get_args()
+    columns, rows = aggregate_read_counts(get_read_counts_fp_list(args.work_dp))
+    if args.output_fp is None:
+        write_read_counts_table(sys.stdout, rows, columns)
+    else:
+        write_read_counts_rows(args.output_fp, rows, columns)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,191 @@
+"""
+read_table.py
+
+Write the reads that survive the pipeline to a Parquet file with one row per read so
+reads from many samples can be loaded and filtered without parsing FASTA files.
+
+Columns:
+    sample        sample prefix
+    read_id       read id as written by step_06_rewrite_sequence_ids
+    sequence      final read sequence
+    length        length of the final sequence
+    mean_quality  mean PHRED quality of the joined read after quality filtering
+    overlap       overlap in bases of the forward and reverse reads joined by fastq-join,
+                  null if the trimmed read pair could not be found
+
+Only joined read pairs survive the pipeline so every row is a joined read and the
+overlap column records how the pair was joined.
+
+FASTA and FASTQ files are read with record_batches. Only the final read id and sequence
+are decoded to str, the quality lines and trimmed reads are used as bytes.
+
+Rows are written in row groups of row_group_size reads. Parquet stores minimum and
+maximum values for each column in each row group, so a filter such as
+length > 300 skips row groups without decompressing them.
+
+The pyarrow package is required. Install it with
+    $ pip install qc18SV4[read_table]
+"""
+from qc18SV4.exceptions import PipelineException
+from qc18SV4.record_batches import read_records
+
+
+row_group_size = 100000
+
+
+def get_read_table_schema():
+    import pyarrow as pa
+
+    return pa.schema([
+        ('sample', pa.dictionary(pa.int32(), pa.string())),
+        ('read_id', pa.string()),
+        ('sequence', pa.string()),
+        ('length', pa.int32()),
+        ('mean_quality', pa.float32()),
+        ('overlap', pa.int32()),
+    ])
+
+
+def import_pyarrow_parquet():
+    try:
+        import pyarrow.parquet as pq
+    except ImportError as e:
+        raise PipelineException(
+            'writing a read table requires pyarrow, install it with "pip install qc18SV4[read_table]"') from e
+    return pq
+
+
+def read_fasta(fasta_fp):
+    """Yield (id, sequence) as str for each record in a FASTA file with sequences on one or more lines."""
+    for batch, i in read_records(fasta_fp, 'fasta'):
+        yield batch.id(i).decode('ascii'), bytes(batch.sequence(i)).decode('ascii')
+
+
+def read_fastq(fastq_fp):
+    """Yield (id, sequence, quality) for each record in a FASTQ file, the id as str and the others as memoryviews."""
+    for batch, i in read_records(fastq_fp, 'fastq'):
+        yield batch.id(i).decode('ascii'), batch.sequence(i), batch.quality(i)
+
+
+def get_mean_quality(quality, phred_offset):
+    if len(quality) == 0:
+        return None
+    else:
+        return sum(quality) / len(quality) - phred_offset
+
+
+def get_joined_reads(prefix, final_fasta_fp, quality_filtered_fastq_fp, phred_offset):
+    """Yield (read_id, sequence, quality-filtered read id, joined length, mean quality) for each final read.
+
+    fastq_to_fasta -r numbers reads 1, 2, 3, ... in the order of the quality-filtered
+    FASTQ file, so read <prefix>_N in the final FASTA file is record N of that file.
+    """
+    fastq_records = read_fastq(quality_filtered_fastq_fp)
+    fastq_record_number = 0
+    for read_id, sequence in read_fasta(final_fasta_fp):
+        read_number = int(read_id[len(prefix) + 1:])
+        while fastq_record_number < read_number:
+            try:
+                joined_read_id, joined_sequence, joined_quality = next(fastq_records)
+            except StopIteration:
+                raise PipelineException(
+                    'read "{}" not found in "{}"'.format(read_id, quality_filtered_fastq_fp))
+            fastq_record_number += 1
+        yield (
+            read_id,
+            sequence,
+            joined_read_id,
+            len(joined_sequence),
+            get_mean_quality(joined_quality, phred_offset))
+
+
+def get_overlaps(joined_reads, forward_fastq_fp, reverse_fastq_fp):
+    """Add the overlap of the joined forward and reverse reads to each joined read.
+
+    fastq-join keeps the forward read id and writes joined reads in input order, so the
+    trimmed read pairs are read in step with the joined reads.
+    """
+    if forward_fastq_fp is None or reverse_fastq_fp is None:
+        for read_id, sequence, _, _, mean_quality in joined_reads:
+            yield read_id, sequence, mean_quality, None
+        return
+
+    read_pairs = zip(read_fastq(forward_fastq_fp), read_fastq(reverse_fastq_fp))
+    for read_id, sequence, joined_read_id, joined_length, mean_quality in joined_reads:
+        overlap = None
+        for (forward_id, forward_sequence, _), (_, reverse_sequence, _) in read_pairs:
+            if forward_id == joined_read_id:
+                overlap = len(forward_sequence) + len(reverse_sequence) - joined_length
+                break
+        yield read_id, sequence, mean_quality, overlap
+
+
+def write_read_table(
+        prefix,
+        read_table_fp,
+        final_fasta_fp,
+        quality_filtered_fastq_fp,
+        forward_fastq_fp=None,
+        reverse_fastq_fp=None,
+        phred_offset=33,
+        row_group_size=row_group_size):
+    """Write one row per final read to a Parquet file.
+
+    :return: (int) number of rows written
+    """
+    pq = import_pyarrow_parquet()
+
+    schema = get_read_table_schema()
+    reads = get_overlaps(
+        get_joined_reads(prefix, final_fasta_fp, quality_filtered_fastq_fp, phred_offset),
+        forward_fastq_fp,
+        reverse_fastq_fp)
+
+    row_count = 0
+    with pq.ParquetWriter(read_table_fp, schema=schema, compression='zstd') as writer:
+        columns = ([], [], [], [])
+        for read in reads:
+            for column, value in zip(columns, read):
+                column.append(value)
+            if len(columns[0]) == row_group_size:
+                writer.write_table(get_row_group(schema, prefix, columns), row_group_size=row_group_size)
+                row_count += len(columns[0])
+                columns = ([], [], [], [])
+        if len(columns[0]) > 0 or row_count == 0:
+            writer.write_table(get_row_group(schema, prefix, columns), row_group_size=row_group_size)
+            row_count += len(columns[0])
+
+    return row_count
+
+
+def get_row_group(schema, prefix, columns):
+    import pyarrow as pa
+
+    read_ids, sequences, mean_qualities, overlaps = columns
+    return pa.Table.from_arrays(
+        [
+            pa.DictionaryArray.from_arrays(
+                pa.array([0] * len(read_ids), type=pa.int32()),
+                pa.array([prefix], type=pa.string())),
+            pa.array(read_ids, type=pa.string()),
+            pa.array(sequences, type=pa.string()),
+            pa.array([len(s) for s in sequences], type=pa.int32()),
+            pa.array(mean_qualities, type=pa.float32()),
+            pa.array(overlaps, type=pa.int32()),
+        ],
+        schema=schema)
+
+
+def read_read_tables(read_table_fp_list, columns=None, filters=None):
+    """Read rows from the read tables of many samples.
+
+    Only the requested columns are read, and row groups that cannot match the filters
+    are skipped using the minimum and maximum values stored for each row group.
+
+    :param read_table_fp_list: paths to Parquet files written by write_read_table
+    :param columns: list of column names, or None for all columns
+    :param filters: pyarrow filters such as [('length', '>', 300), ('mean_quality', '>=', 35)]
+    :return: pyarrow.Table
+    """
+    pq = import_pyarrow_parquet()
+    return pq.ParquetDataset(list(read_table_fp_list), filters=filters).read(columns=columns)
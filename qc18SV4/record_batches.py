@@ -0,0 +1,324 @@
+"""
+record_batches.py
+
+Read FASTA and FASTQ files in batches of records for steps that process reads in the
+pipeline process rather than in an external tool.
+
+A file, plain, gzip, or zstd, is read in large binary chunks. Each batch holds one
+buffer of whole records and arrays of offsets into it, so no Python object is created
+per record until a field is asked for, and then only a memoryview of the buffer.
+Records that span two chunks are carried into the next batch: the partial record is
+copied to the front of the next buffer and the chunk is read in after it with readinto,
+so the bytes of a chunk are not copied again. Each batch has its own buffer because
+memoryviews of a batch, for example in a RecordBatchWriter, may outlive it. FASTA
+sequences may span several lines, FASTQ records must have four lines.
+
+    for batch in read_record_batches('reads.fastq.gz', 'fastq'):
+        for i in range(len(batch)):
+            batch.id(i), batch.sequence(i), batch.quality(i)
+
+RecordBatchWriter writes whole batches back unchanged with one write, single records as
+they were read, or records built from fields of a batch, buffering output into large
+writes. read_records yields the records of a file one at a time so that two files, such
+as the forward and reverse reads of a pair, can be read in step.
+"""
+from array import array
+
+from qc18SV4.compression import open_compressed
+from qc18SV4.exceptions import PipelineException
+
+
+default_chunk_size = 4 * 2**20
+
+header_markers = {'fasta': b'>', 'fastq': b'@'}
+
+
+class RecordBatch:
+    """Records of one file format as offsets into a single buffer.
+
+    For record i the header, without '>' or '@', is buffer[header_starts[i]:header_ends[i]],
+    the sequence is buffer[sequence_starts[i]:sequence_ends[i]], and the whole record with
+    its final line end is buffer[record_starts[i]:record_ends[i]]. FASTQ batches have
+    quality offsets and FASTA batches do not.
+    """
+    __slots__ = (
+        'file_format', 'buffer',
+        'record_starts', 'record_ends',
+        'header_starts', 'header_ends',
+        'sequence_starts', 'sequence_ends',
+        'quality_starts', 'quality_ends',
+        'multiline_sequences')
+
+    def __init__(self, file_format, buffer):
+        self.file_format = file_format
+        self.buffer = memoryview(buffer)
+        self.record_starts = array('q')
+        self.record_ends = array('q')
+        self.header_starts = array('q')
+        self.header_ends = array('q')
+        self.sequence_starts = array('q')
+        self.sequence_ends = array('q')
+        if file_format == 'fastq':
+            self.quality_starts = array('q')
+            self.quality_ends = array('q')
+        else:
+            self.quality_starts = None
+            self.quality_ends = None
+        # True if any FASTA sequence in the batch has more than one line
+        self.multiline_sequences = False
+
+    def __len__(self):
+        return len(self.record_starts)
+
+    def header(self, i):
+        return self.buffer[self.header_starts[i]:self.header_ends[i]]
+
+    def id(self, i):
+        """Return the header up to the first space or tab as bytes."""
+        header = self.header(i).tobytes()
+        return header.split(None, 1)[0] if len(header) > 0 else header
+
+    def sequence(self, i):
+        """Return the sequence as a memoryview, or as bytes without line ends if it spans several lines."""
+        sequence = self.buffer[self.sequence_starts[i]:self.sequence_ends[i]]
+        if self.multiline_sequences:
+            return sequence.tobytes().replace(b'\r', b'').replace(b'\n', b'')
+        else:
+            return sequence
+
+    def sequence_length(self, i):
+        if self.multiline_sequences:
+            return len(self.sequence(i))
+        else:
+            return self.sequence_ends[i] - self.sequence_starts[i]
+
+    def quality(self, i):
+        return self.buffer[self.quality_starts[i]:self.quality_ends[i]]
+
+    def record(self, i):
+        return self.buffer[self.record_starts[i]:self.record_ends[i]]
+
+    @property
+    def base_count(self):
+        if self.multiline_sequences:
+            return sum(self.sequence_length(i) for i in range(len(self)))
+        else:
+            return sum(self.sequence_ends) - sum(self.sequence_starts)
+
+    def as_bytes(self):
+        """Return all records of the batch as they were read."""
+        if len(self) == 0:
+            return b''
+        return self.buffer[self.record_starts[0]:self.record_ends[-1]]
+
+
+def line_content_end(buffer, line_end):
+    """Return the end of a line before '\\n' or '\\r\\n'."""
+    if line_end > 0 and buffer[line_end - 1] == 13:
+        return line_end - 1
+    else:
+        return line_end
+
+
+def parse_fastq_records(buffer, batch, start, at_eof):
+    """Add the complete FASTQ records in buffer from start to batch.
+
+    :return: offset of the first byte not parsed
+    """
+    buffer_length = len(buffer)
+    find = buffer.find
+    while start < buffer_length:
+        header_end = find(b'\n', start)
+        sequence_end = find(b'\n', header_end + 1) if header_end >= 0 else -1
+        plus_end = find(b'\n', sequence_end + 1) if sequence_end >= 0 else -1
+        quality_end = find(b'\n', plus_end + 1) if plus_end >= 0 else -1
+        if quality_end < 0:
+            if at_eof and plus_end >= 0 and plus_end + 1 < buffer_length:
+                # the last line has no line end
+                quality_end = buffer_length
+            elif at_eof and buffer[start:].strip():
+                raise PipelineException('incomplete FASTQ record at offset {}'.format(start))
+            else:
+                return start
+        if buffer[start] != 64:
+            raise PipelineException('FASTQ record at offset {} does not begin with "@"'.format(start))
+        batch.record_starts.append(start)
+        batch.header_starts.append(start + 1)
+        batch.header_ends.append(line_content_end(buffer, header_end))
+        batch.sequence_starts.append(header_end + 1)
+        batch.sequence_ends.append(line_content_end(buffer, sequence_end))
+        batch.quality_starts.append(plus_end + 1)
+        batch.quality_ends.append(line_content_end(buffer, quality_end))
+        start = min(quality_end + 1, buffer_length)
+        batch.record_ends.append(start)
+    return start
+
+
+def parse_fasta_records(buffer, batch, start, at_eof):
+    """Add the complete FASTA records in buffer from start to batch.
+
+    A record is complete when the next record begins or the file ends.
+
+    :return: offset of the first byte not parsed
+    """
+    buffer_length = len(buffer)
+    find = buffer.find
+    # skip blank lines before the first record
+    while start < buffer_length and buffer[start] in (10, 13):
+        start += 1
+    while start < buffer_length:
+        if buffer[start] != 62:
+            raise PipelineException('FASTA record at offset {} does not begin with ">"'.format(start))
+        header_end = find(b'\n', start)
+        if header_end < 0:
+            if at_eof:
+                header_end = buffer_length
+            else:
+                return start
+        next_start = find(b'\n>', header_end)
+        if next_start < 0:
+            if not at_eof:
+                return start
+            record_end = buffer_length
+        else:
+            record_end = next_start + 1
+        sequence_start = min(header_end + 1, record_end)
+        sequence_end = record_end
+        # drop the line ends after the sequence
+        while sequence_end > sequence_start and buffer[sequence_end - 1] in (10, 13):
+            sequence_end -= 1
+        if find(b'\n', sequence_start, sequence_end) >= 0:
+            batch.multiline_sequences = True
+        batch.record_starts.append(start)
+        batch.header_starts.append(start + 1)
+        batch.header_ends.append(line_content_end(buffer, header_end))
+        batch.sequence_starts.append(sequence_start)
+        batch.sequence_ends.append(sequence_end)
+        batch.record_ends.append(record_end)
+        start = record_end
+    return start
+
+
+record_parsers = {'fasta': parse_fasta_records, 'fastq': parse_fastq_records}
+
+
+def read_record_batches(fp, file_format, chunk_size=default_chunk_size):
+    """Yield a RecordBatch of the complete records in each chunk of a FASTA or FASTQ file.
+
+    :param fp: path to a plain, gzip, or zstd file
+    :param file_format: 'fasta' or 'fastq'
+    :param chunk_size: bytes read at a time, a batch may be larger if a record is larger
+    """
+    if file_format not in record_parsers:
+        raise PipelineException('file format must be fasta or fastq, not "{}"'.format(file_format))
+    parse_records = record_parsers[file_format]
+    remainder = b''
+    with open_compressed(fp, 'rb') as input_file:
+        while True:
+            buffer = bytearray(len(remainder) + chunk_size)
+            buffer[:len(remainder)] = remainder
+            read_length = read_into(input_file, memoryview(buffer)[len(remainder):])
+            at_eof = read_length < chunk_size
+            if at_eof:
+                del buffer[len(remainder) + read_length:]
+            batch = RecordBatch(file_format, buffer)
+            end = parse_records(buffer, batch, 0, at_eof)
+            remainder = buffer[end:]
+            if len(batch) > 0:
+                yield batch
+            if at_eof:
+                return
+
+
+def read_records(fp, file_format, chunk_size=default_chunk_size):
+    """Yield (batch, i) for each record of a FASTA or FASTQ file, to read two files record by record.
+
+    A record is only valid while its batch is, copy fields that are kept longer.
+    """
+    for batch in read_record_batches(fp, file_format, chunk_size=chunk_size):
+        for i in range(len(batch)):
+            yield batch, i
+
+
+def read_into(input_file, view):
+    """Fill view from a binary file.
+
+    :return: number of bytes read, less than len(view) only at the end of the file
+    """
+    read_length = 0
+    while read_length < len(view):
+        byte_count = input_file.readinto(view[read_length:])
+        if not byte_count:
+            break
+        read_length += byte_count
+    return read_length
+
+
+class RecordBatchWriter:
+    """Write FASTA or FASTQ records to a binary file in large writes.
+
+    :param line_length: wrap FASTA sequences at this many bases, None to write each sequence on one line
+    """
+    def __init__(self, output_file, file_format, line_length=None, buffer_size=default_chunk_size):
+        if file_format not in header_markers:
+            raise PipelineException('file format must be fasta or fastq, not "{}"'.format(file_format))
+        self.output_file = output_file
+        self.file_format = file_format
+        self.header_marker = header_markers[file_format]
+        self.line_length = line_length
+        self.buffer_size = buffer_size
+        self.record_count = 0
+        self.base_count = 0
+        self._parts = []
+        self._buffered_bytes = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.flush()
+
+    def _append(self, *parts):
+        self._parts.extend(parts)
+        self._buffered_bytes += sum(len(part) for part in parts)
+        if self._buffered_bytes >= self.buffer_size:
+            self.flush()
+
+    def flush(self):
+        if len(self._parts) > 0:
+            self.output_file.write(b''.join(self._parts))
+            self._parts = []
+            self._buffered_bytes = 0
+
+    def write_batch(self, batch):
+        """Write every record of a batch of the same format unchanged."""
+        if batch.file_format != self.file_format:
+            raise PipelineException('can not write a {} batch as {}'.format(batch.file_format, self.file_format))
+        self.flush()
+        self.output_file.write(batch.as_bytes())
+        self.record_count += len(batch)
+        self.base_count += batch.base_count
+
+    def write_record_bytes(self, record, base_count):
+        """Write one whole record as it was read, for example from RecordBatch.record, adding a missing final line end."""
+        self.record_count += 1
+        self.base_count += base_count
+        if len(record) > 0 and record[-1] != 10:
+            self._append(record, b'\n')
+        else:
+            self._append(record)
+
+    def write_record(self, header, sequence, quality=None):
+        """Write one record from bytes-like header (without '>' or '@'), sequence, and quality."""
+        self.record_count += 1
+        self.base_count += len(sequence)
+        if self.file_format == 'fastq':
+            self._append(b'@', header, b'\n', sequence, b'\n+\n', quality, b'\n')
+        elif len(sequence) == 0:
+            self._append(b'>', header, b'\n')
+        elif self.line_length is None or len(sequence) <= self.line_length:
+            self._append(b'>', header, b'\n', sequence, b'\n')
+        else:
+            self._append(b'>', header, b'\n')
+            for line_start in range(0, len(sequence), self.line_length):
+                self._append(sequence[line_start:line_start + self.line_length], b'\n')
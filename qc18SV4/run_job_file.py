@@ -0,0 +1,341 @@
+"""
+run_job_file.py
+
+Run the commands of a Launcher job file, or pipeline commands for the read file pairs
+in an input directory, on the cores of one machine. This does the work of TACC Launcher
+with LAUNCHER_SCHED=dynamic on workstations and clusters without Launcher.
+
+Each task reserves a number of cores, taken from the pipeline's -c/--core-count argument
+unless --cores-per-task is specified, in which case -c in each command is replaced with it.
+Tasks are taken from a single queue and started whenever enough cores are free. Each task
+is restricted to its reserved cores before its command starts if the platform supports
+os.sched_setaffinity.
+
+Start and end times for each task are written to a tab-separated report file. With
+--trace-fp each task is also written as a trace event and every pipeline it runs writes
+trace.jsonl to its work directory, see trace.py.
+
+With --jvm-workers N, N long-lived JVM workers are started for the batch and pipelines
+run TrimmomaticPE and FastQC in them rather than starting a JVM for each command, see
+jvm_worker.py.
+"""
+import argparse
+from functools import partial
+import logging
+import os
+import queue
+import re
+import subprocess
+import sys
+import threading
+import time
+
+from qc18SV4.exceptions import PipelineException
+from qc18SV4.jvm_worker import JvmWorkerPool, jvm_worker_env_var
+from qc18SV4.trace import span, start_tracing, stop_tracing, trace_env_var
+from qc18SV4.write_launcher_job_file import get_forward_reverse_read_pairs, get_pipeline_command_line
+
+
+def get_args(argv=None):
+    arg_parser = argparse.ArgumentParser()
+    arg_parser.add_argument('-j', '--job-fp', help='Launcher job file to be run')
+    arg_parser.add_argument('-i', '--input-dp', help='directory of input files, used if no job file is given')
+    arg_parser.add_argument('-w', '--work-dp-template', help='template for working directory, used with --input-dp')
+    arg_parser.add_argument('-c', '--core-count', default=1, help='number of cores for each pipeline, used with --input-dp')
+    arg_parser.add_argument('-p', '--prefix-regex', help='regular expression matching the input file name with named group <prefix>')
+    arg_parser.add_argument('--forward-primer', default='CCAGCASCYGCGGTAATTCC', help='forward primer to be clipped')
+    arg_parser.add_argument('--reverse-primer', default='TYRATCAAGAACGAAAGT', help='reverse primer to be clipped')
+    arg_parser.add_argument('--min-overlap', type=int, default=20, help='minimum overlap for joining paired ends')
+    arg_parser.add_argument('--phred', default='33', help='33 or 64')
+    arg_parser.add_argument('--cores-per-task', type=int, default=None, help='cores reserved for each task, replaces -c in job file commands')
+    arg_parser.add_argument('--total-cores', type=int, default=None, help='cores available to all tasks, default is all cores available to this process')
+    arg_parser.add_argument('--report-fp', default='task_report.tsv', help='tab-separated file of task start and end times')
+    arg_parser.add_argument('--trace-fp', default=None, help='trace events of each task, also turns on tracing in each pipeline')
+    arg_parser.add_argument('--jvm-workers', type=int, default=0, help='number of JVM workers for TrimmomaticPE and FastQC, 0 to run them as subprocesses')
+    arg_parser.add_argument('--jvm-worker-dp', default='jvm_workers', help='directory for JVM worker files, used with --jvm-workers')
+    args = arg_parser.parse_args(argv)
+
+    if args.job_fp is None and args.input_dp is None:
+        arg_parser.error('one of --job-fp or --input-dp is required')
+    elif args.input_dp is not None and (args.work_dp_template is None or args.prefix_regex is None):
+        arg_parser.error('--input-dp requires --work-dp-template and --prefix-regex')
+
+    return args
+
+
+def main():
+    logging.basicConfig(level=logging.INFO)
+    args = get_args()
+
+    if args.job_fp is not None:
+        command_lines = read_job_file(args.job_fp)
+    else:
+        command_lines = [
+            get_pipeline_command_line(
+                forward_fp=forward_fp,
+                work_dp_template=args.work_dp_template,
+                forward_primer=args.forward_primer,
+                reverse_primer=args.reverse_primer,
+                prefix_regex=args.prefix_regex,
+                phred=args.phred,
+                core_count=args.core_count,
+                min_overlap=args.min_overlap)
+            for forward_fp, _
+            in sorted(get_forward_reverse_read_pairs(args.input_dp))
+        ]
+
+    if args.trace_fp is not None:
+        # pipelines started by tasks inherit the environment
+        os.environ[trace_env_var] = '1'
+        start_tracing(args.trace_fp)
+
+    jvm_worker_pool = None
+    if args.jvm_workers > 0:
+        jvm_worker_pool = JvmWorkerPool(worker_dp=os.path.abspath(args.jvm_worker_dp), worker_count=args.jvm_workers)
+        if jvm_worker_pool.start() > 0:
+            os.environ[jvm_worker_env_var] = jvm_worker_pool.worker_dp
+
+    tasks = get_tasks(command_lines, cores_per_task=args.cores_per_task)
+    scheduler = WorkQueueScheduler(tasks=tasks, total_cores=args.total_cores)
+    try:
+        scheduler.run()
+    finally:
+        if jvm_worker_pool is not None:
+            jvm_worker_pool.stop()
+        stop_tracing()
+    scheduler.write_report(args.report_fp)
+
+    failed_tasks = [task for task in tasks if task.returncode != 0]
+    if len(failed_tasks) > 0:
+        sys.exit(1)
+
+
+def read_job_file(job_fp):
+    """Return the non-empty, non-comment lines of a Launcher job file."""
+    with open(job_fp, 'rt') as job_file:
+        return [
+            line.strip()
+            for line
+            in job_file
+            if len(line.strip()) > 0 and not line.lstrip().startswith('#')
+        ]
+
+
+core_count_pattern = re.compile(r'(?:^|\s)(?:-c|--core-count)(?:\s+|=)(?P<core_count>\d+)')
+
+
+def get_task_core_count(command_line, default=1):
+    """Return the number of cores given to the pipeline in command_line."""
+    m = core_count_pattern.search(command_line)
+    if m is None:
+        return default
+    else:
+        return int(m.group('core_count'))
+
+
+def set_task_core_count(command_line, core_count):
+    """Return command_line with the number of cores given to the pipeline replaced by core_count."""
+    m = core_count_pattern.search(command_line)
+    if m is None:
+        return command_line
+    else:
+        return command_line[:m.start('core_count')] + str(core_count) + command_line[m.end('core_count'):]
+
+
+def get_tasks(command_lines, cores_per_task=None, first_task_id=0):
+    if cores_per_task is not None:
+        command_lines = [set_task_core_count(command_line, cores_per_task) for command_line in command_lines]
+    return [
+        Task(
+            task_id=i,
+            command_line=command_line,
+            core_count=get_task_core_count(command_line) if cores_per_task is None else cores_per_task)
+        for i, command_line
+        in enumerate(command_lines, start=first_task_id)
+    ]
+
+
+def get_available_cores():
+    if hasattr(os, 'sched_getaffinity'):
+        return sorted(os.sched_getaffinity(0))
+    else:
+        return list(range(os.cpu_count() or 1))
+
+
+class Task:
+    def __init__(self, task_id, command_line, core_count):
+        self.task_id = task_id
+        self.command_line = command_line
+        self.core_count = core_count
+
+        self.cores = None
+        self.start_time = None
+        self.end_time = None
+        self.returncode = None
+
+    def __repr__(self):
+        return 'Task(task_id={!r}, command_line={!r}, core_count={!r})'.format(
+            self.task_id, self.command_line, self.core_count)
+
+    @property
+    def elapsed_time(self):
+        return self.end_time - self.start_time
+
+
+class WorkQueueScheduler:
+    """Run tasks from a queue, starting each one as soon as enough cores are free.
+
+    Tasks are considered in queue order and the first task that fits in the free cores
+    is started, so small tasks are packed around large ones.
+
+    run starts the tasks given to the scheduler and waits for all of them. A long-lived
+    scheduler can instead be given more tasks with add_tasks while earlier tasks are
+    running, and collect them with wait_for_tasks as they finish.
+    """
+    def __init__(self, tasks=(), total_cores=None):
+        self.tasks = []
+
+        self.available_cores = get_available_cores()
+        if total_cores is not None:
+            self.available_cores = self.available_cores[:total_cores]
+        if len(self.available_cores) == 0:
+            raise PipelineException('no cores are available to run tasks')
+
+        self.pending_tasks = []
+        self.free_cores = list(self.available_cores)
+        self.running_task_count = 0
+        self.finished_task_queue = queue.Queue()
+
+        self.start_time = None
+        self.end_time = None
+
+        self.add_tasks(tasks)
+
+    def add_tasks(self, tasks):
+        """Queue tasks and, once the scheduler has started, start those that fit in the free cores."""
+        for task in tasks:
+            if task.core_count > len(self.available_cores):
+                logging.getLogger(name=self.__class__.__name__).warning(
+                    'task %d requests %d cores but only %d are available',
+                    task.task_id, task.core_count, len(self.available_cores))
+                task.core_count = len(self.available_cores)
+            self.tasks.append(task)
+            self.pending_tasks.append(task)
+        if self.start_time is not None:
+            self.start_ready_tasks()
+
+    def start_ready_tasks(self):
+        """Start every pending task that fits in the free cores."""
+        if self.start_time is None:
+            self.start_time = time.time()
+        for task in list(self.pending_tasks):
+            if task.core_count <= len(self.free_cores):
+                self.pending_tasks.remove(task)
+                task.cores = self.free_cores[:task.core_count]
+                del self.free_cores[:task.core_count]
+                self.start_task(task, self.finished_task_queue)
+                self.running_task_count += 1
+
+    @property
+    def unfinished_task_count(self):
+        return len(self.pending_tasks) + self.running_task_count
+
+    def wait_for_tasks(self, timeout=None):
+        """Wait up to timeout seconds, or until a task finishes if timeout is None, and start queued tasks.
+
+        :return: list of the tasks that finished
+        """
+        log = logging.getLogger(name=self.__class__.__name__)
+        self.start_ready_tasks()
+        finished_tasks = []
+        deadline = None if timeout is None else time.time() + timeout
+        while self.running_task_count > 0:
+            try:
+                if len(finished_tasks) > 0:
+                    finished_task = self.finished_task_queue.get_nowait()
+                elif deadline is None:
+                    finished_task = self.finished_task_queue.get()
+                else:
+                    finished_task = self.finished_task_queue.get(timeout=max(0.0, deadline - time.time()))
+            except queue.Empty:
+                break
+            self.running_task_count -= 1
+            self.free_cores.extend(finished_task.cores)
+            self.free_cores.sort()
+            log.info(
+                'task %d finished with return code %d in %.1fs',
+                finished_task.task_id, finished_task.returncode, finished_task.elapsed_time)
+            finished_tasks.append(finished_task)
+        self.start_ready_tasks()
+        self.end_time = time.time()
+        return finished_tasks
+
+    def run(self):
+        log = logging.getLogger(name=self.__class__.__name__)
+        log.info('running %d tasks on %d cores', len(self.tasks), len(self.available_cores))
+
+        self.start_time = time.time()
+        while self.unfinished_task_count > 0:
+            self.wait_for_tasks()
+        self.end_time = time.time()
+
+        log.info('core utilization: %.1f%%', 100.0 * self.get_core_utilization())
+        return self.tasks
+
+    def start_task(self, task, finished_task_queue):
+        log = logging.getLogger(name=self.__class__.__name__)
+        log.info('starting task %d on cores %s: %s', task.task_id, task.cores, task.command_line)
+
+        def run_task():
+            task.start_time = time.time()
+            with span('task {}'.format(task.task_id), 'task', cores=task.cores, command_line=task.command_line):
+                try:
+                    # the affinity is set in the child before the shell starts so every
+                    # process started by the task inherits it
+                    process = subprocess.Popen(
+                        task.command_line, shell=True, preexec_fn=get_set_affinity_fn(task.cores))
+                    task.returncode = process.wait()
+                except Exception as e:
+                    log.exception(e)
+                    task.returncode = -1
+            task.end_time = time.time()
+            finished_task_queue.put(task)
+
+        threading.Thread(target=run_task, daemon=True).start()
+
+    def get_core_utilization(self):
+        """Return the fraction of available core-seconds used by tasks."""
+        elapsed_time = self.end_time - self.start_time
+        if elapsed_time <= 0.0:
+            return 0.0
+        busy_core_seconds = sum(task.core_count * task.elapsed_time for task in self.tasks)
+        return busy_core_seconds / (len(self.available_cores) * elapsed_time)
+
+    def write_report(self, report_fp):
+        with open(report_fp, 'wt') as report_file:
+            report_file.write('\t'.join(
+                ('task_id', 'core_count', 'cores', 'start_time', 'end_time', 'elapsed_time', 'returncode', 'command_line')))
+            report_file.write('\n')
+            for task in self.tasks:
+                report_file.write('\t'.join((
+                    str(task.task_id),
+                    str(task.core_count),
+                    ','.join(str(c) for c in task.cores),
+                    '{:.3f}'.format(task.start_time - self.start_time),
+                    '{:.3f}'.format(task.end_time - self.start_time),
+                    '{:.3f}'.format(task.elapsed_time),
+                    str(task.returncode),
+                    task.command_line)))
+                report_file.write('\n')
+
+
+def get_set_affinity_fn(cores):
+    """Return a function that restricts the calling process to cores, or None if the platform cannot."""
+    if hasattr(os, 'sched_setaffinity'):
+        return partial(os.sched_setaffinity, 0, cores)
+    else:
+        return None
+
+
+if __name__ == '__main__':
+    main()
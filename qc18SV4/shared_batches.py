@@ -0,0 +1,277 @@
+"""
+shared_batches.py
+
+Filter or transform the records of a FASTA or FASTQ file with several worker processes
+without pickling reads between them.
+
+Record batches are passed through a ring of fixed-size slots in one block of shared
+memory (multiprocessing.shared_memory, Python 3.8 or later):
+
+    reader process      reads the input, plain, gzip, or zstd, in batches and copies each
+                        batch with its record offsets into a free slot
+    worker processes    transform the records of a slot in place
+    calling process     writes the slots in input order and returns them to the free slots
+
+Only batch sequence numbers and slot indices pass through the queues. A transform is a
+module level function, so it can be used with any start method. It is given the
+RecordBatch of a slot, whose buffer and offsets are views of shared memory, and a
+writable memoryview of the slot before the offsets. It writes its output to the start
+of the slot and returns the output length in bytes and the output record count:
+
+    def keep_long_reads(batch, slot):
+        return keep_records(batch, slot, [i for i in range(len(batch)) if batch.sequence_length(i) >= 100])
+
+    with open('long.fastq', 'wb') as output_file:
+        record_count = transform_records('reads.fastq.gz', 'fastq', output_file, keep_long_reads, worker_count=4)
+
+Output longer than the input overwrites input records, so it should be written after
+every field it needs has been read. The reader fills at most half of each slot by
+default to leave room for longer output.
+"""
+import logging
+from multiprocessing import get_context, shared_memory
+import queue
+import traceback
+
+from qc18SV4.exceptions import PipelineException
+from qc18SV4.record_batches import RecordBatch, default_chunk_size, read_record_batches
+
+
+default_slot_size = 2 * default_chunk_size
+
+# the metadata of each slot is
+#   input length, input record count, offsets start, multiline sequences, output length, output record count
+slot_metadata_length = 6
+offset_item_size = 8
+
+poll_seconds = 1.0
+
+
+def get_offset_names(file_format):
+    """Return the names of the offset arrays of a RecordBatch in the order they are stored in a slot."""
+    offset_names = ['record_starts', 'record_ends', 'header_starts', 'header_ends', 'sequence_starts', 'sequence_ends']
+    if file_format == 'fastq':
+        offset_names.extend(['quality_starts', 'quality_ends'])
+    return offset_names
+
+
+class SharedBatchRing:
+    """Fixed-size slots for record batches in one block of shared memory.
+
+    The block begins with the metadata of every slot followed by the slots. A batch is
+    stored at the start of its slot and its offsets at the end. A ring passed to another
+    process attaches to the same block by name.
+    """
+    def __init__(self, slot_count, slot_size=default_slot_size, name=None):
+        self.slot_count = slot_count
+        # slots begin on 8 byte boundaries so offsets can be viewed as 64-bit integers
+        self.slot_size = slot_size - slot_size % offset_item_size
+        self.metadata_size = slot_count * slot_metadata_length * offset_item_size
+        if name is None:
+            self.shared_memory = shared_memory.SharedMemory(
+                create=True, size=self.metadata_size + slot_count * self.slot_size)
+        else:
+            self.shared_memory = shared_memory.SharedMemory(name=name)
+        self.metadata = self.shared_memory.buf[:self.metadata_size].cast('q')
+
+    def __getstate__(self):
+        return {'slot_count': self.slot_count, 'slot_size': self.slot_size, 'name': self.shared_memory.name}
+
+    def __setstate__(self, state):
+        self.__init__(**state)
+
+    def slot(self, slot_index):
+        slot_start = self.metadata_size + slot_index * self.slot_size
+        return self.shared_memory.buf[slot_start:slot_start + self.slot_size]
+
+    def put_batch(self, slot_index, batch):
+        """Copy the buffer of a batch and its offsets into a slot."""
+        input_length = batch.record_ends[-1]
+        offset_names = get_offset_names(batch.file_format)
+        offsets_start = self.slot_size - len(offset_names) * len(batch) * offset_item_size
+        if input_length > offsets_start:
+            raise PipelineException(
+                'a batch of {} bytes and {} records does not fit in a slot of {} bytes'.format(
+                    input_length, len(batch), self.slot_size))
+        slot = self.slot(slot_index)
+        slot[:input_length] = batch.buffer[:input_length]
+        offset_start = offsets_start
+        for offset_name in offset_names:
+            offsets = memoryview(getattr(batch, offset_name)).cast('B')
+            slot[offset_start:offset_start + len(offsets)] = offsets
+            offset_start += len(offsets)
+        metadata_start = slot_index * slot_metadata_length
+        self.metadata[metadata_start] = input_length
+        self.metadata[metadata_start + 1] = len(batch)
+        self.metadata[metadata_start + 2] = offsets_start
+        self.metadata[metadata_start + 3] = int(batch.multiline_sequences)
+
+    def get_batch(self, slot_index, file_format):
+        """Return the RecordBatch in a slot and a memoryview of the slot before the offsets."""
+        metadata_start = slot_index * slot_metadata_length
+        input_length, record_count, offsets_start, multiline_sequences = \
+            self.metadata[metadata_start:metadata_start + 4].tolist()
+        slot = self.slot(slot_index)
+        batch = RecordBatch(file_format, slot[:input_length])
+        offset_names = get_offset_names(file_format)
+        offsets = slot[offsets_start:offsets_start + len(offset_names) * record_count * offset_item_size].cast('q')
+        for offset_index, offset_name in enumerate(offset_names):
+            setattr(batch, offset_name, offsets[offset_index * record_count:(offset_index + 1) * record_count])
+        batch.multiline_sequences = bool(multiline_sequences)
+        return batch, slot[:offsets_start]
+
+    def set_output(self, slot_index, output_length, output_record_count):
+        metadata_start = slot_index * slot_metadata_length
+        self.metadata[metadata_start + 4] = output_length
+        self.metadata[metadata_start + 5] = output_record_count
+
+    def get_output(self, slot_index):
+        """Return the output of a slot as a memoryview and the output record count."""
+        metadata_start = slot_index * slot_metadata_length
+        output_length, output_record_count = self.metadata[metadata_start + 4:metadata_start + 6].tolist()
+        return self.slot(slot_index)[:output_length], output_record_count
+
+    def close(self):
+        self.metadata.release()
+        self.shared_memory.close()
+
+    def unlink(self):
+        self.shared_memory.unlink()
+
+
+def keep_records(batch, slot, record_indices):
+    """Move the records of a batch with the given increasing indices to the start of its slot.
+
+    :return: (output length in bytes, output record count)
+    """
+    output_length = 0
+    record_count = 0
+    for i in record_indices:
+        record_start = batch.record_starts[i]
+        record_length = batch.record_ends[i] - record_start
+        if record_start != output_length:
+            slot[output_length:output_length + record_length] = slot[record_start:record_start + record_length]
+        output_length += record_length
+        record_count += 1
+    return output_length, record_count
+
+
+def fill_slots(ring, input_fp, file_format, batch_size, free_slots, filled_slots, done_slots, worker_count):
+    """Reader process: copy batches of input records into free slots.
+
+    Sends (sequence number, slot index) to the workers, then one None for each worker,
+    and finally ('end', batch count) to the writer.
+    """
+    try:
+        sequence_number = 0
+        for batch in read_record_batches(input_fp, file_format, chunk_size=batch_size):
+            slot_index = free_slots.get()
+            ring.put_batch(slot_index, batch)
+            filled_slots.put((sequence_number, slot_index))
+            sequence_number += 1
+        for _ in range(worker_count):
+            filled_slots.put(None)
+        done_slots.put(('end', sequence_number))
+    except Exception:
+        done_slots.put(('error', 'reading "{}" failed:\n{}'.format(input_fp, traceback.format_exc())))
+    finally:
+        ring.close()
+
+
+def transform_slot(ring, slot_index, file_format, transform):
+    batch, slot = ring.get_batch(slot_index, file_format)
+    output_length, output_record_count = transform(batch, slot)
+    if output_length > len(slot):
+        raise PipelineException('output of {} bytes is longer than the slot capacity {}'.format(output_length, len(slot)))
+    ring.set_output(slot_index, output_length, output_record_count)
+
+
+def transform_slots(ring, file_format, transform, filled_slots, done_slots):
+    """Worker process: transform filled slots until a None is received."""
+    try:
+        for sequence_number, slot_index in iter(filled_slots.get, None):
+            transform_slot(ring, slot_index, file_format, transform)
+            done_slots.put((sequence_number, slot_index))
+    except Exception:
+        done_slots.put(('error', 'transform failed:\n{}'.format(traceback.format_exc())))
+    finally:
+        ring.close()
+
+
+def transform_records(
+        input_fp, file_format, output_file, transform,
+        worker_count=2, slot_count=None, slot_size=default_slot_size, batch_size=None):
+    """Transform the records of a FASTA or FASTQ file in worker processes and write them in input order.
+
+    :param output_file: binary file the output of each batch is written to
+    :param transform: module level function of (RecordBatch, slot memoryview) returning (output length, record count)
+    :param slot_count: slots in the ring, default is 2 for each worker and the reader and writer
+    :param batch_size: bytes of input read for each slot, default is half the slot size
+    :return: number of output records
+    """
+    log = logging.getLogger(name=__name__)
+    if slot_count is None:
+        slot_count = 2 * (worker_count + 2)
+    if batch_size is None:
+        batch_size = slot_size // 2
+
+    context = get_context()
+    free_slots = context.Queue()
+    filled_slots = context.Queue()
+    done_slots = context.Queue()
+    ring = SharedBatchRing(slot_count, slot_size)
+    processes = []
+    try:
+        for slot_index in range(slot_count):
+            free_slots.put(slot_index)
+        processes.append(context.Process(
+            target=fill_slots,
+            args=(ring, input_fp, file_format, batch_size, free_slots, filled_slots, done_slots, worker_count)))
+        processes.extend(
+            context.Process(target=transform_slots, args=(ring, file_format, transform, filled_slots, done_slots))
+            for _ in range(worker_count))
+        for process in processes:
+            process.start()
+        log.info(
+            'transforming "%s" with %d workers and %d slots of %d bytes', input_fp, worker_count, slot_count, slot_size)
+
+        # batches are finished out of order so hold their slots until every earlier batch is written
+        finished_slots = {}
+        next_sequence_number = 0
+        batch_count = None
+        record_count = 0
+        while batch_count is None or next_sequence_number < batch_count:
+            try:
+                message = done_slots.get(timeout=poll_seconds)
+            except queue.Empty:
+                failed_processes = [p for p in processes if p.exitcode not in (None, 0)]
+                if len(failed_processes) > 0:
+                    raise PipelineException(
+                        'process {} exited with code {}'.format(failed_processes[0].pid, failed_processes[0].exitcode))
+                continue
+            if message[0] == 'error':
+                raise PipelineException(message[1])
+            elif message[0] == 'end':
+                batch_count = message[1]
+            else:
+                sequence_number, slot_index = message
+                finished_slots[sequence_number] = slot_index
+            while next_sequence_number in finished_slots:
+                slot_index = finished_slots.pop(next_sequence_number)
+                output, output_record_count = ring.get_output(slot_index)
+                output_file.write(output)
+                output.release()
+                record_count += output_record_count
+                free_slots.put(slot_index)
+                next_sequence_number += 1
+
+        for process in processes:
+            process.join()
+        return record_count
+    finally:
+        for process in processes:
+            if process.is_alive():
+                process.terminate()
+                process.join()
+        ring.close()
+        ring.unlink()
@@ -0,0 +1,117 @@
+"""
+step_graph.py
+
+Run the tasks of a pipeline, steps, FastQC runs, and deletion of intermediate files, as
+a dependency graph so tasks that do not depend on each other run at the same time
+without using more than a budget of cores.
+
+Each task declares the roles of the files it reads, writes, and deletes, in the sense of
+the roles of StepManifest, and dependencies are derived from them in the order tasks
+were added:
+
+    read after write    a task that reads a role runs after the last earlier task that writes it
+    delete after read   a task that deletes a role runs after every earlier task that reads or writes it
+
+so a task that deletes files can not remove them from under a task that is still reading
+them. Each task also declares the cores it uses, a number or a function of the results of
+earlier tasks. A task is started when its dependencies are done and its cores are free,
+and ready tasks are started in the order they were added. A task that asks for more cores
+than the budget is given the whole budget.
+
+    graph = StepGraph()
+    graph.add('trim', lambda results: trim(), writes=('trimmed', ), cores=4)
+    graph.add('fastqc', lambda results: fastqc(results['trim']), reads=('trimmed', ), cores=2)
+    graph.add('join', lambda results: join(results['trim']), reads=('trimmed', ), writes=('joined', ))
+    results = graph.run(core_count=4)
+"""
+from collections import OrderedDict, namedtuple
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+import logging
+
+from qc18SV4.exceptions import PipelineException
+
+
+StepRoles = namedtuple('StepRoles', ['reads', 'writes', 'deletes'])
+
+GraphTask = namedtuple('GraphTask', ['name', 'function', 'reads', 'writes', 'deletes', 'cores'])
+
+
+class StepGraph:
+    def __init__(self):
+        self.tasks = OrderedDict()
+
+    def add(self, name, function, reads=(), writes=(), deletes=(), cores=1):
+        """Add a task that runs function(results), where results is a dictionary of the results of finished tasks.
+
+        :param cores: (int) cores the task uses or a function of results returning the cores
+        """
+        if name in self.tasks:
+            raise PipelineException('task "{}" is already in the graph'.format(name))
+        self.tasks[name] = GraphTask(
+            name=name, function=function,
+            reads=tuple(reads), writes=tuple(writes), deletes=tuple(deletes),
+            cores=cores)
+
+    def get_dependencies(self):
+        """Return an OrderedDict of task name to the list of names of the tasks it runs after."""
+        dependencies = OrderedDict()
+        last_writers = {}
+        readers = {}
+        for task in self.tasks.values():
+            task_dependencies = []
+            for role in task.reads:
+                if role in last_writers:
+                    task_dependencies.append(last_writers[role])
+            for role in task.deletes:
+                task_dependencies.extend(readers.get(role, ()))
+                if role in last_writers:
+                    task_dependencies.append(last_writers[role])
+            dependencies[task.name] = sorted(set(task_dependencies) - {task.name}, key=list(self.tasks).index)
+
+            for role in task.reads:
+                readers.setdefault(role, []).append(task.name)
+            for role in task.writes:
+                last_writers[role] = task.name
+        return dependencies
+
+    def get_cores(self, task, results, core_count):
+        cores = task.cores(results) if callable(task.cores) else task.cores
+        return max(1, min(int(cores), core_count))
+
+    def run(self, core_count=1):
+        """Run every task and return an OrderedDict of task name to result in the order tasks were added.
+
+        If a task raises an exception no more tasks are started and the exception is raised
+        when the running tasks have finished.
+        """
+        log = logging.getLogger(name=self.__class__.__name__)
+        core_count = max(1, int(core_count))
+        dependencies = self.get_dependencies()
+        results = {}
+        pending_tasks = list(self.tasks.values())
+        running_tasks = {}
+        free_cores = core_count
+        with ThreadPoolExecutor(max_workers=max(1, len(self.tasks))) as executor:
+            while len(pending_tasks) > 0 or len(running_tasks) > 0:
+                for task in list(pending_tasks):
+                    if not all(dependency in results for dependency in dependencies[task.name]):
+                        continue
+                    cores = self.get_cores(task, results, core_count)
+                    if cores <= free_cores:
+                        log.info('starting "%s" on %d of %d free cores', task.name, cores, free_cores)
+                        pending_tasks.remove(task)
+                        free_cores -= cores
+                        running_tasks[executor.submit(task.function, results)] = (task, cores)
+
+                finished_futures, _ = wait(running_tasks, return_when=FIRST_COMPLETED)
+                for future in finished_futures:
+                    task, cores = running_tasks.pop(future)
+                    free_cores += cores
+                    if future.exception() is not None:
+                        log.error('"%s" failed, waiting for %d running tasks', task.name, len(running_tasks))
+                        pending_tasks = []
+                        wait(running_tasks)
+                        raise future.exception()
+                    results[task.name] = future.result()
+
+        return OrderedDict((name, results[name]) for name in self.tasks)
@@ -0,0 +1,206 @@
+"""
+step_metrics.py
+
+Wall time, CPU time, bytes in and out, thread counts, peak bytes on disk, and peak memory for each pipeline step.
+Pipeline.run writes one row per step to step_metrics.tsv in the work directory. Each row also has
+the bytes of the sample's forward and reverse input files, which is the size the planner fits its
+models to even when a step reads subsampled or demultiplexed reads.
+
+Tasks of a step graph run at the same time, so each step is measured on its own rather than
+from the usage of the whole process. CPU time is the time of the thread running the step, of
+the threads map_files starts for it, and of the tools it runs with run_process, which reaps
+each tool with os.wait4 to get the usage of that tool alone. Tools run in a JVM worker are
+counted from the CPU time and peak memory the worker reports for the command.
+
+Peak memory is the larger of the largest resident set size of the pipeline process up to the
+end of the step and the largest resident set size of a tool the step ran.
+"""
+import os
+import resource
+import subprocess
+import threading
+import time
+
+
+# step metrics of FastQC tasks that ran while the next steps ran are named <step>_fastqc
+fastqc_task_suffix = '_fastqc'
+
+step_metrics_columns = (
+    'step',
+    'elapsed_seconds',
+    'cpu_seconds',
+    'input_bytes',
+    'output_bytes',
+    'threads',
+    'peak_disk_bytes',
+    'peak_memory_bytes',
+    'sample_input_bytes',
+)
+
+
+class StepMetrics:
+    def __init__(self, step, input_bytes, threads, sample_input_bytes=None):
+        self.step = step
+        self.input_bytes = input_bytes
+        self.threads = threads
+        self.sample_input_bytes = sample_input_bytes
+
+        self.elapsed_seconds = None
+        self.cpu_seconds = None
+        self.output_bytes = None
+        self.peak_disk_bytes = 0
+        self.peak_memory_bytes = 0
+
+        self._start_time = None
+        self._task_usage = None
+        self._outer_task_usage = None
+
+    def start(self):
+        """Start measuring the step in this thread."""
+        self._start_time = time.time()
+        self._outer_task_usage = get_task_usage()
+        self._task_usage = TaskUsage()
+        _thread_state.task_usage = self._task_usage
+        return self
+
+    def stop(self, output_bytes, peak_disk_bytes=0):
+        """Stop measuring the step. Call this from the thread that called start."""
+        self.elapsed_seconds = time.time() - self._start_time
+        self._task_usage.stop_thread()
+        _thread_state.task_usage = self._outer_task_usage
+        self.cpu_seconds = self._task_usage.cpu_seconds
+        self.output_bytes = output_bytes
+        self.peak_disk_bytes = peak_disk_bytes
+        self.peak_memory_bytes = max(get_peak_memory_bytes(), self._task_usage.peak_memory_bytes)
+        return self
+
+    @property
+    def cpu_efficiency(self):
+        """Fraction of the step's threads that were busy on average."""
+        if self.elapsed_seconds is None or self.elapsed_seconds <= 0.0:
+            return None
+        else:
+            return self.cpu_seconds / (self.elapsed_seconds * self.threads)
+
+    def as_row(self):
+        return {
+            'step': self.step,
+            'elapsed_seconds': '{:.3f}'.format(self.elapsed_seconds),
+            'cpu_seconds': '{:.3f}'.format(self.cpu_seconds),
+            'input_bytes': str(self.input_bytes),
+            'output_bytes': str(self.output_bytes),
+            'threads': str(self.threads),
+            'peak_disk_bytes': str(self.peak_disk_bytes),
+            'peak_memory_bytes': str(self.peak_memory_bytes),
+            'sample_input_bytes': '' if self.sample_input_bytes is None else str(self.sample_input_bytes),
+        }
+
+    @classmethod
+    def from_row(cls, row):
+        step_metrics = cls(step=row['step'], input_bytes=int(row['input_bytes']), threads=int(row['threads']))
+        # step metrics written before sample input bytes were recorded do not have them
+        if row.get('sample_input_bytes', '') != '':
+            step_metrics.sample_input_bytes = int(row['sample_input_bytes'])
+        step_metrics.elapsed_seconds = float(row['elapsed_seconds'])
+        step_metrics.cpu_seconds = float(row['cpu_seconds'])
+        step_metrics.output_bytes = int(row['output_bytes'])
+        # step metrics written before peak disk usage and memory were recorded do not have these columns
+        step_metrics.peak_disk_bytes = int(row.get('peak_disk_bytes', 0))
+        step_metrics.peak_memory_bytes = int(row.get('peak_memory_bytes', 0))
+        return step_metrics
+
+
+class TaskUsage:
+    """CPU time and peak tool memory of one task, added to by the threads and tools it runs."""
+    def __init__(self):
+        self.cpu_seconds = 0.0
+        self.peak_memory_bytes = 0
+        self._start_thread_cpu_seconds = time.thread_time()
+        self._lock = threading.Lock()
+
+    def add(self, cpu_seconds, peak_memory_bytes=0):
+        with self._lock:
+            self.cpu_seconds += cpu_seconds
+            self.peak_memory_bytes = max(self.peak_memory_bytes, peak_memory_bytes)
+
+    def stop_thread(self):
+        """Add the CPU time of the thread that created this TaskUsage."""
+        self.add(time.thread_time() - self._start_thread_cpu_seconds)
+
+
+# the TaskUsage of the step running in each thread
+_thread_state = threading.local()
+
+
+def get_task_usage():
+    """Return the TaskUsage of the step running in this thread or None."""
+    return getattr(_thread_state, 'task_usage', None)
+
+
+def run_for_task(task_usage, fn, *args):
+    """Call fn in a worker thread and add the CPU time of the call to task_usage.
+
+    Tools fn runs with run_process are added to task_usage too.
+    """
+    if task_usage is None:
+        return fn(*args)
+    _thread_state.task_usage = task_usage
+    start_thread_cpu_seconds = time.thread_time()
+    try:
+        return fn(*args)
+    finally:
+        task_usage.add(time.thread_time() - start_thread_cpu_seconds)
+        _thread_state.task_usage = None
+
+
+def run_process(args, check=False, **popen_kwargs):
+    """Run a command like subprocess.run and add its CPU time and peak memory to the step running in this thread.
+
+    The child process is reaped with os.wait4, which returns the usage of the child and of
+    the processes it waited for, so tools run by other tasks at the same time are not counted.
+    """
+    process = subprocess.Popen(args, **popen_kwargs)
+    try:
+        _, status, usage = os.wait4(process.pid, 0)
+    except BaseException:
+        process.kill()
+        process.wait()
+        raise
+    if os.WIFSIGNALED(status):
+        process.returncode = -os.WTERMSIG(status)
+    else:
+        process.returncode = os.WEXITSTATUS(status)
+    task_usage = get_task_usage()
+    if task_usage is not None:
+        # ru_maxrss is in kilobytes on Linux
+        task_usage.add(cpu_seconds=usage.ru_utime + usage.ru_stime, peak_memory_bytes=1024 * usage.ru_maxrss)
+    if check and process.returncode != 0:
+        raise subprocess.CalledProcessError(process.returncode, args)
+    return subprocess.CompletedProcess(args, process.returncode)
+
+
+def get_peak_memory_bytes():
+    """Return the largest resident set size of this process."""
+    # ru_maxrss is in kilobytes on Linux
+    return 1024 * resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def write_step_metrics(step_metrics_fp, step_metrics_list):
+    with open(step_metrics_fp, 'wt') as step_metrics_file:
+        step_metrics_file.write('\t'.join(step_metrics_columns))
+        step_metrics_file.write('\n')
+        for step_metrics in step_metrics_list:
+            row = step_metrics.as_row()
+            step_metrics_file.write('\t'.join(row[column] for column in step_metrics_columns))
+            step_metrics_file.write('\n')
+
+
+def read_step_metrics(step_metrics_fp):
+    with open(step_metrics_fp, 'rt') as step_metrics_file:
+        header = step_metrics_file.readline().rstrip('\n').split('\t')
+        return [
+            StepMetrics.from_row(dict(zip(header, line.rstrip('\n').split('\t'))))
+            for line
+            in step_metrics_file
+            if len(line.strip()) > 0
+        ]
@@ -0,0 +1,160 @@
+"""
+subsample.py
+
+Choose at most max_read_pairs read pairs uniformly at random from a pair of FASTQ files,
+so samples sequenced far deeper than an analysis needs can be cut down before the first
+step.
+
+Read pairs are chosen by reservoir sampling with Algorithm L (Li 1994), which draws a
+random number only for the pairs that enter the reservoir rather than for every pair.
+The forward and reverse records of a pair are kept together, and chosen pairs are
+written in their input order. The choice depends only on the seed and the number of
+read pairs, so a sample is subsampled the same way every time it is run.
+
+The input is read once. The reservoir holds a copy of the forward and reverse records
+of each chosen pair, taken from the batch buffer only when the pair enters the
+reservoir, so memory grows with max_read_pairs and not with the size of the input. The
+outputs are compressed with the format and level of the pipeline's intermediate files.
+"""
+from collections import namedtuple
+import itertools
+import math
+import os
+import random
+
+from qc18SV4.checksums import ChecksumFile
+from qc18SV4.compression import compression_extensions, open_compressed, strip_compression_extension
+from qc18SV4.exceptions import PipelineException
+from qc18SV4.manifest import RecordCounts
+from qc18SV4.record_batches import RecordBatchWriter, read_records
+
+
+default_seed = 1
+
+SubsampledFiles = namedtuple(
+    'SubsampledFiles', ['forward_fp', 'reverse_fp', 'forward_counts', 'reverse_counts', 'input_counts'])
+
+
+def sample_reservoir(items, k, seed=default_seed, keep=None):
+    """Return (index, item) for k items chosen uniformly at random from an iterable, in input order.
+
+    All items are returned if there are k or fewer.
+
+    :param keep: function applied to an item as it enters the reservoir, whose result is
+                 kept in place of the item, or None to keep the item itself
+    """
+    if k < 1:
+        raise PipelineException('the number of items to choose must be at least 1, not {}'.format(k))
+    rng = random.Random(seed)
+
+    def random_open():
+        # a random number in (0, 1) so its logarithm is defined and negative
+        r = rng.random()
+        while r == 0.0:
+            r = rng.random()
+        return r
+
+    def random_skip(w):
+        # number of items skipped before the next item enters the reservoir
+        return math.floor(math.log(random_open()) / math.log1p(-w)) if w < 1.0 else 0
+
+    def keep_item(item):
+        return item if keep is None else keep(item)
+
+    reservoir = []
+    items = iter(items)
+    for index, item in zip(range(k), items):
+        reservoir.append((index, keep_item(item)))
+
+    w = math.exp(math.log(random_open()) / k)
+    next_index = k + random_skip(w)
+    for index, item in enumerate(items, start=k):
+        if index == next_index:
+            reservoir[rng.randrange(k)] = (index, keep_item(item))
+            w *= math.exp(math.log(random_open()) / k)
+            next_index += random_skip(w) + 1
+
+    return sorted(reservoir, key=lambda indexed_item: indexed_item[0])
+
+
+def read_record_pairs(forward_fp, reverse_fp):
+    """Yield ((forward batch, i), (reverse batch, j)) and raise PipelineException if one file has more records."""
+    for forward_record, reverse_record in itertools.zip_longest(
+            read_records(forward_fp, 'fastq'), read_records(reverse_fp, 'fastq')):
+        if forward_record is None or reverse_record is None:
+            raise PipelineException('"{}" and "{}" have different numbers of reads'.format(forward_fp, reverse_fp))
+        yield forward_record, reverse_record
+
+
+def copy_record(batch, i):
+    """Return a record and the length of its sequence, copied out of the buffer of its batch."""
+    return batch.record(i).tobytes(), batch.sequence_length(i)
+
+
+def get_subsampled_fp(fp, output_dp, compression):
+    return os.path.join(
+        output_dp, strip_compression_extension(os.path.basename(fp)) + compression_extensions[compression])
+
+
+def subsample_read_pairs(
+        forward_fp,
+        reverse_fp,
+        max_read_pairs,
+        output_dp,
+        seed=default_seed,
+        compression='gzip',
+        level=1,
+        file_checksums=None):
+    """Write at most max_read_pairs read pairs to output_dp with the input file names.
+
+    The output file names end with the extension of compression in place of any extension
+    of the input files.
+
+    :param compression: 'gzip' or 'zstd'
+    :param level: compression level
+    :param file_checksums: dictionary to which the FileChecksums of the output files are added, or None
+    :return: SubsampledFiles, where input_counts are the read pairs and bases of the input files
+    """
+    output_forward_fp = get_subsampled_fp(forward_fp, output_dp, compression)
+    output_reverse_fp = get_subsampled_fp(reverse_fp, output_dp, compression)
+
+    input_pair_count = 0
+    input_base_count = 0
+
+    def count_pairs(record_pairs):
+        nonlocal input_pair_count, input_base_count
+        for forward_record, reverse_record in record_pairs:
+            input_pair_count += 1
+            input_base_count += forward_record[0].sequence_length(forward_record[1])
+            input_base_count += reverse_record[0].sequence_length(reverse_record[1])
+            yield forward_record, reverse_record
+
+    chosen_pairs = sample_reservoir(
+        count_pairs(read_record_pairs(forward_fp, reverse_fp)),
+        max_read_pairs,
+        seed=seed,
+        keep=lambda record_pair: (copy_record(*record_pair[0]), copy_record(*record_pair[1])))
+
+    with ChecksumFile(output_forward_fp, 'wb') as forward_checksum_file, \
+            ChecksumFile(output_reverse_fp, 'wb') as reverse_checksum_file, \
+            open_compressed(
+                output_forward_fp, 'wb', compression=compression, level=level, fileobj=forward_checksum_file
+            ) as forward_output_file, \
+            open_compressed(
+                output_reverse_fp, 'wb', compression=compression, level=level, fileobj=reverse_checksum_file
+            ) as reverse_output_file, \
+            RecordBatchWriter(forward_output_file, 'fastq') as forward_writer, \
+            RecordBatchWriter(reverse_output_file, 'fastq') as reverse_writer:
+        for _, (forward_record, reverse_record) in chosen_pairs:
+            forward_writer.write_record_bytes(*forward_record)
+            reverse_writer.write_record_bytes(*reverse_record)
+    if file_checksums is not None:
+        file_checksums[output_forward_fp] = forward_checksum_file.checksums
+        file_checksums[output_reverse_fp] = reverse_checksum_file.checksums
+
+    return SubsampledFiles(
+        forward_fp=output_forward_fp,
+        reverse_fp=output_reverse_fp,
+        forward_counts=RecordCounts(record_count=forward_writer.record_count, base_count=forward_writer.base_count),
+        reverse_counts=RecordCounts(record_count=reverse_writer.record_count, base_count=reverse_writer.base_count),
+        input_counts=RecordCounts(record_count=input_pair_count, base_count=input_base_count))
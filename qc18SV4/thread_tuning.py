@@ -0,0 +1,77 @@
+"""
+thread_tuning.py
+
+Choose thread counts for Trimmomatic, FastQC, and the in-process compression helpers
+from the size of a sample's input files and the CPUs available to this process.
+
+Small samples get one thread per tool so a node can run more samples at once.
+Large samples get one thread for each bytes_per_thread of input, up to the number
+of cores the pipeline was given.
+"""
+from collections import namedtuple
+import logging
+import math
+import os
+
+
+ThreadCounts = namedtuple('ThreadCounts', ['trimmomatic', 'fastqc', 'compression'])
+
+# bytes of input per thread for each tool
+trimmomatic_bytes_per_thread = 16 * 2**20
+fastqc_bytes_per_thread = 32 * 2**20
+compression_bytes_per_thread = 64 * 2**20
+
+# FastQC uses at most one thread per file and no step writes more than 4 FASTQ files
+fastqc_max_threads = 4
+
+
+def get_available_cpu_count():
+    if hasattr(os, 'sched_getaffinity'):
+        return len(os.sched_getaffinity(0))
+    else:
+        return os.cpu_count() or 1
+
+
+def get_thread_count(byte_count, bytes_per_thread, max_threads):
+    return max(1, min(int(math.ceil(byte_count / bytes_per_thread)), max_threads))
+
+
+def choose_thread_counts(input_bytes, core_count=None):
+    """Choose thread counts for a sample with input_bytes of forward and reverse reads.
+
+    :param input_bytes: (int) total size of the input files
+    :param core_count: (int) cores given to the pipeline, or None to use all available CPUs
+    :return: ThreadCounts
+    """
+    cpu_count = get_available_cpu_count()
+    if core_count is None:
+        max_threads = cpu_count
+    else:
+        max_threads = max(1, min(int(core_count), cpu_count))
+
+    return ThreadCounts(
+        trimmomatic=get_thread_count(input_bytes, trimmomatic_bytes_per_thread, max_threads),
+        fastqc=get_thread_count(input_bytes, fastqc_bytes_per_thread, min(max_threads, fastqc_max_threads)),
+        compression=get_thread_count(input_bytes, compression_bytes_per_thread, max_threads)
+    )
+
+
+def check_step_metrics(step_metrics_list, min_cpu_efficiency=0.5):
+    """Find steps given more threads than they kept busy.
+
+    A step whose CPU time divided by (elapsed time * threads) is below min_cpu_efficiency
+    had idle threads, which suggests the tuner chose too many for that input size.
+
+    :param step_metrics_list: StepMetrics for each step, for example from read_step_metrics
+    :return: list of StepMetrics for steps with more than one thread and low CPU efficiency
+    """
+    log = logging.getLogger(name=__name__)
+    inefficient_steps = []
+    for step_metrics in step_metrics_list:
+        cpu_efficiency = step_metrics.cpu_efficiency
+        if step_metrics.threads > 1 and cpu_efficiency is not None and cpu_efficiency < min_cpu_efficiency:
+            log.warning(
+                '%s used %d threads for %d input bytes but only %.0f%% of the thread time was busy',
+                step_metrics.step, step_metrics.threads, step_metrics.input_bytes, 100.0 * cpu_efficiency)
+            inefficient_steps.append(step_metrics)
+    return inefficient_steps
@@ -0,0 +1,375 @@
+"""
+tool_shims.py
+
+Stand-ins for TrimmomaticPE, fastq-join, fastq_quality_filter, fastq_to_fasta,
+fastx_clipper, and fastqc so the pipeline can run where the tools are not installed and
+the time spent in qc18SV4 itself can be measured apart from the time spent in the tools.
+
+Each stand-in accepts the command line the pipeline gives the real tool and writes the
+same output files with the same names:
+
+    TrimmomaticPE         paired reads as given, empty unpaired files, all gzipped
+    fastq-join            forward reads as the joined reads, empty un1 and un2 files
+    fastq_quality_filter  reads as given
+    fastq_to_fasta        reads as FASTA with numbered ids (-r)
+    fastx_clipper         sequences of at least -l bases
+    fastqc                an empty <name>_fastqc.zip and <name>_fastqc.html for each file
+
+A stand-in reads all of its input so its run time grows with the input, and if a
+throughput is given it sleeps until it has taken input bytes / throughput seconds.
+If the environment variable QC18SV4_SHIM_LOG names a file each stand-in appends its
+name, input bytes, and seconds to it.
+
+write_tool_shims writes one executable script per tool to a directory that can be put
+first on PATH. benchmark_orchestration uses them to run Pipeline.run on generated read
+pairs, and the run_job_file batch path on several samples, and reports the wall time
+not spent in the stand-ins as orchestration overhead:
+
+    $ benchmark_orchestration --read-pairs 100000 --samples 4 --mb-per-second 50
+"""
+import argparse
+import gzip
+import itertools
+import logging
+import os
+import random
+import resource
+import shutil
+import stat
+import sys
+import tempfile
+import time
+
+from qc18SV4.demultiplex import iupac_masks, reverse_complement
+
+
+shim_log_env_var = 'QC18SV4_SHIM_LOG'
+
+tool_names = (
+    'TrimmomaticPE',
+    'fastq-join',
+    'fastq_quality_filter',
+    'fastq_to_fasta',
+    'fastx_clipper',
+    'fastqc',
+)
+
+
+def open_input(fp, mode='rt'):
+    return gzip.open(fp, mode) if fp.endswith('.gz') else open(fp, mode)
+
+
+def get_option(args, option):
+    return args[args.index(option) + 1]
+
+
+def trimmomatic_pe(args):
+    args = list(args)
+    if args[0] == '-threads':
+        args = args[2:]
+    forward_fp, reverse_fp, forward_paired_fp, forward_unpaired_fp, reverse_paired_fp, reverse_unpaired_fp = args[:6]
+    for input_fp, paired_fp in ((forward_fp, forward_paired_fp), (reverse_fp, reverse_paired_fp)):
+        with open_input(input_fp, 'rb') as input_file, gzip.open(paired_fp, 'wb', compresslevel=1) as paired_file:
+            shutil.copyfileobj(input_file, paired_file)
+    for unpaired_fp in (forward_unpaired_fp, reverse_unpaired_fp):
+        gzip.open(unpaired_fp, 'wb').close()
+    return [forward_fp, reverse_fp]
+
+
+def fastq_join(args):
+    forward_fp, reverse_fp = args[:2]
+    output_pattern = get_option(args, '-o')
+    shutil.copyfile(forward_fp, output_pattern.replace('%', 'join'))
+    # read the reverse reads as fastq-join would
+    with open(reverse_fp, 'rb') as reverse_file:
+        for _ in reverse_file:
+            pass
+    for name in ('un1', 'un2'):
+        open(output_pattern.replace('%', name), 'wt').close()
+    return [forward_fp, reverse_fp]
+
+
+def fastq_quality_filter(args):
+    input_fp = get_option(args, '-i')
+    shutil.copyfile(input_fp, get_option(args, '-o'))
+    return [input_fp]
+
+
+def fastq_to_fasta(args):
+    input_fp = get_option(args, '-i')
+    with open(input_fp, 'rt') as fastq_file, open(get_option(args, '-o'), 'wt') as fasta_file:
+        for i, record in enumerate(iter(lambda: list(itertools.islice(fastq_file, 4)), [])):
+            fasta_file.write('>{}\n{}'.format(i + 1, record[1]))
+    return [input_fp]
+
+
+def fastx_clipper(args):
+    input_fp = get_option(args, '-i')
+    min_length = int(get_option(args, '-l'))
+    with open(input_fp, 'rt') as input_file, open(get_option(args, '-o'), 'wt') as output_file:
+        for header, sequence in iter(lambda: list(itertools.islice(input_file, 2)), []):
+            if len(sequence.strip()) >= min_length:
+                output_file.write(header)
+                output_file.write(sequence)
+    return [input_fp]
+
+
+def fastqc(args):
+    output_dp = get_option(args, '--outdir')
+    input_fp_list = args[args.index('--outdir') + 2:]
+    for input_fp in input_fp_list:
+        with open_input(input_fp, 'rb') as input_file:
+            for _ in input_file:
+                pass
+        name = os.path.basename(input_fp)
+        for extension in ('.gz', '.fastq', '.fq'):
+            if name.endswith(extension):
+                name = name[:-len(extension)]
+        for suffix in ('_fastqc.zip', '_fastqc.html'):
+            open(os.path.join(output_dp, name + suffix), 'wb').close()
+    return input_fp_list
+
+
+tools = {
+    'TrimmomaticPE': trimmomatic_pe,
+    'fastq-join': fastq_join,
+    'fastq_quality_filter': fastq_quality_filter,
+    'fastq_to_fasta': fastq_to_fasta,
+    'fastx_clipper': fastx_clipper,
+    'fastqc': fastqc,
+}
+
+
+def run_shim(tool_name, args, mb_per_second=None):
+    """Do the work of a stand-in tool and sleep until it has taken input bytes / throughput seconds."""
+    start_time = time.time()
+    input_fp_list = tools[tool_name](args)
+    input_bytes = sum(os.path.getsize(fp) for fp in input_fp_list)
+    if mb_per_second:
+        time.sleep(max(0.0, input_bytes / (mb_per_second * 2**20) - (time.time() - start_time)))
+    elapsed_seconds = time.time() - start_time
+
+    shim_log_fp = os.environ.get(shim_log_env_var)
+    if shim_log_fp:
+        with open(shim_log_fp, 'at') as shim_log_file:
+            shim_log_file.write('{}\t{}\t{:.6f}\n'.format(tool_name, input_bytes, elapsed_seconds))
+
+
+def main(tool_name, mb_per_second=None):
+    """Entry point of the scripts written by write_tool_shims."""
+    run_shim(tool_name, sys.argv[1:], mb_per_second=mb_per_second)
+
+
+def write_tool_shims(shim_dp, mb_per_second=None):
+    """Write an executable stand-in for each tool to shim_dp.
+
+    :param mb_per_second: (float) throughput of each stand-in, None for as fast as possible
+    :return: list of script paths
+    """
+    os.makedirs(shim_dp, exist_ok=True)
+    shim_fp_list = []
+    for tool_name in tool_names:
+        shim_fp = os.path.join(shim_dp, tool_name)
+        with open(shim_fp, 'wt') as shim_file:
+            shim_file.write(
+                '#!{}\nfrom qc18SV4.tool_shims import main\nmain({!r}, mb_per_second={!r})\n'.format(
+                    sys.executable, tool_name, mb_per_second))
+        os.chmod(shim_fp, os.stat(shim_fp).st_mode | stat.S_IXUSR | stat.S_IXGRP | stat.S_IXOTH)
+        shim_fp_list.append(shim_fp)
+    return shim_fp_list
+
+
+def read_shim_log(shim_log_fp):
+    """Return (number of tool runs, total seconds in tools) from a stand-in log."""
+    if not os.path.exists(shim_log_fp):
+        return 0, 0.0
+    with open(shim_log_fp, 'rt') as shim_log_file:
+        seconds = [float(line.rstrip('\n').split('\t')[2]) for line in shim_log_file if len(line.strip()) > 0]
+    return len(seconds), sum(seconds)
+
+
+def resolve_primer(primer, rng):
+    """Choose one base for each IUPAC code of a primer."""
+    return ''.join(
+        rng.choice([base for base in 'ACGT' if iupac_masks[base] & iupac_masks[code]])
+        for code
+        in primer)
+
+
+def write_read_pairs(
+        forward_fp, reverse_fp, read_pair_count, forward_primer, reverse_primer,
+        read_length=300, amplicon_length=450, seed=0):
+    """Write read pairs of random amplicons that start with the primers and overlap.
+
+    As in the test data the forward read starts with the forward primer and the reverse
+    read with the reverse complement of the reverse primer.
+    """
+    rng = random.Random(seed)
+    quality = 'I' * (read_length - 20) + '5' * 20
+    with open(forward_fp, 'wt') as forward_file, open(reverse_fp, 'wt') as reverse_file:
+        for i in range(read_pair_count):
+            forward = resolve_primer(forward_primer, rng)
+            reverse = resolve_primer(reverse_primer, rng)
+            amplicon = forward \
+                + ''.join(rng.choice('ACGT') for _ in range(amplicon_length - len(forward) - len(reverse))) \
+                + reverse
+            forward_file.write('@read_{} 1:N:0:1\n{}\n+\n{}\n'.format(i, amplicon[:read_length], quality))
+            reverse_file.write(
+                '@read_{} 2:N:0:1\n{}\n+\n{}\n'.format(i, reverse_complement(amplicon)[:read_length], quality))
+
+
+def get_children_cpu_seconds():
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return usage.ru_utime + usage.ru_stime
+
+
+class OrchestrationBenchmark:
+    """Run the pipeline against stand-in tools and measure the time not spent in the tools."""
+    forward_primer = 'CCAGCASCYGCGGTAATTCC'
+    reverse_primer = 'TYRATCAAGAACGAAAGT'
+    prefix_regex = r'^(?P<prefix>[a-zA-Z0-9]+)_L001_R[12]'
+
+    def __init__(self, work_dp, mb_per_second=None):
+        self.work_dp = work_dp
+        self.shim_dp = os.path.join(work_dp, 'shims')
+        self.shim_log_fp = os.path.join(work_dp, 'shim_log.tsv')
+        write_tool_shims(self.shim_dp, mb_per_second=mb_per_second)
+
+    def write_samples(self, input_dp, sample_count, read_pair_count):
+        os.makedirs(input_dp, exist_ok=True)
+        forward_fp_list = []
+        for sample_index in range(sample_count):
+            forward_fp = os.path.join(input_dp, 'Sample{}_L001_R1_001.fastq'.format(sample_index))
+            write_read_pairs(
+                forward_fp, forward_fp.replace('_R1_', '_R2_'),
+                read_pair_count=read_pair_count,
+                forward_primer=self.forward_primer,
+                reverse_primer=self.reverse_primer,
+                seed=sample_index)
+            forward_fp_list.append(forward_fp)
+        return forward_fp_list
+
+    def measure(self, name, function, read_pair_count):
+        """Run function with the stand-ins first on PATH and return a result row."""
+        if os.path.exists(self.shim_log_fp):
+            os.remove(self.shim_log_fp)
+        environ = dict(os.environ)
+        os.environ['PATH'] = self.shim_dp + os.pathsep + os.environ.get('PATH', '')
+        os.environ[shim_log_env_var] = self.shim_log_fp
+        try:
+            start_time = time.time()
+            start_cpu_seconds = time.process_time()
+            start_children_cpu_seconds = get_children_cpu_seconds()
+            function()
+            elapsed_seconds = time.time() - start_time
+            cpu_seconds = time.process_time() - start_cpu_seconds
+            children_cpu_seconds = get_children_cpu_seconds() - start_children_cpu_seconds
+        finally:
+            os.environ.clear()
+            os.environ.update(environ)
+
+        tool_run_count, tool_seconds = read_shim_log(self.shim_log_fp)
+        overhead_seconds = max(0.0, elapsed_seconds - tool_seconds)
+        return {
+            'benchmark': name,
+            'read_pairs': str(read_pair_count),
+            'elapsed_seconds': '{:.3f}'.format(elapsed_seconds),
+            'cpu_seconds': '{:.3f}'.format(cpu_seconds),
+            'children_cpu_seconds': '{:.3f}'.format(children_cpu_seconds),
+            'tool_runs': str(tool_run_count),
+            'tool_seconds': '{:.3f}'.format(tool_seconds),
+            'overhead_seconds': '{:.3f}'.format(overhead_seconds),
+            'overhead_us_per_read_pair': '{:.1f}'.format(1e6 * overhead_seconds / max(1, read_pair_count)),
+        }
+
+    def benchmark_pipeline(self, read_pair_count, **pipeline_kwargs):
+        """Run Pipeline.run in this process on one generated sample."""
+        from qc18SV4.pipeline import Pipeline
+
+        input_dp = os.path.join(self.work_dp, 'pipeline_input')
+        forward_fp, = self.write_samples(input_dp, sample_count=1, read_pair_count=read_pair_count)
+        pipeline = Pipeline(
+            forward_reads_fp=forward_fp,
+            forward_primer=self.forward_primer,
+            reverse_primer=self.reverse_primer,
+            prefix_regex=self.prefix_regex,
+            phred='33',
+            work_dp=os.path.join(self.work_dp, 'pipeline_work'),
+            **pipeline_kwargs)
+        return self.measure('pipeline', pipeline.run, read_pair_count)
+
+    def benchmark_batch(self, sample_count, read_pair_count, cores_per_task=1, total_cores=None):
+        """Run the run_job_file batch path, one pipeline process per generated sample."""
+        from qc18SV4.run_job_file import WorkQueueScheduler, get_tasks
+        from qc18SV4.write_launcher_job_file import get_pipeline_command_line
+
+        input_dp = os.path.join(self.work_dp, 'batch_input')
+        forward_fp_list = self.write_samples(input_dp, sample_count=sample_count, read_pair_count=read_pair_count)
+        # run the pipeline module with this interpreter so the package need not be installed
+        command_lines = [
+            '{} -m qc18SV4.pipeline '.format(sys.executable) + get_pipeline_command_line(
+                forward_fp=forward_fp,
+                work_dp_template=os.path.join(self.work_dp, 'batch_work', 'sample{}'.format(sample_index)),
+                forward_primer=self.forward_primer,
+                reverse_primer=self.reverse_primer,
+                prefix_regex=self.prefix_regex,
+                phred='33',
+                core_count=cores_per_task)[len('pipeline '):]
+            + '> {} 2>&1'.format(os.path.join(self.work_dp, 'batch_work', 'sample{}.log'.format(sample_index)))
+            for sample_index, forward_fp
+            in enumerate(forward_fp_list)
+        ]
+        os.makedirs(os.path.join(self.work_dp, 'batch_work'), exist_ok=True)
+        tasks = get_tasks(command_lines)
+
+        def run_tasks():
+            WorkQueueScheduler(tasks=tasks, total_cores=total_cores).run()
+
+        result = self.measure('batch', run_tasks, sample_count * read_pair_count)
+        failed_task_count = sum(task.returncode != 0 for task in tasks)
+        if failed_task_count > 0:
+            logging.getLogger(name=self.__class__.__name__).error('%d batch tasks failed', failed_task_count)
+        return result
+
+
+benchmark_columns = (
+    'benchmark', 'read_pairs', 'elapsed_seconds', 'cpu_seconds', 'children_cpu_seconds',
+    'tool_runs', 'tool_seconds', 'overhead_seconds', 'overhead_us_per_read_pair')
+
+
+def get_args(argv=None):
+    arg_parser = argparse.ArgumentParser(
+        description='measure the time the pipeline spends outside of external tools by running it against stand-ins')
+    arg_parser.add_argument('--read-pairs', type=int, default=10000, help='read pairs in each generated sample')
+    arg_parser.add_argument('--samples', type=int, default=4, help='samples run by the batch benchmark, 0 to skip it')
+    arg_parser.add_argument('--mb-per-second', type=float, default=None, help='throughput of each stand-in tool, default is as fast as possible')
+    arg_parser.add_argument('--total-cores', type=int, default=None, help='cores available to the batch benchmark')
+    arg_parser.add_argument('--work-dp', default=None, help='directory for generated input and pipeline output, default is a temporary directory')
+    args = arg_parser.parse_args(argv)
+    return args
+
+
+def main_benchmark():
+    logging.basicConfig(level=logging.WARNING)
+    args = get_args()
+
+    def run_benchmarks(work_dp):
+        benchmark = OrchestrationBenchmark(work_dp=work_dp, mb_per_second=args.mb_per_second)
+        results = [benchmark.benchmark_pipeline(read_pair_count=args.read_pairs)]
+        if args.samples > 0:
+            results.append(
+                benchmark.benchmark_batch(
+                    sample_count=args.samples, read_pair_count=args.read_pairs, total_cores=args.total_cores))
+        print('\t'.join(benchmark_columns))
+        for result in results:
+            print('\t'.join(result[column] for column in benchmark_columns))
+
+    if args.work_dp is None:
+        with tempfile.TemporaryDirectory() as work_dp:
+            run_benchmarks(work_dp)
+    else:
+        run_benchmarks(args.work_dp)
+
+
+if __name__ == '__main__':
+    main_benchmark()
@@ -0,0 +1,275 @@
+"""
+trace.py
+
+Timeline trace of pipeline steps, external tools, and file compression for whole batches.
+
+When tracing is on each pipeline appends one JSON line per event to trace.jsonl in its
+work directory. Events are Chrome trace "complete" events tagged with host, pid, thread,
+and sample prefix:
+
+    {"name": "step_01_trim_primers", "cat": "step", "ph": "X", "ts": ..., "dur": ..., "pid": ..., "tid": ...,
+     "args": {"host": "c455-001", "sample": "Test01", "cpu_seconds": 12.5, "host_cores": 48}}
+
+Categories are task (a run_job_file task), pipeline, step, tool (a run_cmd call), and
+compression. Step events carry the CPU seconds of the pipeline and its tools during the
+step so the busy cores of each host can be estimated over time. Writing an event is one
+buffered write, and when tracing is off a traced block costs one function call.
+
+Tracing is turned on by the pipeline's --trace argument or by setting the environment
+variable QC18SV4_TRACE=1, which reaches every pipeline of a Launcher or SLURM batch.
+merge_traces combines the trace files of many work directories into one trace that can
+be opened in chrome://tracing or https://ui.perfetto.dev, with a counter track of busy
+cores for each host, and writes the core utilization of each host over time:
+
+    $ merge_traces -o batch_trace.json -u core_utilization.tsv work-*
+"""
+import argparse
+from collections import OrderedDict
+from contextlib import contextmanager
+import glob
+import json
+import math
+import os
+import socket
+import sys
+import threading
+import time
+
+
+trace_env_var = 'QC18SV4_TRACE'
+trace_file_name = 'trace.jsonl'
+
+
+def is_tracing_requested():
+    return os.environ.get(trace_env_var, '') not in ('', '0')
+
+
+class Tracer:
+    """Append trace events for one process to a JSON lines file."""
+    def __init__(self, trace_fp, sample=None):
+        self.trace_fp = trace_fp
+        self.sample = sample
+        self.host = socket.gethostname()
+        self.host_cores = os.cpu_count()
+        self.pid = os.getpid()
+        self._lock = threading.Lock()
+        self._trace_file = open(trace_fp, 'at', buffering=2**16)
+
+    def add_event(self, name, category, start_time, end_time, **args):
+        """Write a complete event, times are seconds since the epoch."""
+        event_args = {'host': self.host, 'host_cores': self.host_cores}
+        if self.sample is not None:
+            event_args['sample'] = self.sample
+        event_args.update(args)
+        line = json.dumps({
+            'name': name,
+            'cat': category,
+            'ph': 'X',
+            'ts': int(start_time * 1e6),
+            'dur': int((end_time - start_time) * 1e6),
+            'pid': self.pid,
+            'tid': threading.get_ident(),
+            'args': event_args,
+        })
+        with self._lock:
+            self._trace_file.write(line)
+            self._trace_file.write('\n')
+
+    @contextmanager
+    def span(self, name, category, **args):
+        start_time = time.time()
+        try:
+            yield
+        finally:
+            self.add_event(name, category, start_time, time.time(), **args)
+
+    def close(self):
+        with self._lock:
+            self._trace_file.close()
+
+
+_tracer = None
+
+
+def get_tracer():
+    """Return the Tracer of this process or None if tracing is off."""
+    return _tracer
+
+
+def start_tracing(trace_fp, sample=None):
+    global _tracer
+    if _tracer is not None:
+        _tracer.close()
+    _tracer = Tracer(trace_fp, sample=sample)
+    return _tracer
+
+
+def stop_tracing():
+    global _tracer
+    if _tracer is not None:
+        _tracer.close()
+        _tracer = None
+
+
+@contextmanager
+def span(name, category, **args):
+    """Trace a block of code if tracing is on."""
+    if _tracer is None:
+        yield
+    else:
+        with _tracer.span(name, category, **args):
+            yield
+
+
+def read_trace_events(trace_fp):
+    with open(trace_fp, 'rt') as trace_file:
+        return [json.loads(line) for line in trace_file if len(line.strip()) > 0]
+
+
+def get_trace_fp_list(paths):
+    """Return trace files given as files or as directories searched recursively for trace.jsonl."""
+    trace_fp_list = []
+    for path in paths:
+        if os.path.isdir(path):
+            trace_fp_list.extend(sorted(glob.glob(os.path.join(path, '**', trace_file_name), recursive=True)))
+        else:
+            trace_fp_list.append(path)
+    return trace_fp_list
+
+
+def get_core_utilization(events, bin_seconds=60.0):
+    """Estimate busy cores of each host over time from the CPU seconds of step events.
+
+    The CPU seconds of each step are spread evenly over its duration.
+
+    :return: OrderedDict of host to list of (bin start seconds since the first event, busy cores, host cores)
+    """
+    step_events = [e for e in events if e['cat'] == 'step' and 'cpu_seconds' in e['args']]
+    if len(step_events) == 0:
+        return OrderedDict()
+    bin_us = bin_seconds * 1e6
+    start_ts = min(e['ts'] for e in events)
+    end_ts = max(e['ts'] + e['dur'] for e in events)
+    bin_count = max(1, int(math.ceil((end_ts - start_ts) / bin_us)))
+
+    busy_core_us = OrderedDict()
+    host_cores = {}
+    for event in sorted(step_events, key=lambda e: e['args']['host']):
+        host = event['args']['host']
+        host_cores[host] = event['args'].get('host_cores')
+        bins = busy_core_us.setdefault(host, [0.0] * bin_count)
+        event_start = event['ts'] - start_ts
+        event_end = event_start + event['dur']
+        if event['dur'] <= 0:
+            continue
+        busy_cores = event['args']['cpu_seconds'] * 1e6 / event['dur']
+        for bin_index in range(int(event_start // bin_us), min(bin_count, int(event_end // bin_us) + 1)):
+            overlap_us = min(event_end, (bin_index + 1) * bin_us) - max(event_start, bin_index * bin_us)
+            if overlap_us > 0:
+                bins[bin_index] += busy_cores * overlap_us
+
+    return OrderedDict(
+        (
+            host,
+            [
+                (bin_index * bin_seconds, core_us / bin_us, host_cores[host])
+                for bin_index, core_us
+                in enumerate(bins)
+            ]
+        )
+        for host, bins
+        in busy_core_us.items()
+    )
+
+
+def merge_traces(trace_fp_list, bin_seconds=60.0):
+    """Combine per-process trace files into one Chrome trace.
+
+    Each host and pid becomes a process named for its host, pid, and sample, times start
+    at zero, and a counter track of busy cores is added for each host.
+
+    :return: (trace as a dictionary, core utilization as returned by get_core_utilization)
+    """
+    events = []
+    for trace_fp in trace_fp_list:
+        events.extend(read_trace_events(trace_fp))
+    if len(events) == 0:
+        return {'traceEvents': [], 'displayTimeUnit': 'ms'}, OrderedDict()
+    start_ts = min(e['ts'] for e in events)
+
+    # pids may repeat across hosts so give each host and pid a new pid
+    process_ids = OrderedDict()
+    merged_events = []
+    for event in sorted(events, key=lambda e: e['ts']):
+        process_key = (event['args'].get('host'), event['pid'])
+        if process_key not in process_ids:
+            process_ids[process_key] = len(process_ids) + 1
+            merged_events.append({
+                'name': 'process_name',
+                'ph': 'M',
+                'pid': process_ids[process_key],
+                'args': {'name': '{} {} {}'.format(
+                    process_key[0], process_key[1], event['args'].get('sample', '')).strip()},
+            })
+        merged_event = dict(event)
+        merged_event['pid'] = process_ids[process_key]
+        merged_event['ts'] = event['ts'] - start_ts
+        merged_events.append(merged_event)
+
+    core_utilization = get_core_utilization(events, bin_seconds=bin_seconds)
+    for host_index, (host, bins) in enumerate(core_utilization.items()):
+        counter_pid = len(process_ids) + host_index + 1
+        merged_events.append(
+            {'name': 'process_name', 'ph': 'M', 'pid': counter_pid, 'args': {'name': '{} cores'.format(host)}})
+        for bin_start, busy_cores, _ in bins:
+            merged_events.append({
+                'name': 'busy cores',
+                'ph': 'C',
+                'ts': int(bin_start * 1e6),
+                'pid': counter_pid,
+                'args': {'busy': round(busy_cores, 3)},
+            })
+
+    return {'traceEvents': merged_events, 'displayTimeUnit': 'ms'}, core_utilization
+
+
+def write_core_utilization(output_file, core_utilization):
+    output_file.write('host\tbin_start_seconds\tbusy_cores\thost_cores\tutilization\n')
+    for host, bins in core_utilization.items():
+        for bin_start, busy_cores, host_cores in bins:
+            output_file.write('{}\t{:.1f}\t{:.3f}\t{}\t{}\n'.format(
+                host,
+                bin_start,
+                busy_cores,
+                host_cores,
+                '{:.3f}'.format(busy_cores / host_cores) if host_cores else ''))
+
+
+def get_args(argv=None):
+    arg_parser = argparse.ArgumentParser(
+        description='merge {} files into one Chrome/Perfetto trace and compute core utilization'.format(
+            trace_file_name))
+    arg_parser.add_argument('paths', nargs='+', help='trace files or work directories containing {}'.format(trace_file_name))
+    arg_parser.add_argument('-o', '--output-fp', required=True, help='merged trace JSON file')
+    arg_parser.add_argument('-u', '--utilization-fp', default=None, help='tab-separated core utilization of each host, default is standard output')
+    arg_parser.add_argument('--bin-seconds', type=float, default=60.0, help='width of each core utilization time bin')
+    args = arg_parser.parse_args(argv)
+    return args
+
+
+def main():
+    args = get_args()
+    trace_fp_list = get_trace_fp_list(args.paths)
+    print('merging {} trace files'.format(len(trace_fp_list)), file=sys.stderr)
+    trace, core_utilization = merge_traces(trace_fp_list, bin_seconds=args.bin_seconds)
+    with open(args.output_fp, 'wt') as output_file:
+        json.dump(trace, output_file)
+    if args.utilization_fp is None:
+        write_core_utilization(sys.stdout, core_utilization)
+    else:
+        with open(args.utilization_fp, 'wt') as utilization_file:
+            write_core_utilization(utilization_file, core_utilization)
+
+
+if __name__ == '__main__':
+    main()
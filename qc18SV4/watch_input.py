@@ -0,0 +1,344 @@
+"""
+watch_input.py
+
+Run the pipeline only for read file pairs that are new or changed since the last run, so
+processing an input directory that grows during a sequencing run costs in proportion to
+what is new rather than to everything that has arrived.
+
+Completed read pairs are recorded in a tab-separated file with the path, size,
+modification time, and SHA-256 checksum of the forward and reverse read files. A pair
+is skipped if both files have the recorded size and modification time. If only the
+modification time differs the checksums decide, so copying finished files again does
+not cause them to be run again. Checksums are computed only for new or changed files.
+
+The input directory is polled for *_R1_* files with a matching *_R2_* file. A pair is
+scheduled only when neither file has been modified for --settle-seconds, so files still
+being copied are left for a later poll. New pairs are added to one work queue, the
+scheduler of run_job_file, that runs for as long as the watcher, so pairs found by a
+poll start as soon as cores are free rather than after every pair of an earlier poll
+has finished. A pair is recorded when its pipeline succeeds. Failed pairs are not run
+again until one of their files changes.
+
+The record is written to the current directory by default rather than to the input
+directory, which may be read-only.
+
+    $ watch_input -i input_dir -w work-{prefix} -c 2 -p "^(?P<prefix>[a-zA-Z0-9_]+)_L001_R[12]" --once
+"""
+import argparse
+from collections import namedtuple
+import glob
+import hashlib
+import logging
+import os
+import sys
+import time
+
+from qc18SV4.run_job_file import WorkQueueScheduler, get_tasks
+from qc18SV4.write_launcher_job_file import get_pipeline_command_line
+
+
+completed_pairs_file_name = 'completed_pairs.tsv'
+
+completed_pairs_columns = (
+    'forward_fp', 'forward_size', 'forward_mtime_ns', 'forward_sha256',
+    'reverse_fp', 'reverse_size', 'reverse_mtime_ns', 'reverse_sha256',
+    'completed_time')
+
+
+class FileState(namedtuple('FileState', ['fp', 'size', 'mtime_ns', 'sha256'])):
+    __slots__ = ()
+
+    @classmethod
+    def stat(cls, fp):
+        """Return the size and modification time of a file without a checksum."""
+        st = os.stat(fp)
+        return cls(fp=fp, size=st.st_size, mtime_ns=st.st_mtime_ns, sha256=None)
+
+    def with_checksum(self):
+        if self.sha256 is None:
+            return self._replace(sha256=get_file_sha256(self.fp))
+        else:
+            return self
+
+    def same_stat(self, other):
+        return self.size == other.size and self.mtime_ns == other.mtime_ns
+
+
+ReadPairState = namedtuple('ReadPairState', ['forward', 'reverse'])
+
+
+def get_file_sha256(fp, chunk_size=2**20):
+    sha256 = hashlib.sha256()
+    with open(fp, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            sha256.update(chunk)
+    return sha256.hexdigest()
+
+
+class CompletedPairs:
+    """Persistent record of read pairs the pipeline has completed, keyed by forward read file path."""
+    def __init__(self, completed_pairs_fp):
+        self.completed_pairs_fp = completed_pairs_fp
+        self.pair_states = {}
+        if os.path.exists(completed_pairs_fp):
+            self.read()
+
+    def __len__(self):
+        return len(self.pair_states)
+
+    def read(self):
+        with open(self.completed_pairs_fp, 'rt') as completed_pairs_file:
+            header = completed_pairs_file.readline().rstrip('\n').split('\t')
+            for line in completed_pairs_file:
+                if len(line.strip()) == 0:
+                    continue
+                row = dict(zip(header, line.rstrip('\n').split('\t')))
+                pair_state = ReadPairState(
+                    forward=FileState(
+                        fp=row['forward_fp'],
+                        size=int(row['forward_size']),
+                        mtime_ns=int(row['forward_mtime_ns']),
+                        sha256=row['forward_sha256']),
+                    reverse=FileState(
+                        fp=row['reverse_fp'],
+                        size=int(row['reverse_size']),
+                        mtime_ns=int(row['reverse_mtime_ns']),
+                        sha256=row['reverse_sha256']))
+                self.pair_states[pair_state.forward.fp] = (pair_state, row['completed_time'])
+
+    def write(self):
+        """Write the record to a temporary file and rename it so an interrupted write loses nothing."""
+        temporary_fp = self.completed_pairs_fp + '.tmp'
+        with open(temporary_fp, 'wt') as completed_pairs_file:
+            completed_pairs_file.write('\t'.join(completed_pairs_columns))
+            completed_pairs_file.write('\n')
+            for forward_fp in sorted(self.pair_states):
+                pair_state, completed_time = self.pair_states[forward_fp]
+                completed_pairs_file.write('\t'.join((
+                    pair_state.forward.fp,
+                    str(pair_state.forward.size),
+                    str(pair_state.forward.mtime_ns),
+                    pair_state.forward.sha256,
+                    pair_state.reverse.fp,
+                    str(pair_state.reverse.size),
+                    str(pair_state.reverse.mtime_ns),
+                    pair_state.reverse.sha256,
+                    completed_time)))
+                completed_pairs_file.write('\n')
+        os.replace(temporary_fp, self.completed_pairs_fp)
+
+    def add(self, pair_state, completed_time=None):
+        """Record a completed read pair. Both file states must have checksums."""
+        if completed_time is None:
+            completed_time = time.strftime('%Y-%m-%dT%H:%M:%S')
+        self.pair_states[pair_state.forward.fp] = (
+            ReadPairState(forward=pair_state.forward.with_checksum(), reverse=pair_state.reverse.with_checksum()),
+            completed_time)
+
+    def is_completed(self, pair_state):
+        """Return True if this read pair was completed with the same file contents.
+
+        Files with the recorded size and modification time are assumed unchanged. Otherwise
+        checksums are compared and, if they match, the new modification times are recorded.
+        """
+        if pair_state.forward.fp not in self.pair_states:
+            return False
+        completed_pair_state, completed_time = self.pair_states[pair_state.forward.fp]
+        if completed_pair_state.reverse.fp != pair_state.reverse.fp:
+            return False
+        elif completed_pair_state.forward.same_stat(pair_state.forward) \
+                and completed_pair_state.reverse.same_stat(pair_state.reverse):
+            return True
+        elif completed_pair_state.forward.size != pair_state.forward.size \
+                or completed_pair_state.reverse.size != pair_state.reverse.size:
+            return False
+        elif completed_pair_state.forward.sha256 == get_file_sha256(pair_state.forward.fp) \
+                and completed_pair_state.reverse.sha256 == get_file_sha256(pair_state.reverse.fp):
+            self.add(
+                ReadPairState(
+                    forward=pair_state.forward._replace(sha256=completed_pair_state.forward.sha256),
+                    reverse=pair_state.reverse._replace(sha256=completed_pair_state.reverse.sha256)),
+                completed_time=completed_time)
+            return True
+        else:
+            return False
+
+
+def get_settled_read_pairs(input_dp, settle_seconds=60.0, now=None):
+    """Return ReadPairState for each *_R1_* file with a *_R2_* file where neither has changed for settle_seconds.
+
+    Forward read files without a reverse read file yet are skipped rather than raising an
+    exception as in write_launcher_job_file since the reverse read file may still be arriving.
+    """
+    if now is None:
+        now = time.time()
+    read_pair_states = []
+    for forward_fp in sorted(glob.glob(os.path.join(input_dp, '*_R1_*'))):
+        reverse_fp = forward_fp.replace('_R1_', '_R2_')
+        try:
+            pair_state = ReadPairState(forward=FileState.stat(forward_fp), reverse=FileState.stat(reverse_fp))
+        except FileNotFoundError:
+            continue
+        last_modified = max(pair_state.forward.mtime_ns, pair_state.reverse.mtime_ns) / 1e9
+        if now - last_modified >= settle_seconds:
+            read_pair_states.append(pair_state)
+    return read_pair_states
+
+
+class InputWatcher:
+    """Find new or changed read pairs in an input directory and run the pipeline for each one."""
+    def __init__(self, input_dp, completed_pairs_fp, get_command_line, settle_seconds=60.0, total_cores=None):
+        """
+        :param get_command_line: function of a forward read file path returning a command line
+        """
+        self.input_dp = input_dp
+        self.completed_pairs = CompletedPairs(completed_pairs_fp)
+        self.get_command_line = get_command_line
+        self.settle_seconds = settle_seconds
+        self.scheduler = WorkQueueScheduler(total_cores=total_cores)
+        # read pair states of failed pipelines by forward read file path
+        self.failed_pair_states = {}
+        # read pair states and tasks of queued or running pipelines by task id
+        self.running_pairs = {}
+
+    def get_new_read_pairs(self):
+        running_forward_fps = {pair_state.forward.fp for pair_state, _ in self.running_pairs.values()}
+        new_pair_states = []
+        for pair_state in get_settled_read_pairs(self.input_dp, settle_seconds=self.settle_seconds):
+            failed_pair_state = self.failed_pair_states.get(pair_state.forward.fp)
+            if pair_state.forward.fp in running_forward_fps:
+                # a pair changed while it runs is run again by a later poll
+                continue
+            elif failed_pair_state is not None \
+                    and failed_pair_state.forward.same_stat(pair_state.forward) \
+                    and failed_pair_state.reverse.same_stat(pair_state.reverse):
+                continue
+            elif not self.completed_pairs.is_completed(pair_state):
+                new_pair_states.append(pair_state)
+        return new_pair_states
+
+    def poll(self):
+        """Record pipelines that have finished and queue the pipeline of every new or changed read pair.
+
+        :return: list of Task, one for each read pair that was queued
+        """
+        log = logging.getLogger(name=self.__class__.__name__)
+        self.record_finished_tasks(self.scheduler.wait_for_tasks(timeout=0.0))
+        new_pair_states = self.get_new_read_pairs()
+        log.info(
+            'found %d new or changed read pairs, %d read pairs running, %d read pairs completed before',
+            len(new_pair_states), len(self.running_pairs), len(self.completed_pairs))
+        # is_completed may have recorded new modification times
+        self.completed_pairs.write()
+        if len(new_pair_states) == 0:
+            return []
+
+        # checksum before running so a file changed during the run is run again
+        new_pair_states = [
+            ReadPairState(forward=p.forward.with_checksum(), reverse=p.reverse.with_checksum())
+            for p
+            in new_pair_states
+        ]
+        tasks = get_tasks(
+            [self.get_command_line(p.forward.fp) for p in new_pair_states],
+            first_task_id=len(self.scheduler.tasks))
+        for pair_state, task in zip(new_pair_states, tasks):
+            self.running_pairs[task.task_id] = (pair_state, task)
+        self.scheduler.add_tasks(tasks)
+        self.scheduler.start_ready_tasks()
+        return tasks
+
+    def wait(self, timeout=None):
+        """Record pipelines as they finish for up to timeout seconds, or until every queued pipeline has finished.
+
+        :return: list of Task, one for each pipeline that finished
+        """
+        finished_tasks = []
+        deadline = None if timeout is None else time.time() + timeout
+        while len(self.running_pairs) > 0 and (deadline is None or time.time() < deadline):
+            tasks = self.scheduler.wait_for_tasks(timeout=None if deadline is None else deadline - time.time())
+            self.record_finished_tasks(tasks)
+            finished_tasks.extend(tasks)
+        return finished_tasks
+
+    def record_finished_tasks(self, tasks):
+        log = logging.getLogger(name=self.__class__.__name__)
+        for task in tasks:
+            pair_state, _ = self.running_pairs.pop(task.task_id)
+            if task.returncode == 0:
+                self.completed_pairs.add(pair_state)
+                self.failed_pair_states.pop(pair_state.forward.fp, None)
+            else:
+                log.error('pipeline failed for "%s" with return code %d', pair_state.forward.fp, task.returncode)
+                self.failed_pair_states[pair_state.forward.fp] = pair_state
+        if len(tasks) > 0:
+            self.completed_pairs.write()
+
+    def watch(self, poll_seconds=60.0, max_polls=None):
+        """Poll the input directory every poll_seconds, recording pipelines as they finish between polls.
+
+        After max_polls polls the pipelines already queued are waited for.
+        """
+        poll_count = 0
+        while max_polls is None or poll_count < max_polls:
+            if poll_count > 0:
+                next_poll_time = time.time() + poll_seconds
+                self.wait(timeout=poll_seconds)
+                time.sleep(max(0.0, next_poll_time - time.time()))
+            self.poll()
+            poll_count += 1
+        self.wait()
+
+
+def get_args(argv=None):
+    arg_parser = argparse.ArgumentParser(
+        description='run the pipeline for new or changed read file pairs in an input directory')
+    arg_parser.add_argument('-i', '--input-dp', required=True, help='directory of input files')
+    arg_parser.add_argument('-w', '--work-dp-template', required=True, help='template for working directory')
+    arg_parser.add_argument('-c', '--core-count', default=1, help='number of cores for each pipeline')
+    arg_parser.add_argument('-p', '--prefix-regex', required=True, help='regular expression matching the input file name with named group <prefix>')
+    arg_parser.add_argument('--forward-primer', default='CCAGCASCYGCGGTAATTCC', help='forward primer to be clipped')
+    arg_parser.add_argument('--reverse-primer', default='TYRATCAAGAACGAAAGT', help='reverse primer to be clipped')
+    arg_parser.add_argument('--min-overlap', type=int, default=20, help='minimum overlap for joining paired ends')
+    arg_parser.add_argument('--phred', default='33', help='33 or 64')
+    arg_parser.add_argument('--completed-fp', default=completed_pairs_file_name, help='record of completed read pairs, default is {} in the current directory'.format(completed_pairs_file_name))
+    arg_parser.add_argument('--settle-seconds', type=float, default=60.0, help='seconds a read file must be unmodified before it is run')
+    arg_parser.add_argument('--poll-seconds', type=float, default=60.0, help='seconds between polls of the input directory')
+    arg_parser.add_argument('--once', action='store_true', default=False, help='poll the input directory once and exit')
+    arg_parser.add_argument('--total-cores', type=int, default=None, help='cores available to all pipelines, default is all cores available to this process')
+    args = arg_parser.parse_args(argv)
+    return args
+
+
+def main():
+    logging.basicConfig(level=logging.INFO)
+    args = get_args()
+
+    def get_command_line(forward_fp):
+        return get_pipeline_command_line(
+            forward_fp=forward_fp,
+            work_dp_template=args.work_dp_template,
+            forward_primer=args.forward_primer,
+            reverse_primer=args.reverse_primer,
+            prefix_regex=args.prefix_regex,
+            phred=args.phred,
+            core_count=args.core_count,
+            min_overlap=args.min_overlap)
+
+    watcher = InputWatcher(
+        input_dp=args.input_dp,
+        completed_pairs_fp=args.completed_fp,
+        get_command_line=get_command_line,
+        settle_seconds=args.settle_seconds,
+        total_cores=args.total_cores)
+    try:
+        watcher.watch(poll_seconds=args.poll_seconds, max_polls=1 if args.once else None)
+    except KeyboardInterrupt:
+        pass
+
+    if len(watcher.failed_pair_states) > 0:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
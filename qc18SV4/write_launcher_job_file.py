@@ -5,8 +5,9 @@ import argparse
 import glob
 import math
 import os
+import re
 
-from .pipeline import PipelineException
+from .exceptions import PipelineException
 
 
 def get_args():
@@ -39,22 +40,14 @@ def write_launcher_job_file(
         trimmomatic_minlen=50,
         min_overlap=20):
 
-    forward_read_file_path_set = glob.glob(os.path.join(input_dp, '*_R1*'))
-    reverse_read_file_path_set = glob.glob(os.path.join(input_dp, '*_R2*'))
+    forward_reverse_read_pairs = get_forward_reverse_read_pairs(input_dp)
 
-    if len(forward_read_file_path_set) == 0:
-        raise PipelineException('found no forward read files in directory "{}"'.format(input_dp))
     # this script will run in muscope-18SV4/stampede2 but Launcher
     # jobs will run in the Launcher's work directory
     # so specify absolute paths
     singularity_container_fp = os.path.abspath('muscope-18SV4.img')
     print('path to Singularity container: {}'.format(singularity_container_fp))
 
-    forward_reverse_read_pairs = [
-        (forward_fp, reverse_fp)
-        for forward_fp, reverse_fp
-        in get_file_path_pairs(forward_read_file_path_set, reverse_read_file_path_set)]
-
     slurm_job_num_nodes = int(os.environ['SLURM_JOB_NUM_NODES'])
     slurm_ntasks = int(os.environ['SLURM_NTASKS'])
     slurm_job_cpus_per_node = int(os.environ['SLURM_JOB_CPUS_PER_NODE'])
@@ -75,19 +68,66 @@ def write_launcher_job_file(
     with open(job_fp, 'wt') as job_file:
         for forward_fp, _ in forward_reverse_read_pairs:
             job_file.write(
-                'singularity exec muscope-18SV4.img pipeline '
-                + '-f {} '.format(forward_fp)
-                + '-w {} '.format(work_dp_template)
-                + '-c {} '.format(core_count)
-                + '-p "{}" '.format(prefix_regex)
-                + '--forward-primer {} '.format(forward_primer)
-                + '--reverse-primer {} '.format(reverse_primer)
-                + '--min-overlap {} '.format(min_overlap)
-                + '--phred {} '.format(phred)
+                'singularity exec muscope-18SV4.img '
+                + get_pipeline_command_line(
+                    forward_fp=forward_fp,
+                    work_dp_template=work_dp_template,
+                    forward_primer=forward_primer,
+                    reverse_primer=reverse_primer,
+                    prefix_regex=prefix_regex,
+                    phred=phred,
+                    core_count=core_count,
+                    min_overlap=min_overlap)
                 + '\n'
             )
 
-    return len(forward_read_file_path_set)
+    return len(forward_reverse_read_pairs)
+
+
+def get_forward_reverse_read_pairs(input_dp):
+    forward_read_file_path_set = glob.glob(os.path.join(input_dp, '*_R1*'))
+    reverse_read_file_path_set = glob.glob(os.path.join(input_dp, '*_R2*'))
+
+    if len(forward_read_file_path_set) == 0:
+        raise PipelineException('found no forward read files in directory "{}"'.format(input_dp))
+
+    return [
+        (forward_fp, reverse_fp)
+        for forward_fp, reverse_fp
+        in get_file_path_pairs(forward_read_file_path_set, reverse_read_file_path_set)]
+
+
+def get_pipeline_command_line(
+        forward_fp,
+        work_dp_template,
+        forward_primer, reverse_primer,
+        prefix_regex,
+        phred,
+        core_count=1,
+        min_overlap=20):
+
+    return (
+        'pipeline '
+        + '-f {} '.format(forward_fp)
+        + '-w {} '.format(get_work_dp(work_dp_template, prefix_regex, forward_fp))
+        + '-c {} '.format(core_count)
+        + '-p "{}" '.format(prefix_regex)
+        + '--forward-primer {} '.format(forward_primer)
+        + '--reverse-primer {} '.format(reverse_primer)
+        + '--min-overlap {} '.format(min_overlap)
+        + '--phred {} '.format(phred)
+    )
+
+
+def get_work_dp(work_dp_template, prefix_regex, forward_fp):
+    """Replace {prefix} in work_dp_template with the prefix of the forward read file name."""
+    if '{prefix}' not in work_dp_template:
+        return work_dp_template
+    match = re.search(prefix_regex, os.path.basename(forward_fp))
+    if match is None:
+        raise PipelineException(
+            'prefix regex "{}" does not match "{}"'.format(prefix_regex, os.path.basename(forward_fp)))
+    return work_dp_template.replace('{prefix}', match.group('prefix'))
 
 
 def get_file_path_pairs(forward_read_file_paths, reverse_read_file_paths):
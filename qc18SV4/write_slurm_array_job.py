@@ -0,0 +1,231 @@
+"""
+write_slurm_array_job.py
+
+Write SLURM array jobs as an alternative to a TACC Launcher job file. Samples are
+grouped into size classes by the size of their input files and each class gets its
+own array job script with its own --cpus-per-task, --mem, and --time, so a few large
+samples do not force a large allocation on every sample.
+
+The following files are written to the output directory:
+
+    samples.tsv           one line per sample: size class, array task index, input bytes, pipeline command line
+    <job name>.<class>.sh one array job script per size class with at least one sample
+    submit.sh             submits every array job script with sbatch
+
+A size class is given as NAME,MAX_INPUT_GB,CPUS,MEM_GB,HH:MM:SS and a sample is placed
+in the first class with MAX_INPUT_GB at least its forward and reverse read gigabytes.
+If step metrics of past runs are given the memory and time limit of each class are
+predicted for its largest sample as by plan_slurm_job.
+
+    $ write_slurm_array_job -i input_dir -o jobs -w work/{prefix} -p "^(?P<prefix>[a-zA-Z0-9_]+)_L001_R[12]" --max-concurrent 20
+"""
+import argparse
+from collections import OrderedDict, namedtuple
+import math
+import os
+import re
+
+from .exceptions import PipelineException
+from .write_launcher_job_file import get_forward_reverse_read_pairs, get_pipeline_command_line
+
+
+SizeClass = namedtuple('SizeClass', ['name', 'max_input_bytes', 'cpus_per_task', 'mem_gb', 'time_limit'])
+
+default_size_classes = (
+    SizeClass(name='small', max_input_bytes=2**30, cpus_per_task=1, mem_gb=4, time_limit='02:00:00'),
+    SizeClass(name='medium', max_input_bytes=4 * 2**30, cpus_per_task=4, mem_gb=8, time_limit='06:00:00'),
+    SizeClass(name='large', max_input_bytes=math.inf, cpus_per_task=8, mem_gb=16, time_limit='12:00:00'),
+)
+
+time_limit_pattern = re.compile(r'^\d+:\d\d:\d\d$')
+
+
+def parse_size_class(size_class_spec):
+    """Parse NAME,MAX_INPUT_GB,CPUS,MEM_GB,HH:MM:SS where MAX_INPUT_GB may be inf."""
+    try:
+        name, max_input_gb, cpus_per_task, mem_gb, time_limit = size_class_spec.split(',')
+        size_class = SizeClass(
+            name=name,
+            max_input_bytes=float(max_input_gb) * 2**30,
+            cpus_per_task=int(cpus_per_task),
+            mem_gb=int(mem_gb),
+            time_limit=time_limit)
+    except ValueError as e:
+        raise PipelineException(
+            'failed to parse size class "{}", expected NAME,MAX_INPUT_GB,CPUS,MEM_GB,HH:MM:SS'.format(
+                size_class_spec)) from e
+    if time_limit_pattern.match(size_class.time_limit) is None:
+        raise PipelineException('time limit "{}" is not HH:MM:SS'.format(size_class.time_limit))
+    return size_class
+
+
+def get_args():
+    arg_parser = argparse.ArgumentParser()
+    arg_parser.add_argument('-o', '--output-dp', required=True, help='directory for the array job scripts')
+    arg_parser.add_argument('-i', '--input-dp', required=True, help='directory of input files')
+    arg_parser.add_argument('-w', '--work-dp-template', required=True, help='template for working directory, {prefix} is replaced with the sample prefix')
+    arg_parser.add_argument('-p', '--prefix-regex', required=True, help='regular expression matching the input file name with named group <prefix>')
+    arg_parser.add_argument('--forward-primer', default='CCAGCASCYGCGGTAATTCC', help='forward primer to be clipped')
+    arg_parser.add_argument('--reverse-primer', default='TYRATCAAGAACGAAAGT', help='reverse primer to be clipped')
+    arg_parser.add_argument('--min-overlap', type=int, default=20, help='minimum overlap for joining paired ends')
+    arg_parser.add_argument('--phred', default='33', help='33 or 64')
+    arg_parser.add_argument('--job-name', default='muscope-18SV4', help='SLURM job name')
+    arg_parser.add_argument('--partition', default=None, help='SLURM partition')
+    arg_parser.add_argument('--account', default=None, help='SLURM account')
+    arg_parser.add_argument('--max-concurrent', type=int, default=None, help='most array tasks of each size class to run at once')
+    arg_parser.add_argument('--size-class', action='append', type=parse_size_class, dest='size_classes', help='NAME,MAX_INPUT_GB,CPUS,MEM_GB,HH:MM:SS, may be repeated')
+    arg_parser.add_argument('--singularity-image', default=None, help='run the pipeline in this Singularity image')
+    arg_parser.add_argument('-m', '--step-metrics', nargs='+', default=None, help='step_metrics.tsv files or work directories of past runs used to predict memory and time limits')
+    arg_parser.add_argument('--safety-factor', type=float, default=1.25, help='multiplier for predicted memory and time')
+    args = arg_parser.parse_args()
+    return args
+
+
+def get_size_class(input_bytes, size_classes):
+    for size_class in size_classes:
+        if input_bytes <= size_class.max_input_bytes:
+            return size_class
+    raise PipelineException('no size class for a sample with {} input bytes'.format(input_bytes))
+
+
+def assign_size_classes(forward_reverse_read_pairs, size_classes):
+    """Group read pairs by size class.
+
+    :return: OrderedDict of SizeClass to list of (forward_fp, input_bytes) in size class order
+    """
+    samples = OrderedDict((size_class, []) for size_class in size_classes)
+    for forward_fp, reverse_fp in sorted(forward_reverse_read_pairs):
+        input_bytes = os.path.getsize(forward_fp) + os.path.getsize(reverse_fp)
+        samples[get_size_class(input_bytes, size_classes)].append((forward_fp, input_bytes))
+    return OrderedDict((size_class, s) for size_class, s in samples.items() if len(s) > 0)
+
+
+def predict_size_class_limits(samples, step_metrics_paths, safety_factor):
+    """Replace the memory and time limit of each size class with predictions for its largest sample."""
+    from .planner import fit_step_models, format_wall_time, get_step_metrics_fp_list, predict_sample
+    from .step_metrics import read_step_metrics
+
+    step_models = fit_step_models(
+        [read_step_metrics(fp) for fp in get_step_metrics_fp_list(step_metrics_paths)])
+    predicted_samples = OrderedDict()
+    for size_class, class_samples in samples.items():
+        predictions = [predict_sample(fp, input_bytes, step_models) for fp, input_bytes in class_samples]
+        predicted_size_class = size_class._replace(
+            mem_gb=max(1, int(math.ceil(safety_factor * max(p.peak_memory_bytes for p in predictions) / 2**30))),
+            time_limit=format_wall_time(safety_factor * max(p.seconds for p in predictions)))
+        predicted_samples[predicted_size_class] = class_samples
+    return predicted_samples
+
+
+def write_slurm_array_job(
+        output_dp,
+        input_dp,
+        work_dp_template,
+        forward_primer, reverse_primer,
+        prefix_regex,
+        phred,
+        min_overlap=20,
+        job_name='muscope-18SV4',
+        partition=None,
+        account=None,
+        max_concurrent=None,
+        size_classes=None,
+        singularity_image=None,
+        step_metrics=None,
+        safety_factor=1.25):
+    """Write samples.tsv, one array job script per size class, and submit.sh.
+
+    :return: OrderedDict of SizeClass to the number of samples in the class
+    """
+    if size_classes is None:
+        size_classes = default_size_classes
+
+    samples = assign_size_classes(get_forward_reverse_read_pairs(input_dp), size_classes)
+    if step_metrics is not None:
+        samples = predict_size_class_limits(samples, step_metrics, safety_factor)
+
+    os.makedirs(output_dp, exist_ok=True)
+    # array tasks run in the submission directory so use absolute paths
+    sample_index_fp = os.path.abspath(os.path.join(output_dp, 'samples.tsv'))
+    command_prefix = '' if singularity_image is None else 'singularity exec {} '.format(singularity_image)
+    with open(sample_index_fp, 'wt') as sample_index_file:
+        sample_index_file.write('size_class\ttask_index\tinput_bytes\tcommand_line\n')
+        for size_class, class_samples in samples.items():
+            for task_index, (forward_fp, input_bytes) in enumerate(class_samples):
+                command_line = command_prefix + get_pipeline_command_line(
+                    forward_fp=os.path.abspath(forward_fp),
+                    work_dp_template=work_dp_template,
+                    forward_primer=forward_primer,
+                    reverse_primer=reverse_primer,
+                    prefix_regex=prefix_regex,
+                    phred=phred,
+                    core_count=size_class.cpus_per_task,
+                    min_overlap=min_overlap)
+                sample_index_file.write(
+                    '{}\t{}\t{}\t{}\n'.format(size_class.name, task_index, input_bytes, command_line.strip()))
+
+    script_fp_list = []
+    for size_class, class_samples in samples.items():
+        script_fp = os.path.join(output_dp, '{}.{}.sh'.format(job_name, size_class.name))
+        with open(script_fp, 'wt') as script_file:
+            script_file.write(
+                get_array_job_script(
+                    job_name=job_name,
+                    size_class=size_class,
+                    task_count=len(class_samples),
+                    sample_index_fp=sample_index_fp,
+                    partition=partition,
+                    account=account,
+                    max_concurrent=max_concurrent))
+        script_fp_list.append(script_fp)
+
+    with open(os.path.join(output_dp, 'submit.sh'), 'wt') as submit_file:
+        submit_file.write('#!/bin/bash\n')
+        for script_fp in script_fp_list:
+            submit_file.write('sbatch {}\n'.format(os.path.abspath(script_fp)))
+
+    return OrderedDict((size_class, len(class_samples)) for size_class, class_samples in samples.items())
+
+
+def get_array_job_script(
+        job_name, size_class, task_count, sample_index_fp, partition=None, account=None, max_concurrent=None):
+    array = '0-{}'.format(task_count - 1)
+    if max_concurrent is not None:
+        array += '%{}'.format(max_concurrent)
+
+    sbatch_lines = [
+        '#SBATCH --job-name={}-{}'.format(job_name, size_class.name),
+        '#SBATCH --array={}'.format(array),
+        '#SBATCH --ntasks=1',
+        '#SBATCH --cpus-per-task={}'.format(size_class.cpus_per_task),
+        '#SBATCH --mem={}G'.format(size_class.mem_gb),
+        '#SBATCH --time={}'.format(size_class.time_limit),
+        '#SBATCH --output={}-{}-%A_%a.out'.format(job_name, size_class.name),
+    ]
+    if partition is not None:
+        sbatch_lines.append('#SBATCH --partition={}'.format(partition))
+    if account is not None:
+        sbatch_lines.append('#SBATCH --account={}'.format(account))
+
+    return '\n'.join([
+        '#!/bin/bash',
+        *sbatch_lines,
+        '',
+        'COMMAND_LINE=$(awk -F \'\\t\' -v size_class={} -v task_index=$SLURM_ARRAY_TASK_ID '
+        '\'$1 == size_class && $2 == task_index {{ print $4 }}\' {})'.format(size_class.name, sample_index_fp),
+        'echo "${COMMAND_LINE}"',
+        'eval "${COMMAND_LINE}"',
+        '',
+    ])
+
+
+def main():
+    args = get_args()
+    size_class_counts = write_slurm_array_job(**args.__dict__)
+    for size_class, count in size_class_counts.items():
+        print('{}: {} samples, {} cpus, {}G memory, {} time limit'.format(
+            size_class.name, count, size_class.cpus_per_task, size_class.mem_gb, size_class.time_limit))
+
+
+if __name__ == '__main__':
+    main()
@@ -72,9 +72,7 @@ setup(
     # your project is installed. For an analysis of "install_requires" vs pip's
     # requirements files see:
     # https://packaging.python.org/en/latest/requirements.html
-    install_requires=[
-        'biopython'
-    ],
+    install_requires=[],
 
     # List additional groups of dependencies here (e.g. development
     # dependencies). You can install these using the following syntax,
@@ -83,6 +81,8 @@ setup(
     extras_require={
         'dev': [],
         'test': ['pytest'],
+        'read_table': ['pyarrow'],
+        'zstd': ['zstandard'],
     },
 
     # If there are data files included in your packages that need to be
@@ -104,7 +104,17 @@ setup(
     entry_points={
         'console_scripts': [
             'pipeline=qc18SV4.pipeline:main',
-            'write_launcher_job_file=qc18SV4.write_launcher_job_file:main'
+            'write_launcher_job_file=qc18SV4.write_launcher_job_file:main',
+            'run_job_file=qc18SV4.run_job_file:main',
+            'aggregate_read_counts=qc18SV4.read_counts:main',
+            'benchmark_compression=qc18SV4.compression:main',
+            'plan_slurm_job=qc18SV4.planner:main',
+            'write_slurm_array_job=qc18SV4.write_slurm_array_job:main',
+            'watch_input=qc18SV4.watch_input:main',
+            'profile_input=qc18SV4.input_profile:main',
+            'benchmark_orchestration=qc18SV4.tool_shims:main_benchmark',
+            'merge_traces=qc18SV4.trace:main',
+            'verify_checksums=qc18SV4.checksums:main'
         ],
     },
 )
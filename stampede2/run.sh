@@ -21,6 +21,7 @@ echo ${LAUNCHER_JOB_FILE}
 #python write_launcher_job_file.py -i ${INPUT_DIR} -j ${LAUNCHER_JOB_FILE} -w ${OUTPUT_DIR}/work-${SLURM_JOB_ID}-{prefix}
 singularity exec muscope-18SV4.img write_launcher_job_file -i ${INPUT_DIR} -j ${LAUNCHER_JOB_FILE} -w ${OUTPUT_DIR}/work-${SLURM_JOB_ID}-{prefix}
 sleep 10
+# plan_slurm_job recommends LAUNCHER_PPN, node count, and wall time from the step metrics of past runs
 export LAUNCHER_PPN=2
 
 $LAUNCHER_DIR/paramrun
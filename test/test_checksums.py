@@ -0,0 +1,99 @@
+import hashlib
+import os
+import tempfile
+
+import pytest
+
+from qc18SV4.checksums import (
+    ChecksumFile, find_checksums_files, get_args, get_file_checksums, read_checksums, verify_checksums,
+    write_checksums)
+from qc18SV4.compression import open_compressed
+from qc18SV4.manifest import StepManifest, count_records_and_checksums
+from qc18SV4.pipeline_util import compress_file
+
+
+fastq = '@r1\nACGT\n+\nIIII\n' * 10
+
+
+def hash_file(fp):
+    with open(fp, 'rb') as f:
+        data = f.read()
+    return len(data), hashlib.md5(data).hexdigest(), hashlib.sha256(data).hexdigest()
+
+
+@pytest.mark.parametrize('file_name', ['unittest.fastq', 'unittest.fastq.gz', 'unittest.fastq.zst'])
+def test_checksum_file(file_name):
+    if file_name.endswith('.zst'):
+        pytest.importorskip('zstandard')
+
+    with tempfile.TemporaryDirectory() as work_dir:
+        fp = os.path.join(work_dir, file_name)
+        with ChecksumFile(fp, 'wb') as checksum_file, open_compressed(fp, 'wt', fileobj=checksum_file) as f:
+            f.write(fastq)
+        # the checksums are of the bytes on disk
+        assert tuple(checksum_file.checksums) == hash_file(fp)
+        assert get_file_checksums(fp) == checksum_file.checksums
+
+        counts, checksums = count_records_and_checksums(fp)
+        assert counts == (10, 40)
+        assert checksums == checksum_file.checksums
+
+
+@pytest.mark.parametrize('compression', ['gzip', 'zstd'])
+def test_compress_file_checksums(compression):
+    if compression == 'zstd':
+        pytest.importorskip('zstandard')
+
+    with tempfile.TemporaryDirectory() as work_dir:
+        fastq_fp = os.path.join(work_dir, 'unittest.fastq')
+        with open(fastq_fp, 'wt') as fastq_file:
+            fastq_file.write(fastq)
+        file_checksums = {}
+        compressed_fp, counts = compress_file(
+            fastq_fp, compression=compression, level=1, file_checksums=file_checksums)
+        assert counts == (10, 40)
+        assert tuple(file_checksums[fastq_fp]) == hash_file(fastq_fp)
+        assert tuple(file_checksums[compressed_fp]) == hash_file(compressed_fp)
+
+
+def test_write_and_verify_checksums():
+    with tempfile.TemporaryDirectory() as work_dir:
+        output_dir = os.path.join(work_dir, 'step_01')
+        os.mkdir(output_dir)
+        file_checksums = {}
+        manifest = StepManifest(step_name='step_01', output_dir=output_dir, file_checksums=file_checksums)
+        fastq_fp = os.path.join(output_dir, 'unittest.fastq.gz')
+        with ChecksumFile(fastq_fp, 'wb') as checksum_file, open_compressed(fastq_fp, 'wt', fileobj=checksum_file) as f:
+            f.write(fastq)
+        file_checksums[fastq_fp] = checksum_file.checksums
+        manifest.add(role='reads', fp=fastq_fp)
+        # a file with no checksums is hashed while it is counted
+        log_fp = os.path.join(output_dir, 'log')
+        with open(log_fp, 'wt') as log_file:
+            log_file.write('log\n')
+        manifest.add(role='log', fp=log_fp)
+        assert file_checksums[log_fp] == get_file_checksums(log_fp)
+
+        entries = write_checksums(work_dir, manifest.output_files)
+        assert [entry.path for entry in entries] == ['step_01/unittest.fastq.gz', 'step_01/log']
+        assert entries[0].record_count == 10
+        assert entries[1].record_count is None
+        checksums_fp = os.path.join(work_dir, 'checksums.tsv')
+        assert read_checksums(checksums_fp) == entries
+        with open(os.path.join(work_dir, 'checksums.md5'), 'rt') as md5sum_file:
+            assert md5sum_file.readline() == '{}  step_01/unittest.fastq.gz\n'.format(hash_file(fastq_fp)[1])
+
+        assert find_checksums_files([work_dir]) == [checksums_fp]
+        assert [result.status for result in verify_checksums(checksums_fp)] == ['unchanged', 'unchanged']
+        assert [result.status for result in verify_checksums(checksums_fp, full=True)] == ['ok', 'ok']
+
+        with open(log_fp, 'at') as log_file:
+            log_file.write('more log\n')
+        os.remove(fastq_fp)
+        assert [result.status for result in verify_checksums(checksums_fp)] == ['missing', 'changed']
+
+
+def test_get_args():
+    args = get_args(['work-1', 'work-2', '--full'])
+    assert args.work_dp == ['work-1', 'work-2']
+    assert args.full
@@ -0,0 +1,85 @@
+import os
+import tempfile
+
+import pytest
+
+import qc18SV4.compression
+from qc18SV4.compression import (
+    CompressionPolicy, benchmark_compression_policies, get_benchmark_policies, get_compression, open_compressed,
+    strip_compression_extension)
+from qc18SV4.exceptions import PipelineException
+from qc18SV4.pipeline_util import compress_file, decompress_file
+
+
+fastq = '@r1\nACGT\n+\nIIII\n' * 10
+
+
+def write_fastq(work_dir):
+    fastq_fp = os.path.join(work_dir, 'unittest.fastq')
+    with open(fastq_fp, 'wt') as fastq_file:
+        fastq_file.write(fastq)
+    return fastq_fp
+
+
+def test_compression_policy():
+    assert CompressionPolicy.create() == ('gzip', 1, 9)
+    assert CompressionPolicy.create(intermediate_format='zstd') == ('zstd', 3, 9)
+    assert CompressionPolicy.create(intermediate_level=6, output_level=4) == ('gzip', 6, 4)
+
+
+def test_strip_compression_extension():
+    assert strip_compression_extension('a.fastq.gz') == 'a.fastq'
+    assert strip_compression_extension('a.fastq.zst') == 'a.fastq'
+    assert strip_compression_extension('a.fastq') == 'a.fastq'
+
+
+@pytest.mark.parametrize('compression', ['gzip', 'zstd'])
+def test_compress_and_decompress_file(compression):
+    if compression == 'zstd':
+        pytest.importorskip('zstandard')
+
+    with tempfile.TemporaryDirectory() as work_dir:
+        fastq_fp = write_fastq(work_dir)
+        compressed_fp, counts = compress_file(fastq_fp, compression=compression, level=1)
+        assert get_compression(compressed_fp) == compression
+        assert counts == (10, 40)
+
+        # the format is detected from the file so a misleading name does not matter
+        renamed_fp = os.path.join(work_dir, 'renamed.fastq')
+        os.rename(compressed_fp, renamed_fp)
+        with open_compressed(renamed_fp, 'rt') as f:
+            assert f.read() == fastq
+        os.rename(renamed_fp, compressed_fp)
+
+        os.remove(fastq_fp)
+        assert decompress_file(compressed_fp) == fastq_fp
+        with open(fastq_fp, 'rt') as f:
+            assert f.read() == fastq
+
+
+def test_benchmark_compression_policies():
+    with tempfile.TemporaryDirectory() as work_dir:
+        fastq_fp = write_fastq(work_dir)
+        policies = {
+            'gzip-9': CompressionPolicy.create(intermediate_level=9),
+            'gzip-1': CompressionPolicy.create(intermediate_level=1),
+        }
+        results = benchmark_compression_policies([fastq_fp], policies)
+        assert [result.policy for result in results] == ['gzip-9', 'gzip-1']
+        assert all(result.input_bytes == len(fastq) for result in results)
+        assert all(0 < result.output_bytes < len(fastq) for result in results)
+        # benchmark files are removed
+        assert os.listdir(work_dir) == ['unittest.fastq']
+
+
+def test_get_benchmark_policies(monkeypatch):
+    assert list(get_benchmark_policies(['gzip-1', 'zstd-3'])) == ['gzip-1', 'zstd-3']
+
+    def fail_to_import_zstandard():
+        raise PipelineException('zstd compression requires zstandard')
+
+    # without zstandard the default policies are the gzip policies and asking for zstd fails
+    monkeypatch.setattr(qc18SV4.compression, 'import_zstandard', fail_to_import_zstandard)
+    assert list(get_benchmark_policies()) == ['gzip-9', 'gzip-6', 'gzip-1']
+    with pytest.raises(PipelineException):
+        get_benchmark_policies(['gzip-1', 'zstd-1'])
@@ -0,0 +1,87 @@
+import os
+import tempfile
+
+import pytest
+
+from qc18SV4.demultiplex import (
+    Amplicon, AmpliconClassifier, PrimerMatcher, demultiplex_read_pairs, read_primer_table, reverse_complement)
+from qc18SV4.exceptions import PipelineException
+
+
+amplicons = [
+    Amplicon(name='18SV4', forward_primer='CCAGCASCYGCGGTAATTCC', reverse_primer='TYRATCAAGAACGAAAGT'),
+    Amplicon(name='16SV4V5', forward_primer='GTGYCAGCMGCCGCGGTAA', reverse_primer='AAACTYAAAKRAATTGRCGG'),
+]
+
+
+def test_reverse_complement():
+    assert reverse_complement('TYRATCAAGAACGAAAGT') == 'ACTTTCGTTCTTGATYRA'
+
+
+def test_primer_matcher():
+    matcher = PrimerMatcher([('a', 'ACGTS'), ('b', 'ACGTA'), ('c', 'TTTT')], max_offset=2)
+    assert matcher.match('ACGTCGGG') == {'a'}
+    assert matcher.match('ACGTAGGG') == {'b'}
+    # an N in a read matches any primer base
+    assert matcher.match('ACNTGGGG') == {'a'}
+    assert matcher.match('GGTTTTGG') == {'c'}
+    # too far from the start
+    assert matcher.match('GGGTTTTG') == set()
+    assert matcher.match('ACG') == set()
+    # bytes-like sequences are matched like str
+    assert matcher.match(memoryview(b'ACNTGGGG')) == {'a'}
+    assert matcher.match(b'GGTTTTGG') == {'c'}
+
+    with pytest.raises(PipelineException):
+        PrimerMatcher([('a', 'ACGTX')])
+
+
+def test_amplicon_classifier():
+    classifier = AmpliconClassifier(amplicons)
+    forward_read = 'CCAGCAGCTGCGGTAATTCCAGCTCC'
+    reverse_read = 'NCTTTCGTTCTTGATCAACGGGAACG'
+    assert classifier.classify(forward_read, reverse_read) == '18SV4'
+    # read pairs are accepted in either orientation
+    assert classifier.classify(reverse_read, forward_read) == '18SV4'
+    # both reads must match the same amplicon
+    assert classifier.classify(forward_read, forward_read) == 'unassigned'
+    assert classifier.classify(forward_read, 'CCGTCAATTCCTTTGAGTTTCAAA') == 'unassigned'
+    assert classifier.classify('GTGCCAGCAGCCGCGGTAATAC', 'CCGTCAATTCCTTTGAGTTTCAAA') == '16SV4V5'
+
+
+def test_read_primer_table():
+    with tempfile.TemporaryDirectory() as work_dir:
+        primer_table_fp = os.path.join(work_dir, 'primers.tsv')
+        with open(primer_table_fp, 'wt') as f:
+            f.write('amplicon\tforward_primer\treverse_primer\n18SV4\tccagcascygcggtaattcc\tTYRATCAAGAACGAAAGT\n\n')
+        assert read_primer_table(primer_table_fp) == [amplicons[0]]
+
+        with open(primer_table_fp, 'wt') as f:
+            f.write('amplicon\tforward_primer\treverse_primer\nunassigned\tACGT\tACGT\n')
+        with pytest.raises(PipelineException):
+            read_primer_table(primer_table_fp)
+
+
+def test_demultiplex_read_pairs():
+    test_data_dp = os.path.join(os.path.dirname(__file__), 'data')
+    with tempfile.TemporaryDirectory() as work_dir:
+        demultiplexed_files = demultiplex_read_pairs(
+            forward_fp=os.path.join(test_data_dp, 'Test01_L001_R1_001.fastq'),
+            reverse_fp=os.path.join(test_data_dp, 'Test01_L001_R2_001.fastq'),
+            amplicons=amplicons,
+            output_dp=work_dir)
+
+        assert list(demultiplexed_files) == ['18SV4', '16SV4V5', 'unassigned']
+        assert demultiplexed_files['18SV4'].forward_counts.record_count > 100
+        assert demultiplexed_files['16SV4V5'].forward_counts.record_count == 0
+        assert sum(files.forward_counts.record_count for files in demultiplexed_files.values()) == 200
+
+        amplicon_files = demultiplexed_files['18SV4']
+        assert amplicon_files.forward_fp == os.path.join(work_dir, '18SV4', 'Test01_L001_R1_001.fastq')
+        with open(amplicon_files.forward_fp, 'rt') as forward_file, open(amplicon_files.reverse_fp, 'rt') as reverse_file:
+            forward_lines = forward_file.readlines()
+            reverse_lines = reverse_file.readlines()
+        assert len(forward_lines) == len(reverse_lines) == 4 * amplicon_files.forward_counts.record_count
+        # read pairs stay together
+        assert [line.split()[0] for line in forward_lines[::4]] == [line.split()[0] for line in reverse_lines[::4]]
+        assert amplicon_files.forward_counts.base_count == sum(len(line.strip()) for line in forward_lines[1::4])
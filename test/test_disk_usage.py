@@ -0,0 +1,46 @@
+import os
+import tempfile
+
+from qc18SV4.disk_usage import DiskUsageTracker
+
+
+def write_bytes(fp, byte_count):
+    with open(fp, 'wb') as f:
+        f.write(b'A' * byte_count)
+    return fp
+
+
+def test_disk_usage_tracker():
+    with tempfile.TemporaryDirectory() as work_dir:
+        disk_usage = DiskUsageTracker()
+        a_fp = write_bytes(os.path.join(work_dir, 'a'), 100)
+        b_fp = write_bytes(os.path.join(work_dir, 'b'), 50)
+        disk_usage.add(a_fp, b_fp)
+        assert disk_usage.current_bytes == 150
+
+        # adding a file again records its new size
+        write_bytes(a_fp, 200)
+        disk_usage.add(a_fp)
+        assert disk_usage.current_bytes == 250
+
+        step_peak = disk_usage.start_step()
+        disk_usage.remove(a_fp, os.path.join(work_dir, 'untracked'))
+        assert disk_usage.current_bytes == 50
+        assert disk_usage.peak_bytes == 250
+        assert disk_usage.stop_step(step_peak) == 250
+
+        step_peak = disk_usage.start_step()
+        fastqc_dir = os.path.join(work_dir, 'fastqc_results')
+        os.mkdir(fastqc_dir)
+        write_bytes(os.path.join(fastqc_dir, 'x_fastqc.zip'), 10)
+        disk_usage.add_dir(fastqc_dir)
+        # a step starting while another is running has its own peak
+        concurrent_step_peak = disk_usage.start_step()
+        disk_usage.remove(os.path.join(fastqc_dir, 'x_fastqc.zip'))
+        assert disk_usage.current_bytes == 50
+        assert disk_usage.stop_step(concurrent_step_peak) == 60
+        write_bytes(b_fp, 100)
+        disk_usage.add(b_fp)
+        assert disk_usage.stop_step(step_peak) == 100
+        assert disk_usage.peak_bytes == 250
+        assert disk_usage.step_peaks == []
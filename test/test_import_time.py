@@ -0,0 +1,47 @@
+"""
+Command line programs are started once per sample, often inside a Singularity
+container, so the time to import them is paid thousands of times in a batch.
+These tests fail if a heavy dependency is imported when a program starts or if
+importing a program takes longer than the budget.
+"""
+import json
+import subprocess
+import sys
+
+import pytest
+
+
+# seconds to import one command line module in a fresh interpreter
+import_time_budget = 0.25
+
+cli_modules = (
+    'qc18SV4.pipeline',
+    'qc18SV4.write_launcher_job_file',
+    'qc18SV4.run_job_file',
+)
+
+
+def import_in_fresh_interpreter(module_name):
+    code = (
+        'import json, sys, time\n'
+        't0 = time.perf_counter()\n'
+        'import {}\n'
+        'elapsed = time.perf_counter() - t0\n'
+        'print(json.dumps({{"elapsed": elapsed, "modules": sorted(sys.modules)}}))\n'
+    ).format(module_name)
+    output = subprocess.run([sys.executable, '-c', code], stdout=subprocess.PIPE, check=True, universal_newlines=True)
+    return json.loads(output.stdout)
+
+
+@pytest.mark.parametrize('module_name', cli_modules)
+def test_no_heavy_imports(module_name):
+    imported_modules = import_in_fresh_interpreter(module_name)['modules']
+    heavy_modules = [m for m in imported_modules if m.split('.')[0] in ('Bio', 'numpy', 'cProfile', 'pstats')]
+    assert heavy_modules == []
+
+
+@pytest.mark.parametrize('module_name', cli_modules)
+def test_import_time(module_name):
+    # take the best of several runs to reduce noise from other processes
+    elapsed = min(import_in_fresh_interpreter(module_name)['elapsed'] for _ in range(3))
+    assert elapsed < import_time_budget, '{} took {:.3f}s to import'.format(module_name, elapsed)
@@ -0,0 +1,57 @@
+import os
+import tempfile
+
+import pytest
+
+from qc18SV4.exceptions import PipelineException
+from qc18SV4.input_profile import check_input_profile, get_overlap, infer_phred, profile_read_pair
+from qc18SV4.pipeline_util import gzip_file
+
+
+test_data_dp = os.path.join(os.path.dirname(__file__), 'data')
+
+
+def test_infer_phred():
+    assert infer_phred(ord('#'), ord('J')) == '33'
+    assert infer_phred(ord('B'), ord('h')) == '64'
+    # high quality phred 33 and low quality phred 64 look the same
+    assert infer_phred(ord('@'), ord('I')) is None
+    with pytest.raises(PipelineException):
+        infer_phred(ord('#'), ord('h'))
+
+
+def test_get_overlap():
+    amplicon = 'ACGTTGCAAGCTTAGCCGATCGATGGCTAGCATCGACTAGCTAGGCTTACG'
+    forward_read = amplicon[:40]
+    # the reverse read is the reverse complement of the end of the amplicon
+    reverse_read = amplicon[-40:].translate(str.maketrans('ACGT', 'TGCA'))[::-1]
+    assert get_overlap(forward_read, reverse_read) == 40 + 40 - len(amplicon)
+    assert get_overlap(forward_read, 'A' * 40) is None
+
+
+def test_profile_read_pair():
+    with tempfile.TemporaryDirectory() as work_dir:
+        # profile gzipped input
+        fps = []
+        for read in ('R1', 'R2'):
+            fp = os.path.join(work_dir, 'Test01_L001_{}_001.fastq'.format(read))
+            with open(os.path.join(test_data_dp, 'Test01_L001_{}_001.fastq'.format(read)), 'rt') as f, \
+                    open(fp, 'wt') as g:
+                g.write(f.read())
+            fps.append(gzip_file(fp)[0])
+
+        input_profile = profile_read_pair(
+            *fps, forward_primer='CCAGCASCYGCGGTAATTCC', reverse_primer='TYRATCAAGAACGAAAGT', record_count=100)
+        assert input_profile.pair_count == 100
+        assert input_profile.phred == '33'
+        assert input_profile.max_read_length == 301
+        assert input_profile.primer_rate > 0.5
+        assert 150 < input_profile.median_overlap < 250
+
+        assert check_input_profile(input_profile, phred='33', min_overlap=20) == []
+        assert len(check_input_profile(input_profile, phred='64', min_overlap=20)) == 1
+        assert len(check_input_profile(input_profile, phred='auto', min_overlap=280)) == 1
+
+        input_profile = profile_read_pair(*fps, forward_primer='ACGTACGTACGT', reverse_primer='ACGTACGTACGT')
+        assert input_profile.primer_rate == 0.0
+        assert len(check_input_profile(input_profile, phred='33', min_overlap=20)) == 1
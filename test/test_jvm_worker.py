@@ -0,0 +1,165 @@
+import fcntl
+import os
+import shutil
+import socket
+import subprocess
+import tempfile
+import threading
+
+import pytest
+
+from qc18SV4.jvm_worker import (
+    JvmWorkerPool, get_worker_args, get_worker_fps, jvm_worker_env_var, run_java_tool, tool_worker_java_source)
+from qc18SV4.pipeline import run_cmd
+from qc18SV4.step_metrics import TaskUsage, run_for_task
+
+
+class FakeWorker:
+    """Answer requests as ToolWorker does, writing each command to its log."""
+    def __init__(self, worker_dp, worker_index, reply='0'):
+        self.reply = reply
+        self.commands = []
+        self.server = socket.socket()
+        self.server.bind(('127.0.0.1', 0))
+        self.server.listen(5)
+        self.endpoint_fp, self.lock_fp, _ = get_worker_fps(worker_dp, worker_index)
+        with open(self.endpoint_fp, 'wt') as endpoint_file:
+            endpoint_file.write('{} token\n'.format(self.server.getsockname()[1]))
+        self.thread = threading.Thread(target=self.serve, daemon=True)
+        self.thread.start()
+
+    def serve(self):
+        while True:
+            try:
+                connection, _ = self.server.accept()
+            except OSError:
+                return
+            with connection, connection.makefile('rw', encoding='utf-8') as f:
+                if f.readline().strip() != 'token':
+                    continue
+                log_fp = f.readline().strip()
+                command = [f.readline().strip() for _ in range(int(f.readline()))]
+                self.commands.append(command)
+                with open(log_fp, 'at') as log_file:
+                    log_file.write('ran {}\n'.format(command[0]))
+                f.write(self.reply + '\n')
+
+    def close(self):
+        try:
+            # wakes the thread waiting in accept
+            self.server.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        self.server.close()
+        self.thread.join()
+
+
+def test_get_worker_args():
+    with tempfile.TemporaryDirectory() as work_dir:
+        cwd = os.getcwd()
+        os.chdir(work_dir)
+        try:
+            assert get_worker_args([
+                'TrimmomaticPE', '-threads', '2', 'a_R1.fastq', 'out/1P.fastq.gz',
+                'LEADING:10', 'MINLEN:100', 'ILLUMINACLIP:out/trimPE.fasta:2:30:10'
+            ]) == [
+                'TrimmomaticPE', '-threads', '2',
+                os.path.join(os.getcwd(), 'a_R1.fastq'), os.path.join(os.getcwd(), 'out', '1P.fastq.gz'),
+                'LEADING:10', 'MINLEN:100',
+                'ILLUMINACLIP:{}:2:30:10'.format(os.path.join(os.getcwd(), 'out', 'trimPE.fasta'))
+            ]
+            assert get_worker_args(['fastqc', '--threads', '2', '--outdir', 'qc', '/data/a.fastq', 'b.fastq']) == [
+                'fastqc', '--threads', '2', '--outdir', os.path.join(os.getcwd(), 'qc'),
+                '/data/a.fastq', os.path.join(os.getcwd(), 'b.fastq')
+            ]
+        finally:
+            os.chdir(cwd)
+
+
+def test_run_java_tool():
+    with tempfile.TemporaryDirectory() as work_dir:
+        log_fp = os.path.join(work_dir, 'log')
+        # not a Java tool or no workers
+        assert run_java_tool(['echo', 'hello'], log_fp, worker_dp=work_dir) is None
+        assert run_java_tool(['fastqc', 'a.fastq'], log_fp, worker_dp=work_dir) is None
+
+        workers = [FakeWorker(work_dir, 0), FakeWorker(work_dir, 1, reply='2')]
+        try:
+            output = run_java_tool(['fastqc', '--outdir', work_dir, 'a.fastq'], log_fp, worker_dp=work_dir)
+            assert isinstance(output, subprocess.CompletedProcess)
+            assert output.returncode == 0
+            assert workers[0].commands == [['fastqc', '--outdir', work_dir, os.path.abspath('a.fastq')]]
+            with open(log_fp, 'rt') as log_file:
+                assert log_file.read() == 'ran fastqc\n'
+
+            # worker 0 is busy so the command goes to worker 1
+            with open(workers[0].lock_fp, 'a') as lock_file:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+                assert run_java_tool(['TrimmomaticPE', 'a.fastq'], log_fp, worker_dp=work_dir).returncode == 2
+                assert len(workers[1].commands) == 1
+
+                # every worker is busy or not running
+                workers[1].close()
+                assert run_java_tool(['TrimmomaticPE', 'a.fastq'], log_fp, worker_dp=work_dir) is None
+
+            workers[0].reply = 'fallback'
+            assert run_java_tool(['TrimmomaticPE', 'a.fastq'], log_fp, worker_dp=work_dir) is None
+        finally:
+            for worker in workers:
+                worker.close()
+
+
+def test_run_java_tool__task_usage():
+    with tempfile.TemporaryDirectory() as work_dir:
+        log_fp = os.path.join(work_dir, 'log')
+        # 2.5 seconds of CPU time and a peak of 1000 kilobytes
+        worker = FakeWorker(work_dir, 0, reply='0 2500000000 1000')
+        try:
+            task_usage = TaskUsage()
+            output = run_for_task(task_usage, run_java_tool, ['fastqc', 'a.fastq'], log_fp, work_dir)
+            assert output.returncode == 0
+            # with the CPU time of the thread that sent the request
+            assert 2.5 <= task_usage.cpu_seconds < 3.0
+            assert task_usage.peak_memory_bytes == 1000 * 1024
+
+            # a worker that can not measure itself adds nothing
+            worker.reply = '1 -1 -1'
+            task_usage = TaskUsage()
+            assert run_for_task(task_usage, run_java_tool, ['fastqc', 'a.fastq'], log_fp, work_dir).returncode == 1
+            assert task_usage.cpu_seconds < 0.5
+            assert task_usage.peak_memory_bytes == 0
+        finally:
+            worker.close()
+
+
+def test_run_cmd_in_worker(monkeypatch):
+    with tempfile.TemporaryDirectory() as work_dir:
+        log_fp = os.path.join(work_dir, 'log')
+        worker = FakeWorker(work_dir, 0)
+        try:
+            monkeypatch.setenv(jvm_worker_env_var, work_dir)
+            assert run_cmd(['fastqc', 'a.fastq'], log_file=log_fp).returncode == 0
+            # other commands run as subprocesses
+            assert run_cmd(['echo', 'hello'], log_file=log_fp).returncode == 0
+            with open(log_fp, 'rt') as log_file:
+                assert log_file.read() == 'ran fastqc\nhello\n'
+        finally:
+            worker.close()
+
+
+def test_jvm_worker_pool_without_java():
+    with tempfile.TemporaryDirectory() as work_dir:
+        # Java tools run as subprocesses
+        pool = JvmWorkerPool(work_dir, worker_count=2, classpath=[], java=os.path.join(work_dir, 'java'))
+        assert pool.start() == 0
+        pool.stop()
+
+
+@pytest.mark.skipif(shutil.which('javac') is None, reason='javac is not installed')
+def test_compile_tool_worker():
+    with tempfile.TemporaryDirectory() as work_dir:
+        source_fp = os.path.join(work_dir, 'ToolWorker.java')
+        with open(source_fp, 'wt') as source_file:
+            source_file.write(tool_worker_java_source)
+        subprocess.run(['javac', '-d', work_dir, source_fp], check=True)
+        assert os.path.exists(os.path.join(work_dir, 'ToolWorker.class'))
@@ -0,0 +1,71 @@
+import gzip
+import os
+import tempfile
+
+import pytest
+
+from qc18SV4.manifest import ManifestException, RecordCounter, StepManifest, count_records
+
+
+def test_record_counter_fastq():
+    fastq = b'@r1\nACGT\n+\nIIII\n@r2\nACGT\n+\nIIII\n'
+    # feed the stream in every possible chunk size to cover records spanning chunks
+    for chunk_size in range(1, len(fastq) + 1):
+        counter = RecordCounter('fastq')
+        for i in range(0, len(fastq), chunk_size):
+            counter.update(fastq[i:i+chunk_size])
+        assert counter.record_count == 2
+        assert counter.base_count == 8
+
+
+def test_record_counter_fasta():
+    fasta = b'>r1\nACGT\nACGT\n>r2\nAC>GT\n>r3\nA'
+    for chunk_size in range(1, len(fasta) + 1):
+        counter = RecordCounter('fasta')
+        for i in range(0, len(fasta), chunk_size):
+            counter.update(fasta[i:i+chunk_size])
+        assert counter.record_count == 3
+        assert counter.base_count == 14
+
+
+def test_record_counter__no_final_newline():
+    counter = RecordCounter('fastq')
+    counter.update(b'@r1\nACGT\n+\nIIII\n@r2\nAC')
+    counter.update(b'GTA\n+\nIIIII')
+    assert counter.counts == (2, 9)
+
+
+def test_count_records():
+    with tempfile.TemporaryDirectory() as work_dir:
+        fastq_gz_fp = os.path.join(work_dir, 'unittest.fastq.gz')
+        with gzip.open(fastq_gz_fp, 'wt') as fastq_file:
+            fastq_file.write('@r1\nACGT\n+\nIIII\n' * 3)
+        assert count_records(fastq_gz_fp) == (3, 12)
+
+        log_fp = os.path.join(work_dir, 'log')
+        with open(log_fp, 'wt') as log_file:
+            log_file.write('not a sequence file\n')
+        assert count_records(log_fp) is None
+
+
+def test_step_manifest():
+    with tempfile.TemporaryDirectory() as work_dir:
+        fasta_fp = os.path.join(work_dir, 'unittest.fasta')
+        with open(fasta_fp, 'wt') as fasta_file:
+            fasta_file.write('>r1\nACGT\n>r2\nACGT\n')
+
+        manifest = StepManifest(step_name='unittest', output_dir=work_dir)
+        manifest.add(role='fasta', fp=fasta_fp)
+
+        output_file = manifest.file_for('fasta')
+        assert output_file.record_count == 2
+        assert output_file.base_count == 8
+        assert output_file.size == os.path.getsize(fasta_fp)
+        assert not output_file.compressed
+        assert len(manifest.files_for('fasta', compressed=True)) == 0
+
+        with pytest.raises(ManifestException):
+            manifest.file_for('fastq')
+
+        manifest.remove(fasta_fp)
+        assert len(manifest) == 0
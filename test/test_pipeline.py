@@ -2,13 +2,17 @@ import glob
 import gzip
 import logging
 import os
+import sys
 import tempfile
+import threading
 
 import pytest
 
 import qc18SV4.pipeline as pipeline_18SV4
+from qc18SV4.manifest import StepManifest
 from qc18SV4.pipeline import PipelineException
 from qc18SV4.pipeline_util import get_sorted_file_list, gzip_files
+from qc18SV4.step_graph import StepGraph
 
 
 logging.basicConfig(level=logging.DEBUG)
@@ -31,6 +35,12 @@ def test_get_reads_filename_prefix__exception():
             get_pipeline(work_dir=work_dir, forward_reads_fp='this_will_not_match_prefix_re.fastq')
 
 
+def test_profile():
+    with tempfile.TemporaryDirectory() as work_dir:
+        assert get_pipeline(work_dir=work_dir).profiler is None
+        assert get_pipeline(work_dir=work_dir, profile=True).profiler is not None
+
+
 def get_pipeline(
         work_dir,
         forward_reads_fp='unittest_L001_R1.fastq',
@@ -48,6 +58,13 @@ def get_pipeline(
         **kwargs)
 
 
+def get_input_manifest(input_dir, *role_fp_list):
+    input_manifest = StepManifest(step_name='unittest', output_dir=input_dir)
+    for role, fp in role_fp_list:
+        input_manifest.add(role=role, fp=fp)
+    return input_manifest
+
+
 def write_test_input(input_dir, file_name, content):
     fp = os.path.join(input_dir, file_name)
     with open(fp, 'wt') as input_file:
@@ -73,6 +90,146 @@ def check_for_fastq_results(output_dir):
     assert len(fastqc_output_file_list) == len(fastq_file_list)
 
 
+def test_step_00_demultiplex_amplicons():
+    with tempfile.TemporaryDirectory() as input_dir, tempfile.TemporaryDirectory() as work_dir:
+        primer_table_fp = write_test_input(
+            input_dir=input_dir,
+            file_name='primers.tsv',
+            content='amplicon\tforward_primer\treverse_primer\nA\tAAAAAAAAAA\tGGGGGGGGGG\nT\tTTTTTTTTTT\tGGGGGGGGGG\n')
+        forward_reads_fp = write_test_input(
+            input_dir=input_dir,
+            file_name='unittest_L001_R1.fastq',
+            content='@read_1\n{}\n+\n{}\n@read_2\n{}\n+\n{}\n'.format('A'*20, 'a'*20, 'C'*20, 'a'*20))
+        write_test_input(
+            input_dir=input_dir,
+            file_name='unittest_L001_R2.fastq',
+            content='@read_1\n{}\n+\n{}\n@read_2\n{}\n+\n{}\n'.format('C'*20, 'a'*20, 'C'*20, 'a'*20))
+
+        pipeline = get_pipeline(work_dir=work_dir, forward_reads_fp=forward_reads_fp, primer_table=primer_table_fp)
+        manifest = pipeline.step_00_demultiplex_amplicons()
+
+        assert [(f.role, os.path.relpath(f.fp, manifest.output_dir), f.record_count) for f in manifest] == [
+            ('amplicon_forward', 'A/unittest_L001_R1.fastq', 1),
+            ('amplicon_reverse', 'A/unittest_L001_R2.fastq', 1),
+            ('amplicon_forward', 'T/unittest_L001_R1.fastq', 0),
+            ('amplicon_reverse', 'T/unittest_L001_R2.fastq', 0),
+            ('unassigned_forward', 'unassigned/unittest_L001_R1.fastq', 1),
+            ('unassigned_reverse', 'unassigned/unittest_L001_R2.fastq', 1),
+        ]
+        # input read pairs are counted while they are demultiplexed
+        assert manifest.input_counts == (2, 80)
+
+        # sequence ids of each amplicon include the amplicon name
+        fasta_fp, *_ = gzip_files(
+            write_test_input(input_dir=input_dir, file_name='unittest.length.fasta', content='>1\nACGT\n'))
+        first_lines = []
+        for amplicon in pipeline.amplicons:
+            amplicon_pipeline = pipeline.create_amplicon_pipeline(
+                amplicon, manifest.files_for('amplicon_forward')[0].fp)
+            assert amplicon_pipeline.prefix == 'unittest_' + amplicon.name
+            amplicon_manifest = amplicon_pipeline.step_06_rewrite_sequence_ids(
+                input_manifest=get_input_manifest(input_dir, ('length_filtered', fasta_fp)))
+            with gzip.open(amplicon_manifest.file_for('id_rewritten').fp, 'rt') as output_file:
+                first_lines.append(output_file.readline())
+        assert first_lines == ['>unittest_A_1\n', '>unittest_T_1\n']
+
+
+def test_step_00_subsample_read_pairs(monkeypatch):
+    with tempfile.TemporaryDirectory() as input_dir, tempfile.TemporaryDirectory() as work_dir:
+        forward_reads_fp = write_test_input(
+            input_dir=input_dir,
+            file_name='unittest_L001_R1.fastq',
+            content=''.join('@read_{}\n{}\n+\n{}\n'.format(i, 'A'*20, 'a'*20) for i in range(10)))
+        write_test_input(
+            input_dir=input_dir,
+            file_name='unittest_L001_R2.fastq',
+            content=''.join('@read_{}\n{}\n+\n{}\n'.format(i, 'C'*20, 'a'*20) for i in range(10)))
+
+        pipeline = get_pipeline(work_dir=work_dir, forward_reads_fp=forward_reads_fp, max_read_pairs=4)
+        manifest = pipeline.step_00_subsample_read_pairs()
+
+        assert [(f.role, os.path.relpath(f.fp, manifest.output_dir), f.record_count) for f in manifest] == [
+            ('subsampled_forward', 'unittest_L001_R1.fastq.gz', 4),
+            ('subsampled_reverse', 'unittest_L001_R2.fastq.gz', 4),
+        ]
+        # input read pairs are counted while they are subsampled
+        assert manifest.input_counts == (10, 400)
+        # the next step reads the subsampled reads from the manifest
+        assert pipeline.get_input_read_pair_fps(manifest) == (
+            manifest.file_for('subsampled_forward').fp, manifest.file_for('subsampled_reverse').fp)
+        assert pipeline.get_released_roles('step_01_trim_primers') == (
+            'subsampled_forward', 'subsampled_reverse', 'forward_unpaired', 'reverse_unpaired')
+
+        # neither the input files nor the subsampled files are read again to count reads
+        def fail_to_count(*args, **kwargs):
+            raise AssertionError('input files were counted')
+
+        monkeypatch.setattr(pipeline_18SV4, 'get_input_read_counts', fail_to_count)
+        manifest = pipeline.run_step(pipeline.step_00_subsample_read_pairs)
+        pipeline.run_step(pipeline.step_01_trim_primers, input_manifest=manifest)
+        assert [(c.step, c.input_counts) for c in pipeline.step_read_counts] == [
+            ('step_00_subsample_read_pairs', (10, 400)),
+            ('step_01_trim_primers', (4, 160)),
+        ]
+
+
+def test_step_00_subsample_read_pairs__zstd(monkeypatch):
+    pytest.importorskip('zstandard')
+    with tempfile.TemporaryDirectory() as input_dir, tempfile.TemporaryDirectory() as work_dir:
+        forward_reads_fp = write_test_input(
+            input_dir=input_dir,
+            file_name='unittest_L001_R1.fastq',
+            content=''.join('@read_{}\n{}\n+\n{}\n'.format(i, 'A'*20, 'a'*20) for i in range(10)))
+        write_test_input(
+            input_dir=input_dir,
+            file_name='unittest_L001_R2.fastq',
+            content=''.join('@read_{}\n{}\n+\n{}\n'.format(i, 'C'*20, 'a'*20) for i in range(10)))
+
+        pipeline = get_pipeline(
+            work_dir=work_dir, forward_reads_fp=forward_reads_fp, max_read_pairs=4, intermediate_compression='zstd')
+        manifest = pipeline.step_00_subsample_read_pairs()
+        assert [os.path.basename(f.fp) for f in manifest] == ['unittest_L001_R1.fastq.zst', 'unittest_L001_R2.fastq.zst']
+
+        # Trimmomatic is given uncompressed copies of the zstd files, which are deleted after it runs
+        cmd_line_lists = []
+
+        def run_cmd_spy(cmd_line_list, **kwargs):
+            cmd_line_lists.append(cmd_line_list)
+            return run_cmd(cmd_line_list, **kwargs)
+
+        run_cmd = pipeline_18SV4.run_cmd
+        monkeypatch.setattr(pipeline_18SV4, 'run_cmd', run_cmd_spy)
+        trim_manifest = pipeline.step_01_trim_primers(input_manifest=manifest)
+        trimmomatic_input_fps = cmd_line_lists[0][3:5]
+        assert [os.path.basename(fp) for fp in trimmomatic_input_fps] == [
+            'unittest_L001_R1.fastq', 'unittest_L001_R2.fastq']
+        assert not any(os.path.exists(fp) for fp in trimmomatic_input_fps)
+        assert os.path.basename(trim_manifest.file_for('forward_paired').fp) == 'unittest_L001_R1.trim1p.fastq.gz'
+
+
+def test_check_input_files():
+    test_data_dp = os.path.join(os.path.dirname(__file__), 'data')
+    with tempfile.TemporaryDirectory() as work_dir:
+        pipeline = get_pipeline(
+            work_dir=work_dir,
+            forward_reads_fp=os.path.join(test_data_dp, 'Test01_L001_R1_001.fastq'),
+            forward_primer='CCAGCASCYGCGGTAATTCC',
+            reverse_primer='TYRATCAAGAACGAAAGT',
+            phred='auto')
+        pipeline.check_input_files()
+        assert pipeline.phred == '33'
+
+        pipeline = get_pipeline(
+            work_dir=work_dir,
+            forward_reads_fp=os.path.join(test_data_dp, 'Test01_L001_R1_001.fastq'),
+            forward_primer='CCAGCASCYGCGGTAATTCC',
+            reverse_primer='TYRATCAAGAACGAAAGT',
+            phred='64',
+            check_input=True)
+        with pytest.raises(PipelineException):
+            pipeline.check_input_files()
+
+
 def test_step_01_trim_primers():
     with tempfile.TemporaryDirectory() as input_dir, tempfile.TemporaryDirectory() as work_dir:
 
@@ -86,13 +243,14 @@ def test_step_01_trim_primers():
         write_test_input(
             input_dir=input_dir, file_name='unittest_L001_R2.fastq', content='@read_1 reverse\n{}\n+\n{}\n'.format(reverse_read, reverse_qual))
 
-        output_dir = get_pipeline(
+        manifest = get_pipeline(
             work_dir=work_dir,
             forward_reads_fp=forward_reads_fp,
             forward_primer='A'*30,
             reverse_primer='T'*30,
             trimmomatic_minlen=4
         ).step_01_trim_primers()
+        output_dir = manifest.output_dir
 
         assert os.path.exists(output_dir)
         assert os.path.isdir(output_dir)
@@ -135,11 +293,16 @@ def test_step_02_join_paired_end_reads():
             file_name='unittest.trim2p.fastq',
             content='@read_1 reverse\n{}\n+\n{}\n'.format('T'*100, 'a'*100))
 
-        gzip_files(input_file_1, input_file_2)
+        gzipped_input_file_1, gzipped_input_file_2 = gzip_files(input_file_1, input_file_2)
 
-        output_dir = get_pipeline(
+        manifest = get_pipeline(
             work_dir=work_dir
-        ).step_02_join_paired_end_reads(input_dir=input_dir)
+        ).step_02_join_paired_end_reads(
+            input_manifest=get_input_manifest(
+                input_dir,
+                ('forward_paired', gzipped_input_file_1),
+                ('reverse_paired', gzipped_input_file_2)))
+        output_dir = manifest.output_dir
 
         assert os.path.exists(output_dir)
         assert os.path.isdir(output_dir)
@@ -154,13 +317,100 @@ def test_step_02_join_paired_end_reads():
         check_for_fastq_results(output_dir)
 
 
+@pytest.mark.parametrize('keep_roles, unjoined_extension', [((), '.fastq'), (('unjoined_forward', 'unjoined_reverse'), '.fastq.gz')])
+def test_step_02_join_paired_end_reads__minimize_disk(keep_roles, unjoined_extension):
+    """Unjoined reads deleted when step 02 is done are not compressed unless they are kept."""
+    with tempfile.TemporaryDirectory() as input_dir, tempfile.TemporaryDirectory() as work_dir:
+        input_file_1 = write_test_input(
+            input_dir=input_dir,
+            file_name='unittest.trim1p.fastq',
+            content='@read_1 forward\n{}\n+\n{}\n'.format('A'*100, 'a'*100))
+        input_file_2 = write_test_input(
+            input_dir=input_dir,
+            file_name='unittest.trim2p.fastq',
+            content='@read_1 reverse\n{}\n+\n{}\n'.format('T'*100, 'a'*100))
+        gzipped_input_file_1, gzipped_input_file_2 = gzip_files(input_file_1, input_file_2)
+
+        pipeline = get_pipeline(work_dir=work_dir, minimize_disk=True, keep_roles=keep_roles)
+        released_roles = pipeline.get_released_roles('step_02_join_paired_end_reads')
+        assert ('unjoined_forward' in released_roles) == (len(keep_roles) == 0)
+
+        manifest = pipeline.step_02_join_paired_end_reads(
+            input_manifest=get_input_manifest(
+                input_dir,
+                ('forward_paired', gzipped_input_file_1),
+                ('reverse_paired', gzipped_input_file_2)))
+        assert [os.path.basename(f.fp) for f in manifest.fasta_fastq_files()] == [
+            'unittest.trim.join.fastq.gz',
+            'unittest.trim.un1' + unjoined_extension,
+            'unittest.trim.un2' + unjoined_extension,
+        ]
+        # FastQC reads the uncompressed unjoined reads before they are deleted
+        assert len(glob.glob(os.path.join(manifest.output_dir, 'fastqc_results', '*.zip'))) == 3
+
+        pipeline.release_intermediate_files([manifest])
+        assert [f.role for f in manifest] == ['joined'] + list(keep_roles)
+
+
+def test_run_fastqc_task__concurrent_step(monkeypatch):
+    """FastQC running alongside a step is measured on its own and not counted in the step's CPU time."""
+    with tempfile.TemporaryDirectory() as input_dir, tempfile.TemporaryDirectory() as work_dir:
+        # a fastqc that uses a second of CPU time
+        fastqc_dir = os.path.join(input_dir, 'bin')
+        os.mkdir(fastqc_dir)
+        write_test_input(
+            input_dir=fastqc_dir,
+            file_name='fastqc',
+            content='#!{}\nimport time\nend = time.process_time() + 1.0\nwhile time.process_time() < end:\n    pass\n'.format(
+                sys.executable))
+        os.chmod(os.path.join(fastqc_dir, 'fastqc'), 0o755)
+        monkeypatch.setenv('PATH', fastqc_dir + os.pathsep + os.environ['PATH'])
+
+        input_file_1 = write_test_input(
+            input_dir=input_dir,
+            file_name='unittest.trim1p.fastq',
+            content='@read_1 forward\n{}\n+\n{}\n'.format('A'*100, 'a'*100))
+        input_file_2 = write_test_input(
+            input_dir=input_dir,
+            file_name='unittest.trim2p.fastq',
+            content='@read_1 reverse\n{}\n+\n{}\n'.format('T'*100, 'a'*100))
+        input_manifest = StepManifest(step_name='step_01_trim_primers', output_dir=input_dir)
+        input_manifest.add(role='forward_paired', fp=input_file_1)
+        input_manifest.add(role='reverse_paired', fp=input_file_2)
+
+        pipeline = get_pipeline(work_dir=work_dir, core_count=2)
+        fastqc_finished = threading.Event()
+
+        def run_fastqc_task(results):
+            pipeline.run_fastqc_task(input_manifest)
+            fastqc_finished.set()
+
+        # a step that waits without using the CPU until FastQC has finished
+        def step_02_join_paired_end_reads(input_manifest):
+            assert fastqc_finished.wait(timeout=60)
+            return input_manifest
+
+        graph = StepGraph()
+        graph.add('step_01_trim_primers_fastqc', run_fastqc_task)
+        graph.add(
+            'step_02_join_paired_end_reads',
+            lambda results: pipeline.run_step(step_02_join_paired_end_reads, input_manifest=input_manifest))
+        graph.run(core_count=2)
+
+        step_metrics = {m.step: m for m in pipeline.step_metrics}
+        assert step_metrics['step_01_trim_primers_fastqc'].cpu_seconds >= 0.9
+        assert step_metrics['step_01_trim_primers_fastqc'].input_bytes == os.path.getsize(input_file_1) + os.path.getsize(input_file_2)
+        assert step_metrics['step_02_join_paired_end_reads'].cpu_seconds < 0.5
+
+
 def test_step_03_quality_filter():
     with tempfile.TemporaryDirectory() as input_dir, tempfile.TemporaryDirectory() as work_dir:
-        write_test_input(input_dir=input_dir, file_name='unittest.trim.join.fastq', content='@read_1 joined\n{}\n+\n{}\n'.format('A'*100, 'a'*100))
+        input_file = write_test_input(input_dir=input_dir, file_name='unittest.trim.join.fastq', content='@read_1 joined\n{}\n+\n{}\n'.format('A'*100, 'a'*100))
 
-        output_dir = get_pipeline(
+        manifest = get_pipeline(
             work_dir=work_dir, phred='64'
-        ).step_03_quality_filter(input_dir=input_dir)
+        ).step_03_quality_filter(input_manifest=get_input_manifest(input_dir, ('joined', input_file)))
+        output_dir = manifest.output_dir
 
         assert os.path.exists(output_dir)
         assert os.path.isdir(output_dir)
@@ -176,11 +426,12 @@ def test_step_03_quality_filter():
 
 def test_step_04_fasta_format():
     with tempfile.TemporaryDirectory() as input_dir, tempfile.TemporaryDirectory() as work_dir:
-        write_test_input(input_dir=input_dir, file_name='unittest.trim.join.quality.fastq', content='@read_1\n{}\n+\n{}\n'.format('A'*100, 'a'*100))
+        input_file = write_test_input(input_dir=input_dir, file_name='unittest.trim.join.quality.fastq', content='@read_1\n{}\n+\n{}\n'.format('A'*100, 'a'*100))
 
-        output_dir = get_pipeline(
+        manifest = get_pipeline(
             work_dir=work_dir
-        ).step_04_fasta_format(input_dir=input_dir)
+        ).step_04_fasta_format(input_manifest=get_input_manifest(input_dir, ('quality_filtered', input_file)))
+        output_dir = manifest.output_dir
 
         assert os.path.exists(output_dir)
         assert os.path.isdir(output_dir)
@@ -194,11 +445,12 @@ def test_step_04_fasta_format():
 
 def test_step_05_length_filter():
     with tempfile.TemporaryDirectory() as input_dir, tempfile.TemporaryDirectory() as work_dir:
-        write_test_input(input_dir=input_dir, file_name='unittest.trim.join.quality.fasta', content='>read_1\n{}\n'.format('A'*100))
+        input_file = write_test_input(input_dir=input_dir, file_name='unittest.trim.join.quality.fasta', content='>read_1\n{}\n'.format('A'*100))
 
-        output_dir = get_pipeline(
+        manifest = get_pipeline(
             work_dir=work_dir
-        ).step_05_length_filter(input_dir=input_dir)
+        ).step_05_length_filter(input_manifest=get_input_manifest(input_dir, ('fasta', input_file)))
+        output_dir = manifest.output_dir
 
         assert os.path.exists(output_dir)
         assert os.path.isdir(output_dir)
@@ -213,11 +465,12 @@ def test_step_06_rewrite_sequence_ids():
     with tempfile.TemporaryDirectory() as input_dir, tempfile.TemporaryDirectory() as work_dir:
         input_file_1 = write_test_input(input_dir=input_dir, file_name='unittest.quality.fasta', content='>1\n{}\n'.format('A'*100))
 
-        gzip_files(input_file_1)
+        gzipped_input_file_1, *_ = gzip_files(input_file_1)
 
-        output_dir = get_pipeline(
+        manifest = get_pipeline(
             work_dir=work_dir
-        ).step_06_rewrite_sequence_ids(input_dir=input_dir)
+        ).step_06_rewrite_sequence_ids(input_manifest=get_input_manifest(input_dir, ('length_filtered', gzipped_input_file_1)))
+        output_dir = manifest.output_dir
 
         assert os.path.exists(output_dir)
         assert os.path.isdir(output_dir)
@@ -228,3 +481,66 @@ def test_step_06_rewrite_sequence_ids():
 
         with gzip.open(os.path.join(output_dir, output_file_list[0].name), 'rt') as output_file:
             assert output_file.readlines()[0] == '>unittest_1\n'
+
+        output_file = manifest.file_for('id_rewritten')
+        assert output_file.fp == os.path.join(output_dir, 'unittest.quality.id.fasta.gz')
+        assert output_file.record_count == 1
+        assert output_file.size == os.path.getsize(output_file.fp)
+
+
+def test_release_intermediate_files():
+    with tempfile.TemporaryDirectory() as input_dir, tempfile.TemporaryDirectory() as work_dir:
+        pipeline = get_pipeline(work_dir=work_dir, minimize_disk=True)
+
+        step_01_manifest = StepManifest(step_name='step_01_trim_primers', output_dir=input_dir)
+        for role in ('forward_paired', 'forward_unpaired'):
+            step_01_manifest.add(
+                role=role,
+                fp=write_test_input(input_dir=input_dir, file_name=role + '.fastq', content='@r\nA\n+\nI\n'))
+        step_02_manifest = StepManifest(step_name='step_02_join_paired_end_reads', output_dir=input_dir)
+        step_02_manifest.add(
+            role='joined',
+            fp=write_test_input(input_dir=input_dir, file_name='joined.fastq', content='@r\nA\n+\nI\n'))
+
+        # unpaired reads are read by no step so they are deleted when step 01 is done
+        pipeline.release_intermediate_files([step_01_manifest])
+        assert [f.role for f in step_01_manifest] == ['forward_paired']
+        assert not os.path.exists(os.path.join(input_dir, 'forward_unpaired.fastq'))
+
+        # paired reads are deleted when step 02 is done but joined reads are kept for step 03
+        pipeline.release_intermediate_files([step_01_manifest, step_02_manifest])
+        assert len(step_01_manifest) == 0
+        assert not os.path.exists(os.path.join(input_dir, 'forward_paired.fastq'))
+        assert [f.role for f in step_02_manifest] == ['joined']
+        assert os.path.exists(os.path.join(input_dir, 'joined.fastq'))
+
+
+def test_get_step_graph():
+    with tempfile.TemporaryDirectory() as work_dir:
+        pipeline = get_pipeline(work_dir=work_dir, core_count=4)
+        pipeline.defer_fastqc = True
+        dependencies = pipeline.get_step_graph().get_dependencies()
+        assert dependencies['step_02_join_paired_end_reads'] == ['step_01_trim_primers']
+        # FastQC runs while the next step runs
+        assert dependencies['step_01_trim_primers_fastqc'] == ['step_01_trim_primers']
+        # step 04 deletes the quality filtered reads after FastQC has read them
+        assert dependencies['step_04_fasta_format'] == ['step_03_quality_filter', 'step_03_quality_filter_fastqc']
+        assert 'step_07_write_read_table' not in dependencies
+        # the input files are counted while Trimmomatic reads them
+        assert dependencies['count_input_reads'] == []
+        assert 'count_input_reads' not in get_pipeline(work_dir=work_dir, input_counts=(1, 2)).get_step_graph().tasks
+
+        pipeline = get_pipeline(work_dir=work_dir, minimize_disk=True, write_read_table=True)
+        pipeline.defer_fastqc = True
+        dependencies = pipeline.get_step_graph().get_dependencies()
+        # paired reads are deleted when the read table and FastQC no longer need them
+        assert dependencies['step_07_write_read_table_release'] == [
+            'step_01_trim_primers',
+            'step_01_trim_primers_fastqc',
+            'step_02_join_paired_end_reads',
+            'step_03_quality_filter',
+            'step_03_quality_filter_fastqc',
+            'step_04_fasta_format',
+            'step_07_write_read_table',
+        ]
+        assert dependencies['step_01_trim_primers_release'] == ['step_01_trim_primers', 'step_01_trim_primers_fastqc']
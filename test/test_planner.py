@@ -0,0 +1,139 @@
+import os
+import tempfile
+
+import pytest
+
+from qc18SV4.exceptions import PipelineException
+from qc18SV4.planner import (
+    fit_linear_model, fit_step_models, format_wall_time, get_makespan, plan_allocation, predict_sample,
+    predict_samples)
+from qc18SV4.step_metrics import StepMetrics
+
+
+def get_step_metrics(step, input_bytes, elapsed_seconds, peak_memory_bytes):
+    step_metrics = StepMetrics(step=step, input_bytes=input_bytes, threads=1)
+    step_metrics.elapsed_seconds = elapsed_seconds
+    step_metrics.cpu_seconds = elapsed_seconds
+    step_metrics.output_bytes = input_bytes
+    step_metrics.peak_memory_bytes = peak_memory_bytes
+    return step_metrics
+
+
+def test_fit_linear_model():
+    model = fit_linear_model([(1, 3), (2, 5), (3, 7)])
+    assert model.intercept == pytest.approx(1.0)
+    assert model.slope == pytest.approx(2.0)
+    assert model.predict(10) == pytest.approx(21.0)
+
+    # one input size fits a line through the origin
+    assert fit_linear_model([(2, 4), (2, 8)]).predict(4) == pytest.approx(12.0)
+
+
+def test_fit_step_models_and_predict_sample():
+    step_metrics_lists = [
+        [
+            get_step_metrics('step_01_trim_primers', input_bytes, 10.0 + input_bytes / 100, 1000 + input_bytes),
+            # later steps are fitted against the input of the first step
+            get_step_metrics('step_02_join_paired_end_reads', input_bytes // 2, input_bytes / 50, 500),
+        ]
+        for input_bytes
+        in (1000, 2000, 4000)
+    ]
+    step_models = fit_step_models(step_metrics_lists)
+    assert list(step_models) == ['step_01_trim_primers', 'step_02_join_paired_end_reads']
+
+    prediction = predict_sample('sample', 3000, step_models)
+    assert prediction.step_seconds['step_01_trim_primers'] == pytest.approx(40.0)
+    assert prediction.seconds == pytest.approx(100.0)
+    assert prediction.peak_memory_bytes == pytest.approx(4000)
+
+
+def test_predict_sample__fastqc_tasks():
+    step_models = fit_step_models(
+        [
+            [
+                get_step_metrics('step_01_trim_primers', input_bytes, 10.0, 1000),
+                # FastQC runs while the next step runs
+                get_step_metrics('step_01_trim_primers_fastqc', input_bytes, 5.0, 300),
+                get_step_metrics('step_02_join_paired_end_reads', input_bytes, 8.0, 200),
+            ]
+            for input_bytes
+            in (1000, 2000)
+        ])
+    prediction = predict_sample('sample', 1500, step_models)
+    assert prediction.seconds == pytest.approx(18.0)
+    assert prediction.peak_memory_bytes == pytest.approx(1300)
+
+
+def test_fit_step_models__sample_input_bytes():
+    step_metrics_lists = []
+    for sample_input_bytes in (1000, 2000, 4000):
+        # step 01 reads at most 500 bytes of subsampled reads
+        step_metrics_list = [
+            get_step_metrics('step_00_subsample_read_pairs', sample_input_bytes, sample_input_bytes / 100, 100),
+            get_step_metrics('step_01_trim_primers', 500, 10.0, 1000),
+        ]
+        for step_metrics in step_metrics_list:
+            step_metrics.sample_input_bytes = sample_input_bytes
+        step_metrics_lists.append(step_metrics_list)
+    # older step metrics of a subsampled run do not have the sample input bytes and are skipped
+    step_metrics_lists.append([
+        get_step_metrics('step_00_subsample_read_pairs', 8000, 1000.0, 100),
+        get_step_metrics('step_01_trim_primers', 500, 10.0, 1000),
+    ])
+
+    step_models = fit_step_models(step_metrics_lists)
+    prediction = predict_sample('sample', 3000, step_models)
+    assert prediction.step_seconds['step_00_subsample_read_pairs'] == pytest.approx(30.0)
+    assert prediction.step_seconds['step_01_trim_primers'] == pytest.approx(10.0)
+
+
+def test_predict_samples():
+    step_models = fit_step_models(
+        [[get_step_metrics('step_01_trim_primers', 100, 1.0, 10)], [get_step_metrics('step_01_trim_primers', 200, 2.0, 20)]])
+    with tempfile.TemporaryDirectory() as input_dir:
+        for name, size in (('a_R1_001.fastq', 100), ('a_R2_001.fastq', 100), ('b_R1_001.fastq', 50), ('b_R2_001.fastq', 50)):
+            with open(os.path.join(input_dir, name), 'wt') as f:
+                f.write('A' * size)
+        predictions = predict_samples(input_dir, step_models)
+        assert [(p.sample, p.input_bytes) for p in predictions] == [('a_R1_001.fastq', 200), ('b_R1_001.fastq', 100)]
+        assert [p.seconds for p in predictions] == [pytest.approx(2.0), pytest.approx(1.0)]
+
+
+def test_get_makespan():
+    assert get_makespan([4, 3, 3, 2], slot_count=2) == 6
+    assert get_makespan([4, 3, 3, 2], slot_count=4) == 4
+    assert get_makespan([4, 3, 3, 2], slot_count=1) == 12
+
+
+def test_plan_allocation():
+    step_models = fit_step_models([[get_step_metrics('step_01_trim_primers', 100, 3600.0, 2**30)]])
+    predictions = [predict_sample('s{}'.format(i), 100, step_models) for i in range(8)]
+
+    # 4 cores per node and 2 cores per sample gives 2 samples per node
+    plan = plan_allocation(
+        predictions, target_seconds=2 * 3600, cores_per_node=4, memory_per_node_bytes=64 * 2**30,
+        cores_per_sample=2, safety_factor=1.0)
+    assert plan == (2, 2, 2 * 3600.0, True)
+
+    # memory limits samples per node
+    plan = plan_allocation(
+        predictions, target_seconds=2 * 3600, cores_per_node=4, memory_per_node_bytes=2**30, safety_factor=1.0)
+    assert plan == (4, 1, 2 * 3600.0, True)
+
+    # a target shorter than one sample can not be met
+    plan = plan_allocation(
+        predictions, target_seconds=1800, cores_per_node=4, memory_per_node_bytes=64 * 2**30, safety_factor=1.0)
+    assert plan == (2, 4, 3600.0, False)
+
+    with pytest.raises(PipelineException):
+        plan_allocation(predictions, target_seconds=3600, cores_per_node=4, memory_per_node_bytes=2**29)
+    with pytest.raises(PipelineException):
+        plan_allocation(
+            predictions, target_seconds=3600, cores_per_node=4, memory_per_node_bytes=64 * 2**30, max_nodes=0)
+
+
+def test_format_wall_time():
+    assert format_wall_time(1) == '00:01:00'
+    assert format_wall_time(3601) == '01:01:00'
+    assert format_wall_time(26 * 3600) == '26:00:00'
@@ -0,0 +1,32 @@
+import os
+import pstats
+import tempfile
+
+from qc18SV4.profiling import StepProfiler
+
+
+def busy_step(n):
+    total = 0
+    for i in range(n):
+        total += sum(range(100))
+    return total
+
+
+def test_step_profiler():
+    with tempfile.TemporaryDirectory() as work_dir:
+        profiler = StepProfiler(output_dp=work_dir, sampling_interval=0.001)
+        assert profiler.run('step_00_busy', busy_step, 20000) == 20000 * 4950
+
+        pstats_fp = os.path.join(work_dir, 'step_00_busy.pstats')
+        assert os.path.exists(pstats_fp)
+        function_names = {function_name for _, _, function_name in pstats.Stats(pstats_fp).stats}
+        assert 'busy_step' in function_names
+
+        with open(os.path.join(work_dir, 'step_00_busy.collapsed'), 'rt') as collapsed_file:
+            collapsed_lines = collapsed_file.readlines()
+        assert len(collapsed_lines) > 0
+        stack, sample_count = collapsed_lines[0].rsplit(' ', 1)
+        assert 'busy_step:test_profiling.py' in stack
+        assert int(sample_count) > 0
+
+        assert 'busy_step' in profiler.get_hotspots()
@@ -0,0 +1,88 @@
+import os
+import tempfile
+
+from qc18SV4.manifest import RecordCounts, StepManifest
+from qc18SV4.pipeline_util import gzip_file
+from qc18SV4.read_counts import (
+    StepReadCounts, aggregate_read_counts, get_input_read_counts, get_surviving_read_counts, write_read_counts)
+
+
+def write_file(fp, content):
+    with open(fp, 'wt') as f:
+        f.write(content)
+    return fp
+
+
+def test_get_input_read_counts():
+    with tempfile.TemporaryDirectory() as work_dir:
+        forward_fp = write_file(os.path.join(work_dir, 'unittest_R1.fastq'), '@r1\nACGT\n+\nIIII\n' * 3)
+        reverse_fp = write_file(os.path.join(work_dir, 'unittest_R2.fastq'), '@r1\nACG\n+\nIII\n' * 3)
+        # a read pair counts as one read
+        assert get_input_read_counts(forward_fp, reverse_fp, thread_count=2) == (3, 21)
+
+
+def test_get_surviving_read_counts():
+    with tempfile.TemporaryDirectory() as work_dir:
+        manifest = StepManifest(step_name='step_03_quality_filter', output_dir=work_dir)
+        fastq_fp = write_file(os.path.join(work_dir, 'unittest.fastq'), '@r1\nACGT\n+\nIIII\n' * 2)
+        gzipped_fastq_fp, counts = gzip_file(fastq_fp)
+        manifest.add(role='quality_filtered', fp=fastq_fp, counts=counts)
+        manifest.add(role='quality_filtered', fp=gzipped_fastq_fp, counts=counts)
+        # the compressed and uncompressed copies are counted once
+        assert get_surviving_read_counts(manifest) == (2, 8)
+
+
+def test_write_and_aggregate_read_counts():
+    with tempfile.TemporaryDirectory() as work_dir:
+        read_counts_1_fp = os.path.join(work_dir, 'read_counts_1.tsv')
+        write_read_counts(
+            read_counts_1_fp,
+            'sample1',
+            [
+                StepReadCounts('step_01_trim_primers', RecordCounts(10, 2000), RecordCounts(8, 1600), 2.0),
+                StepReadCounts('step_02_join_paired_end_reads', RecordCounts(8, 1600), RecordCounts(5, 600), 1.0),
+            ])
+        read_counts_2_fp = os.path.join(work_dir, 'read_counts_2.tsv')
+        write_read_counts(
+            read_counts_2_fp,
+            'sample2',
+            [
+                StepReadCounts('step_01_trim_primers', RecordCounts(4, 800), RecordCounts(4, 800), 0.0),
+                StepReadCounts('step_07_write_read_table', RecordCounts(4, 800), RecordCounts(4, None), 1.0),
+            ])
+
+        columns, rows = aggregate_read_counts([read_counts_1_fp, read_counts_2_fp])
+        assert columns[0] == 'sample'
+        assert columns[-1] == 'read_survival'
+        assert 'step_02_reads_out' in columns
+        assert 'step_07_reads_out' in columns
+
+        assert rows[0]['step_01_reads_per_second'] == '5.0'
+        assert rows[0]['step_02_bases_out'] == '600'
+        assert rows[0]['read_survival'] == '0.5000'
+        assert 'step_07_reads_out' not in rows[0]
+
+        assert rows[1]['step_01_reads_per_second'] == ''
+        assert rows[1]['step_07_bases_out'] == ''
+        assert rows[1]['read_survival'] == '1.0000'
+
+
+def test_write_read_counts_with_subsampling():
+    with tempfile.TemporaryDirectory() as work_dir:
+        read_counts_fp = os.path.join(work_dir, 'read_counts.tsv')
+        write_read_counts(
+            read_counts_fp,
+            'sample1',
+            [
+                StepReadCounts('step_00_subsample_read_pairs', RecordCounts(100, 20000), RecordCounts(10, 2000), 1.0),
+                StepReadCounts('step_00_demultiplex_amplicons', RecordCounts(10, 2000), RecordCounts(10, 2000), 1.0),
+                StepReadCounts('step_01_trim_primers', RecordCounts(10, 2000), RecordCounts(8, 1600), 2.0),
+            ])
+        columns, rows = aggregate_read_counts([read_counts_fp])
+        assert columns[1:3] == ['step_00_subsample_reads_in', 'step_00_subsample_bases_in']
+        assert rows[0]['step_00_subsample_reads_out'] == '10'
+        # both steps numbered 00 have their own columns
+        assert rows[0]['step_00_demultiplex_reads_in'] == '10'
+        assert 'step_00_reads_in' not in rows[0]
+        # survival of the subsampled reads
+        assert rows[0]['read_survival'] == '0.8000'
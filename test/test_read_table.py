@@ -0,0 +1,73 @@
+import os
+import tempfile
+
+import pytest
+
+pytest.importorskip('pyarrow')
+
+from qc18SV4.read_table import read_read_tables, write_read_table
+
+
+def write_file(dir_path, file_name, content):
+    fp = os.path.join(dir_path, file_name)
+    with open(fp, 'wt') as f:
+        f.write(content)
+    return fp
+
+
+def test_write_read_table():
+    with tempfile.TemporaryDirectory() as work_dir:
+        # three read pairs, pairs a and c were joined with overlaps of 4 and 2
+        forward_fp = write_file(work_dir, 'unittest.trim1p.fastq', '@a 1\nAAAAAA\n+\nIIIIII\n@b 1\nCCCC\n+\nIIII\n@c 1\nGGGG\n+\nIIII\n')
+        reverse_fp = write_file(work_dir, 'unittest.trim2p.fastq', '@a 2\nTTTTTT\n+\nIIIIII\n@b 2\nCCCC\n+\nIIII\n@c 2\nTTTT\n+\nIIII\n')
+        # quality scores I = 40 and 5 = 20 for phred 33
+        quality_fp = write_file(
+            work_dir, 'unittest.trim.join.quality.fastq',
+            '@a 1\nAAAAAAAA\n+\nIIII5555\n@c 1\nGGGGTT\n+\nIIIIII\n')
+        # read 1 was removed by the length filter and read 2 is on two lines
+        final_fp = write_file(work_dir, 'unittest.id.fasta', '>unittest_2\nGGG\nGTT\n')
+
+        read_table_fp = os.path.join(work_dir, 'unittest.reads.parquet')
+        row_count = write_read_table(
+            prefix='unittest',
+            read_table_fp=read_table_fp,
+            final_fasta_fp=final_fp,
+            quality_filtered_fastq_fp=quality_fp,
+            forward_fastq_fp=forward_fp,
+            reverse_fastq_fp=reverse_fp)
+        assert row_count == 1
+
+        rows = read_read_tables([read_table_fp]).to_pylist()
+        assert rows == [{
+            'sample': 'unittest',
+            'read_id': 'unittest_2',
+            'sequence': 'GGGGTT',
+            'length': 6,
+            'mean_quality': 40.0,
+            'overlap': 2,
+        }]
+
+
+def test_read_read_tables__filter():
+    with tempfile.TemporaryDirectory() as work_dir:
+        read_table_fp_list = []
+        for sample, length in (('s1', 10), ('s2', 20)):
+            quality_fp = write_file(
+                work_dir, sample + '.fastq',
+                ''.join('@r{}\n{}\n+\n{}\n'.format(i, 'A' * length, 'I' * length) for i in range(5)))
+            final_fp = write_file(
+                work_dir, sample + '.fasta',
+                ''.join('>{}_{}\n{}\n'.format(sample, i + 1, 'A' * length) for i in range(5)))
+            read_table_fp = os.path.join(work_dir, sample + '.reads.parquet')
+            write_read_table(
+                prefix=sample,
+                read_table_fp=read_table_fp,
+                final_fasta_fp=final_fp,
+                quality_filtered_fastq_fp=quality_fp,
+                row_group_size=2)
+            read_table_fp_list.append(read_table_fp)
+
+        table = read_read_tables(read_table_fp_list, columns=['sample', 'length'], filters=[('length', '>', 15)])
+        assert table.column_names == ['sample', 'length']
+        assert table.num_rows == 5
+        assert set(table.column('sample').to_pylist()) == {'s2'}
@@ -0,0 +1,106 @@
+import gzip
+import io
+import os
+import tempfile
+
+import pytest
+
+from qc18SV4.exceptions import PipelineException
+import qc18SV4.record_batches
+from qc18SV4.record_batches import RecordBatchWriter, read_record_batches
+
+
+test_data_dp = os.path.join(os.path.dirname(__file__), 'data')
+
+
+def read_records(fp, file_format, chunk_size):
+    records = []
+    for batch in read_record_batches(fp, file_format, chunk_size=chunk_size):
+        for i in range(len(batch)):
+            records.append((
+                batch.id(i),
+                bytes(batch.sequence(i)),
+                bytes(batch.quality(i)) if file_format == 'fastq' else None))
+    return records
+
+
+def test_read_fastq_batches():
+    fastq_fp = os.path.join(test_data_dp, 'Test01_L001_R1_001.fastq')
+    with open(fastq_fp, 'rb') as f:
+        lines = f.read().splitlines()
+    expected_records = [
+        (lines[i][1:].split()[0], lines[i + 1], lines[i + 3])
+        for i in range(0, len(lines), 4)
+    ]
+    # small chunks split records across batches
+    for chunk_size in (50, 1000, 2**20):
+        assert read_records(fastq_fp, 'fastq', chunk_size) == expected_records
+
+    # each batch keeps its own buffer so earlier batches are unchanged by later reads
+    batches = list(read_record_batches(fastq_fp, 'fastq', chunk_size=50))
+    with open(fastq_fp, 'rb') as f:
+        assert b''.join(batch.as_bytes() for batch in batches) == f.read()
+
+
+def test_read_batches_without_final_line_end():
+    with tempfile.TemporaryDirectory() as work_dir:
+        fastq_fp = os.path.join(work_dir, 'reads.fastq.gz')
+        with gzip.open(fastq_fp, 'wb') as f:
+            f.write(b'@r1 a\nACGT\n+\nIIII\n@r2\r\nGG\r\n+\r\nII')
+        assert read_records(fastq_fp, 'fastq', 7) == [(b'r1', b'ACGT', b'IIII'), (b'r2', b'GG', b'II')]
+
+        fasta_fp = os.path.join(work_dir, 'reads.fasta')
+        with open(fasta_fp, 'wb') as f:
+            f.write(b'\n>s1 first\nACGT\nAC\n>s2\n>s3\nTTT')
+        assert read_records(fasta_fp, 'fasta', 5) == [(b's1', b'ACGTAC', None), (b's2', b'', None), (b's3', b'TTT', None)]
+        assert sum(batch.base_count for batch in read_record_batches(fasta_fp, 'fasta')) == 9
+
+
+def test_read_batches_errors():
+    with tempfile.TemporaryDirectory() as work_dir:
+        fastq_fp = os.path.join(work_dir, 'reads.fastq')
+        with open(fastq_fp, 'wb') as f:
+            f.write(b'@r1\nACGT\n+\nIIII\n@r2\nGG\n')
+        with pytest.raises(PipelineException):
+            read_records(fastq_fp, 'fastq', 2**20)
+        with pytest.raises(PipelineException):
+            read_records(fastq_fp, 'fasta', 2**20)
+        with pytest.raises(PipelineException):
+            read_records(fastq_fp, 'fastx', 2**20)
+
+
+def test_record_batch_writer():
+    fastq_fp = os.path.join(test_data_dp, 'Test01_L001_R1_001.fastq')
+    with open(fastq_fp, 'rb') as f:
+        fastq = f.read()
+
+    output_file = io.BytesIO()
+    with RecordBatchWriter(output_file, 'fastq', buffer_size=100) as writer:
+        for batch in read_record_batches(fastq_fp, 'fastq', chunk_size=1000):
+            writer.write_batch(batch)
+    assert output_file.getvalue() == fastq
+    assert writer.record_count == fastq.count(b'\n') // 4
+
+    output_file = io.BytesIO()
+    with RecordBatchWriter(output_file, 'fasta', line_length=3) as writer:
+        writer.write_record(b'a', b'ACGTACG')
+        writer.write_record(b'b', b'')
+        writer.write_record(b'c', b'ACG')
+    assert output_file.getvalue() == b'>a\nACG\nTAC\nG\n>b\n>c\nACG\n'
+    assert (writer.record_count, writer.base_count) == (3, 10)
+
+
+def test_write_record_bytes():
+    with tempfile.TemporaryDirectory() as work_dir:
+        fastq_fp = os.path.join(work_dir, 'reads.fastq')
+        with open(fastq_fp, 'wb') as f:
+            f.write(b'@r1 a\nACGT\n+r1\nIIII\n@r2\nGG\n+\nII')
+
+        output_file = io.BytesIO()
+        with RecordBatchWriter(output_file, 'fastq') as writer:
+            # records are read one at a time across batches of two records or less
+            for batch, i in qc18SV4.record_batches.read_records(fastq_fp, 'fastq', chunk_size=20):
+                writer.write_record_bytes(batch.record(i), batch.sequence_length(i))
+        # records are written unchanged and the last record gets a line end
+        assert output_file.getvalue() == b'@r1 a\nACGT\n+r1\nIIII\n@r2\nGG\n+\nII\n'
+        assert (writer.record_count, writer.base_count) == (2, 6)
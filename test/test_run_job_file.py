@@ -0,0 +1,74 @@
+import os
+import sys
+import tempfile
+
+import pytest
+
+from qc18SV4.run_job_file import Task, WorkQueueScheduler, get_task_core_count, get_tasks, read_job_file
+
+
+def test_get_task_core_count():
+    assert get_task_core_count('singularity exec muscope-18SV4.img pipeline -f a_R1_.fastq -c 4 -p "x"') == 4
+    assert get_task_core_count('pipeline --core-count 2 -f a_R1_.fastq') == 2
+    assert get_task_core_count('pipeline -f a_R1_-c_.fastq') == 1
+    assert get_task_core_count('echo hello', default=3) == 3
+
+
+def test_read_job_file():
+    with tempfile.TemporaryDirectory() as work_dir:
+        job_fp = os.path.join(work_dir, 'job_file')
+        with open(job_fp, 'wt') as job_file:
+            job_file.write('# comment\npipeline -c 2 -f a\n\npipeline -c 1 -f b\n')
+        tasks = get_tasks(read_job_file(job_fp))
+        assert [task.command_line for task in tasks] == ['pipeline -c 2 -f a', 'pipeline -c 1 -f b']
+        assert [task.core_count for task in tasks] == [2, 1]
+
+        tasks = get_tasks(read_job_file(job_fp), cores_per_task=3)
+        assert [task.command_line for task in tasks] == ['pipeline -c 3 -f a', 'pipeline -c 3 -f b']
+        assert [task.core_count for task in tasks] == [3, 3]
+
+
+def test_work_queue_scheduler():
+    with tempfile.TemporaryDirectory() as work_dir:
+        tasks = [
+            Task(task_id=i, command_line='sleep 0.2; exit {}'.format(i % 2), core_count=1)
+            for i
+            in range(4)
+        ]
+        scheduler = WorkQueueScheduler(tasks=tasks, total_cores=1)
+        scheduler.run()
+
+        assert [task.returncode for task in tasks] == [0, 1, 0, 1]
+        # one core means the tasks ran one at a time
+        tasks_by_start_time = sorted(tasks, key=lambda t: t.start_time)
+        for previous_task, task in zip(tasks_by_start_time, tasks_by_start_time[1:]):
+            assert previous_task.end_time <= task.start_time
+        assert 0.0 < scheduler.get_core_utilization() <= 1.0
+
+        report_fp = os.path.join(work_dir, 'report.tsv')
+        scheduler.write_report(report_fp)
+        with open(report_fp, 'rt') as report_file:
+            report_lines = report_file.readlines()
+        assert len(report_lines) == 5
+        assert report_lines[0].startswith('task_id\tcore_count\tcores')
+
+
+def test_work_queue_scheduler__oversized_task():
+    tasks = [Task(task_id=0, command_line='true', core_count=1000)]
+    WorkQueueScheduler(tasks=tasks, total_cores=1).run()
+    assert tasks[0].core_count == 1
+    assert tasks[0].returncode == 0
+
+
+@pytest.mark.skipif(not hasattr(os, 'sched_getaffinity'), reason='os.sched_getaffinity is not available')
+def test_work_queue_scheduler__affinity():
+    with tempfile.TemporaryDirectory() as work_dir:
+        affinity_fp = os.path.join(work_dir, 'affinity')
+        # the shell starts python as a child, which must already be restricted to the task's cores
+        command_line = '{} -c "import os; print(sorted(os.sched_getaffinity(0)))" > {}'.format(
+            sys.executable, affinity_fp)
+        tasks = [Task(task_id=0, command_line=command_line, core_count=1)]
+        WorkQueueScheduler(tasks=tasks, total_cores=1).run()
+        assert tasks[0].returncode == 0
+        with open(affinity_fp, 'rt') as affinity_file:
+            assert affinity_file.read().strip() == str(tasks[0].cores)
@@ -0,0 +1,65 @@
+import gzip
+import io
+import os
+import tempfile
+
+import pytest
+
+from qc18SV4.exceptions import PipelineException
+from qc18SV4.shared_batches import keep_records, transform_records
+
+
+test_data_dp = os.path.join(os.path.dirname(__file__), 'data')
+
+
+def keep_long_reads(batch, slot):
+    return keep_records(batch, slot, [i for i in range(len(batch)) if batch.sequence_length(i) >= 200])
+
+
+def fastq_to_fasta(batch, slot):
+    # every field is read before the output overwrites the slot
+    output = b''.join(b'>' + batch.id(i) + b'\n' + bytes(batch.sequence(i)) + b'\n' for i in range(len(batch)))
+    slot[:len(output)] = output
+    return len(output), len(batch)
+
+
+def fail(batch, slot):
+    raise ValueError('bad batch')
+
+
+def test_transform_records():
+    fastq_fp = os.path.join(test_data_dp, 'Test01_L001_R1_001.fastq')
+    with open(fastq_fp, 'rb') as f:
+        lines = f.read().splitlines()
+    records = [lines[i:i + 4] for i in range(0, len(lines), 4)]
+
+    with tempfile.TemporaryDirectory() as work_dir:
+        gzip_fastq_fp = os.path.join(work_dir, 'reads.fastq.gz')
+        with open(fastq_fp, 'rb') as f, gzip.open(gzip_fastq_fp, 'wb') as g:
+            g.write(f.read())
+
+        # small slots so the reads pass through many slots and workers
+        output_file = io.BytesIO()
+        record_count = transform_records(
+            gzip_fastq_fp, 'fastq', output_file, keep_long_reads, worker_count=3, slot_count=4, slot_size=4096)
+        expected_records = [record for record in records if len(record[1]) >= 200]
+        assert record_count == len(expected_records)
+        assert output_file.getvalue() == b''.join(b'\n'.join(record) + b'\n' for record in expected_records)
+
+        output_file = io.BytesIO()
+        record_count = transform_records(fastq_fp, 'fastq', output_file, fastq_to_fasta, slot_size=4096)
+        assert record_count == len(records)
+        assert output_file.getvalue() == b''.join(
+            b'>' + record[0][1:].split()[0] + b'\n' + record[1] + b'\n' for record in records)
+
+
+def test_transform_records_errors():
+    fastq_fp = os.path.join(test_data_dp, 'Test01_L001_R1_001.fastq')
+    with pytest.raises(PipelineException) as e:
+        transform_records(fastq_fp, 'fastq', io.BytesIO(), fail, slot_size=4096)
+    assert 'bad batch' in str(e.value)
+
+    # a batch larger than a slot
+    with pytest.raises(PipelineException) as e:
+        transform_records(fastq_fp, 'fastq', io.BytesIO(), keep_long_reads, slot_size=512, batch_size=1024)
+    assert 'does not fit' in str(e.value)
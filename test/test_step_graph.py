@@ -0,0 +1,89 @@
+import threading
+import time
+
+import pytest
+
+from qc18SV4.exceptions import PipelineException
+from qc18SV4.step_graph import StepGraph
+
+
+def test_get_dependencies():
+    graph = StepGraph()
+    graph.add('trim', None, writes=('trimmed', 'unpaired'))
+    graph.add('trim_fastqc', None, reads=('trimmed', 'unpaired'))
+    graph.add('join', None, reads=('trimmed', ), writes=('joined', ))
+    graph.add('join_fastqc', None, reads=('joined', ))
+    # deleting trimmed files waits for every task that reads them
+    graph.add('release', None, deletes=('trimmed', 'unpaired'))
+    graph.add('filter', None, reads=('joined', ), deletes=('joined', ))
+
+    assert graph.get_dependencies() == {
+        'trim': [],
+        'trim_fastqc': ['trim'],
+        'join': ['trim'],
+        'join_fastqc': ['join'],
+        'release': ['trim', 'trim_fastqc', 'join'],
+        'filter': ['join', 'join_fastqc'],
+    }
+
+    with pytest.raises(PipelineException):
+        graph.add('trim', None)
+
+
+class CoreCounter:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.busy_cores = 0
+        self.peak_busy_cores = 0
+        self.order = []
+
+    def task(self, name, cores, seconds=0.05):
+        def run(results):
+            with self.lock:
+                self.busy_cores += cores
+                self.peak_busy_cores = max(self.peak_busy_cores, self.busy_cores)
+                self.order.append(name)
+            time.sleep(seconds)
+            with self.lock:
+                self.busy_cores -= cores
+            return name.upper()
+        return run
+
+
+def test_run():
+    core_counter = CoreCounter()
+    graph = StepGraph()
+    graph.add('a', core_counter.task('a', 2), writes=('x', ), cores=2)
+    graph.add('b', core_counter.task('b', 2), reads=('x', ), cores=2)
+    graph.add('c', core_counter.task('c', 1), reads=('x', ), writes=('y', ))
+    graph.add('d', lambda results: results['c'] + '!', reads=('y', ), cores=lambda results: 8)
+
+    results = graph.run(core_count=3)
+    assert list(results.items()) == [('a', 'A'), ('b', 'B'), ('c', 'C'), ('d', 'C!')]
+    # b and c run at the same time but never on more than 3 cores
+    assert core_counter.order == ['a', 'b', 'c']
+    assert core_counter.peak_busy_cores == 3
+
+    core_counter = CoreCounter()
+    graph = StepGraph()
+    graph.add('a', core_counter.task('a', 1), writes=('x', ))
+    graph.add('b', core_counter.task('b', 1), reads=('x', ))
+    graph.add('c', core_counter.task('c', 1), reads=('x', ))
+    graph.run(core_count=1)
+    assert core_counter.peak_busy_cores == 1
+
+
+def test_run_failure():
+    core_counter = CoreCounter()
+
+    def fail(results):
+        raise PipelineException('failed')
+
+    graph = StepGraph()
+    graph.add('a', fail, writes=('x', ))
+    graph.add('b', core_counter.task('b', 1))
+    graph.add('c', core_counter.task('c', 1), reads=('x', ))
+    with pytest.raises(PipelineException):
+        graph.run(core_count=2)
+    # b was already running and c never starts
+    assert core_counter.order == ['b']
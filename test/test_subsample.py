@@ -0,0 +1,109 @@
+import gzip
+import os
+import tempfile
+
+import pytest
+
+from qc18SV4.compression import get_compression, open_compressed
+from qc18SV4.exceptions import PipelineException
+from qc18SV4.read_counts import get_input_read_counts
+from qc18SV4.record_batches import read_records
+import qc18SV4.subsample
+from qc18SV4.subsample import sample_reservoir, subsample_read_pairs
+
+
+test_data_dp = os.path.join(os.path.dirname(__file__), 'data')
+
+
+def test_sample_reservoir():
+    chosen = sample_reservoir(range(1000), 10, seed=7)
+    assert len(chosen) == 10
+    assert [index for index, _ in chosen] == sorted(item for _, item in chosen)
+    # the same seed chooses the same items
+    assert sample_reservoir(range(1000), 10, seed=7) == chosen
+    assert sample_reservoir(range(1000), 10, seed=8) != chosen
+    # fewer items than the reservoir
+    assert sample_reservoir('ab', 3) == [(0, 'a'), (1, 'b')]
+    # keep is applied only to the items that enter the reservoir
+    kept_items = []
+    assert sample_reservoir(range(1000), 10, seed=7, keep=lambda item: kept_items.append(item) or -item) == [
+        (index, -item) for index, item in chosen]
+    assert 10 < len(kept_items) < 200
+
+    # every item is about equally likely to be chosen
+    chosen_counts = [0] * 20
+    for seed in range(4000):
+        for index, _ in sample_reservoir(range(20), 5, seed=seed):
+            chosen_counts[index] += 1
+    assert all(800 < chosen_count < 1200 for chosen_count in chosen_counts)
+
+    with pytest.raises(PipelineException):
+        sample_reservoir(range(10), 0)
+
+
+def read_ids(fp):
+    with gzip.open(fp, 'rt') as f:
+        return [line.split()[0] for line in f.readlines()[::4]]
+
+
+def write_gzipped_test_data(input_dir):
+    forward_fp = os.path.join(input_dir, 'Test01_L001_R1_001.fastq.gz')
+    reverse_fp = os.path.join(input_dir, 'Test01_L001_R2_001.fastq.gz')
+    for fp in (forward_fp, reverse_fp):
+        with open(os.path.join(test_data_dp, os.path.basename(fp)[:-3]), 'rb') as f, gzip.open(fp, 'wb') as g:
+            g.write(f.read())
+    return forward_fp, reverse_fp
+
+
+def test_subsample_read_pairs():
+    with tempfile.TemporaryDirectory() as input_dir, tempfile.TemporaryDirectory() as output_dir:
+        forward_fp, reverse_fp = write_gzipped_test_data(input_dir)
+        subsampled_files = subsample_read_pairs(forward_fp, reverse_fp, max_read_pairs=10, output_dp=output_dir)
+        assert subsampled_files.forward_fp == os.path.join(output_dir, 'Test01_L001_R1_001.fastq.gz')
+        assert subsampled_files.forward_counts.record_count == 10
+        assert subsampled_files.input_counts.record_count == len(read_ids(forward_fp))
+        assert subsampled_files.input_counts == get_input_read_counts(forward_fp, reverse_fp)
+        # forward and reverse reads stay paired and in input order
+        forward_ids = read_ids(subsampled_files.forward_fp)
+        assert forward_ids == read_ids(subsampled_files.reverse_fp)
+        input_ids = read_ids(forward_fp)
+        assert sorted(forward_ids, key=input_ids.index) == forward_ids
+
+        with gzip.open(reverse_fp, 'rt') as f:
+            reverse_lines = f.readlines()
+        with gzip.open(reverse_fp, 'wt') as f:
+            f.writelines(reverse_lines[:-4])
+        with pytest.raises(PipelineException):
+            subsample_read_pairs(forward_fp, reverse_fp, max_read_pairs=10, output_dp=output_dir)
+
+
+def test_subsample_read_pairs__one_pass(monkeypatch):
+    read_fp_list = []
+
+    def read_records_spy(fp, file_format):
+        read_fp_list.append(fp)
+        return read_records(fp, file_format, chunk_size=1000)
+
+    monkeypatch.setattr(qc18SV4.subsample, 'read_records', read_records_spy)
+    with tempfile.TemporaryDirectory() as input_dir, tempfile.TemporaryDirectory() as output_dir:
+        forward_fp, reverse_fp = write_gzipped_test_data(input_dir)
+        subsampled_files = subsample_read_pairs(forward_fp, reverse_fp, max_read_pairs=10, output_dp=output_dir, seed=3)
+
+        # each input file is read once and the pairs chosen are those chosen by index
+        assert read_fp_list == [forward_fp, reverse_fp]
+        input_ids = read_ids(forward_fp)
+        chosen_indices = [index for index, _ in sample_reservoir(range(len(input_ids)), 10, seed=3)]
+        assert read_ids(subsampled_files.forward_fp) == [input_ids[index] for index in chosen_indices]
+        assert read_ids(subsampled_files.reverse_fp) == read_ids(subsampled_files.forward_fp)
+
+
+def test_subsample_read_pairs__zstd():
+    pytest.importorskip('zstandard')
+    with tempfile.TemporaryDirectory() as input_dir, tempfile.TemporaryDirectory() as output_dir:
+        forward_fp, reverse_fp = write_gzipped_test_data(input_dir)
+        subsampled_files = subsample_read_pairs(
+            forward_fp, reverse_fp, max_read_pairs=10, output_dp=output_dir, compression='zstd', level=3)
+        assert subsampled_files.forward_fp == os.path.join(output_dir, 'Test01_L001_R1_001.fastq.zst')
+        assert get_compression(subsampled_files.reverse_fp) == 'zstd'
+        with open_compressed(subsampled_files.forward_fp, 'rt') as f:
+            assert len(f.readlines()) == 4 * 10
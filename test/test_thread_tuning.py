@@ -0,0 +1,51 @@
+import os
+import tempfile
+
+from qc18SV4.step_metrics import StepMetrics, read_step_metrics, write_step_metrics
+from qc18SV4.thread_tuning import check_step_metrics, choose_thread_counts, get_available_cpu_count
+
+
+def test_choose_thread_counts__small_input():
+    thread_counts = choose_thread_counts(input_bytes=1000, core_count=16)
+    assert thread_counts.trimmomatic == 1
+    assert thread_counts.fastqc == 1
+    assert thread_counts.compression == 1
+
+
+def test_choose_thread_counts__large_input():
+    cpu_count = get_available_cpu_count()
+    thread_counts = choose_thread_counts(input_bytes=10 * 2**30, core_count=cpu_count)
+    assert thread_counts.trimmomatic == cpu_count
+    assert thread_counts.fastqc == min(cpu_count, 4)
+    assert thread_counts.compression == cpu_count
+
+    # never more threads than the pipeline was given
+    thread_counts = choose_thread_counts(input_bytes=10 * 2**30, core_count=1)
+    assert thread_counts == (1, 1, 1)
+
+
+def get_step_metrics(step, elapsed_seconds, cpu_seconds, threads):
+    step_metrics = StepMetrics(step=step, input_bytes=2**20, threads=threads, sample_input_bytes=2**21)
+    step_metrics.elapsed_seconds = elapsed_seconds
+    step_metrics.cpu_seconds = cpu_seconds
+    step_metrics.output_bytes = 2**19
+    return step_metrics
+
+
+def test_check_step_metrics():
+    with tempfile.TemporaryDirectory() as work_dir:
+        step_metrics_fp = os.path.join(work_dir, 'step_metrics.tsv')
+        write_step_metrics(
+            step_metrics_fp,
+            [
+                get_step_metrics('step_01_trim_primers', elapsed_seconds=10.0, cpu_seconds=38.0, threads=4),
+                get_step_metrics('step_02_join_paired_end_reads', elapsed_seconds=10.0, cpu_seconds=11.0, threads=4),
+                get_step_metrics('step_06_rewrite_sequence_ids', elapsed_seconds=10.0, cpu_seconds=2.0, threads=1),
+            ])
+        step_metrics_list = read_step_metrics(step_metrics_fp)
+
+        assert len(step_metrics_list) == 3
+        assert step_metrics_list[0].cpu_efficiency == 0.95
+        assert step_metrics_list[0].sample_input_bytes == 2**21
+        inefficient_steps = check_step_metrics(step_metrics_list)
+        assert [s.step for s in inefficient_steps] == ['step_02_join_paired_end_reads']
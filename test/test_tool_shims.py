@@ -0,0 +1,51 @@
+import glob
+import os
+import subprocess
+import tempfile
+
+from qc18SV4.tool_shims import OrchestrationBenchmark, shim_log_env_var, write_read_pairs, write_tool_shims
+
+
+def test_write_tool_shims():
+    with tempfile.TemporaryDirectory() as work_dir:
+        shim_dir = os.path.join(work_dir, 'shims')
+        write_tool_shims(shim_dir)
+        forward_fp = os.path.join(work_dir, 'a_L001_R1_001.fastq')
+        reverse_fp = os.path.join(work_dir, 'a_L001_R2_001.fastq')
+        write_read_pairs(forward_fp, reverse_fp, 10, forward_primer='ACGTN', reverse_primer='TTGCA', read_length=30)
+
+        shim_log_fp = os.path.join(work_dir, 'shim_log.tsv')
+        env = dict(os.environ)
+        env[shim_log_env_var] = shim_log_fp
+        subprocess.run(
+            [os.path.join(shim_dir, 'fastq_to_fasta'), '-i', forward_fp, '-o', os.path.join(work_dir, 'a.fasta'), '-n', '-v', '-r'],
+            env=env,
+            check=True)
+        with open(os.path.join(work_dir, 'a.fasta'), 'rt') as f:
+            lines = f.readlines()
+        assert len(lines) == 20
+        assert lines[0] == '>1\n'
+        assert lines[1].startswith('ACGT')
+
+        subprocess.run(
+            [os.path.join(shim_dir, 'fastqc'), '--threads', '1', '--outdir', work_dir, forward_fp],
+            env=env,
+            check=True)
+        assert os.path.exists(os.path.join(work_dir, 'a_L001_R1_001_fastqc.zip'))
+
+        with open(shim_log_fp, 'rt') as f:
+            assert [line.split('\t')[0] for line in f] == ['fastq_to_fasta', 'fastqc']
+
+
+def test_orchestration_benchmark():
+    with tempfile.TemporaryDirectory() as work_dir:
+        benchmark = OrchestrationBenchmark(work_dp=work_dir)
+        result = benchmark.benchmark_pipeline(read_pair_count=50)
+        assert result['benchmark'] == 'pipeline'
+        assert result['tool_runs'] == '8'
+        assert float(result['overhead_seconds']) > 0.0
+        assert len(glob.glob(os.path.join(work_dir, 'pipeline_work', 'step_06_rewrite_sequence_ids', '*.fasta.gz'))) == 1
+
+        result = benchmark.benchmark_batch(sample_count=2, read_pair_count=20)
+        assert result['tool_runs'] == '16'
+        assert len(glob.glob(os.path.join(work_dir, 'batch_work', 'sample*', 'step_06_rewrite_sequence_ids', '*.fasta.gz'))) == 2
@@ -0,0 +1,76 @@
+import json
+import os
+import tempfile
+
+from qc18SV4.trace import (
+    get_core_utilization, get_trace_fp_list, get_tracer, merge_traces, read_trace_events, span, start_tracing,
+    stop_tracing)
+
+
+def test_span():
+    with tempfile.TemporaryDirectory() as work_dir:
+        # no tracer, nothing is written
+        with span('a', 'step'):
+            pass
+        assert get_tracer() is None
+
+        trace_fp = os.path.join(work_dir, 'trace.jsonl')
+        start_tracing(trace_fp, sample='Test01')
+        try:
+            with span('fastqc', 'tool', command='fastqc'):
+                pass
+            get_tracer().add_event('step_01_trim_primers', 'step', 10.0, 12.5, cpu_seconds=5.0)
+        finally:
+            stop_tracing()
+        assert get_tracer() is None
+
+        events = read_trace_events(trace_fp)
+        assert [(e['name'], e['cat'], e['ph']) for e in events] == [
+            ('fastqc', 'tool', 'X'), ('step_01_trim_primers', 'step', 'X')]
+        assert events[0]['args']['sample'] == 'Test01'
+        assert events[0]['args']['command'] == 'fastqc'
+        assert events[1]['ts'] == 10000000
+        assert events[1]['dur'] == 2500000
+
+
+def get_step_event(host, pid, start_seconds, duration_seconds, cpu_seconds):
+    return {
+        'name': 'step_01_trim_primers', 'cat': 'step', 'ph': 'X',
+        'ts': int(start_seconds * 1e6), 'dur': int(duration_seconds * 1e6), 'pid': pid, 'tid': 1,
+        'args': {'host': host, 'host_cores': 4, 'sample': 'S{}'.format(pid), 'cpu_seconds': cpu_seconds},
+    }
+
+
+def test_get_core_utilization():
+    events = [
+        # two cores busy for the first 20 seconds on host a
+        get_step_event('a', 1, 100.0, 20.0, 40.0),
+        # one core busy from 10 to 30 seconds on host a
+        get_step_event('a', 2, 110.0, 20.0, 20.0),
+        get_step_event('b', 1, 100.0, 10.0, 10.0),
+    ]
+    core_utilization = get_core_utilization(events, bin_seconds=10.0)
+    assert list(core_utilization) == ['a', 'b']
+    assert [round(busy, 3) for _, busy, _ in core_utilization['a']] == [2.0, 3.0, 1.0]
+    assert [round(busy, 3) for _, busy, _ in core_utilization['b']] == [1.0, 0.0, 0.0]
+    assert core_utilization['a'][0][2] == 4
+
+
+def test_merge_traces():
+    with tempfile.TemporaryDirectory() as work_dir:
+        for i, host in enumerate(('a', 'b')):
+            os.makedirs(os.path.join(work_dir, 'work-{}'.format(i)))
+            with open(os.path.join(work_dir, 'work-{}'.format(i), 'trace.jsonl'), 'wt') as f:
+                # the same pid on two hosts
+                f.write(json.dumps(get_step_event(host, 7, 100.0 + i, 10.0, 10.0)))
+                f.write('\n')
+
+        trace_fp_list = get_trace_fp_list([work_dir])
+        assert len(trace_fp_list) == 2
+        trace, core_utilization = merge_traces(trace_fp_list, bin_seconds=5.0)
+        complete_events = [e for e in trace['traceEvents'] if e['ph'] == 'X']
+        assert sorted(e['pid'] for e in complete_events) == [1, 2]
+        assert [e['ts'] for e in complete_events] == [0, 1000000]
+        process_names = [e['args']['name'] for e in trace['traceEvents'] if e['ph'] == 'M']
+        assert process_names == ['a 7 S7', 'b 7 S7', 'a cores', 'b cores']
+        assert len([e for e in trace['traceEvents'] if e['ph'] == 'C']) == 2 * len(core_utilization['a'])
@@ -0,0 +1,131 @@
+import os
+import tempfile
+
+from qc18SV4.watch_input import CompletedPairs, InputWatcher, get_args, get_settled_read_pairs
+
+
+def write_read_pair(input_dir, prefix, text):
+    for read in ('R1', 'R2'):
+        with open(os.path.join(input_dir, '{}_L001_{}_001.fastq'.format(prefix, read)), 'wt') as f:
+            f.write(text)
+
+
+def test_get_settled_read_pairs():
+    with tempfile.TemporaryDirectory() as input_dir:
+        write_read_pair(input_dir, 'a', 'AAAA')
+        # the reverse read file has not arrived
+        with open(os.path.join(input_dir, 'b_L001_R1_001.fastq'), 'wt') as f:
+            f.write('CCCC')
+
+        assert get_settled_read_pairs(input_dir, settle_seconds=60.0) == []
+        pair_states = get_settled_read_pairs(input_dir, settle_seconds=0.0)
+        assert [os.path.basename(p.forward.fp) for p in pair_states] == ['a_L001_R1_001.fastq']
+        assert pair_states[0].reverse.size == 4
+
+
+def test_get_args():
+    # the record is not written to the input directory, which may be read-only
+    args = get_args(['-i', 'input_dir', '-w', 'work-{prefix}', '-p', '(?P<prefix>.+)_R1'])
+    assert args.completed_fp == 'completed_pairs.tsv'
+
+
+def run_poll(watcher):
+    """Poll once and wait for the queued pipelines, returning their tasks in queue order."""
+    watcher.poll()
+    return sorted(watcher.wait(), key=lambda task: task.task_id)
+
+
+def test_input_watcher():
+    with tempfile.TemporaryDirectory() as input_dir, tempfile.TemporaryDirectory() as work_dir:
+        completed_pairs_fp = os.path.join(work_dir, 'completed_pairs.tsv')
+        run_log_fp = os.path.join(work_dir, 'run.log')
+
+        def get_command_line(forward_fp):
+            # fail for sample c
+            return 'echo {} >> {}; test {} != c'.format(
+                os.path.basename(forward_fp), run_log_fp, os.path.basename(forward_fp)[0])
+
+        def get_watcher():
+            return InputWatcher(
+                input_dp=input_dir,
+                completed_pairs_fp=completed_pairs_fp,
+                get_command_line=get_command_line,
+                settle_seconds=0.0,
+                total_cores=1)
+
+        def read_run_log():
+            with open(run_log_fp, 'rt') as f:
+                return sorted(line.strip() for line in f)
+
+        write_read_pair(input_dir, 'a', 'AAAA')
+        write_read_pair(input_dir, 'b', 'CCCC')
+        watcher = get_watcher()
+        assert len(run_poll(watcher)) == 2
+        assert len(CompletedPairs(completed_pairs_fp)) == 2
+
+        # nothing new
+        assert run_poll(watcher) == []
+
+        # a new pair and a failing pair arrive, only those are run
+        os.remove(run_log_fp)
+        write_read_pair(input_dir, 'c', 'GGGG')
+        write_read_pair(input_dir, 'd', 'TTTT')
+        tasks = run_poll(get_watcher())
+        assert [task.returncode != 0 for task in tasks] == [True, False]
+        assert read_run_log() == ['c_L001_R1_001.fastq', 'd_L001_R1_001.fastq']
+        assert len(CompletedPairs(completed_pairs_fp)) == 3
+
+        # the same contents with a new modification time are not run again
+        os.remove(run_log_fp)
+        write_read_pair(input_dir, 'a', 'AAAA')
+        os.utime(os.path.join(input_dir, 'a_L001_R1_001.fastq'), ns=(0, 0))
+        watcher = get_watcher()
+        # the failed pair is run again by a new watcher
+        assert len(run_poll(watcher)) == 1
+        assert read_run_log() == ['c_L001_R1_001.fastq']
+        # but not again by the same watcher until it changes
+        assert run_poll(watcher) == []
+
+        # changed contents are run again
+        write_read_pair(input_dir, 'b', 'CCCCCC')
+        assert len(run_poll(watcher)) == 1
+        assert read_run_log() == ['b_L001_R1_001.fastq', 'c_L001_R1_001.fastq']
+
+
+def test_input_watcher__new_pair_during_long_run():
+    """Polls do not wait for running pipelines and pairs they find are queued on the same scheduler."""
+    with tempfile.TemporaryDirectory() as input_dir, tempfile.TemporaryDirectory() as work_dir:
+        completed_pairs_fp = os.path.join(work_dir, 'completed_pairs.tsv')
+        finish_fp = os.path.join(work_dir, 'finish')
+
+        def get_command_line(forward_fp):
+            if os.path.basename(forward_fp).startswith('a'):
+                # a straggler that runs until it is told to finish
+                return 'while [ ! -e {} ]; do sleep 0.05; done'.format(finish_fp)
+            else:
+                return 'true'
+
+        watcher = InputWatcher(
+            input_dp=input_dir,
+            completed_pairs_fp=completed_pairs_fp,
+            get_command_line=get_command_line,
+            settle_seconds=0.0,
+            total_cores=1)
+        write_read_pair(input_dir, 'a', 'AAAA')
+        assert len(watcher.poll()) == 1
+
+        # a pair arriving while the straggler runs is queued without waiting for it
+        write_read_pair(input_dir, 'b', 'CCCC')
+        tasks = watcher.poll()
+        assert [task.command_line for task in tasks] == ['true']
+        assert watcher.wait(timeout=0.2) == []
+        # the running pair is not queued again
+        assert watcher.poll() == []
+        assert len(CompletedPairs(completed_pairs_fp)) == 0
+
+        # the queued pair runs when the straggler's core is free
+        with open(finish_fp, 'wt'):
+            pass
+        assert len(watcher.wait()) == 2
+        assert tasks[0].returncode == 0
+        assert len(CompletedPairs(completed_pairs_fp)) == 2
@@ -5,7 +5,8 @@ import tempfile
 import pytest
 
 from qc18SV4.pipeline import PipelineException
-from qc18SV4.write_launcher_job_file import get_file_path_pairs, get_cores_per_job, write_launcher_job_file
+from qc18SV4.write_launcher_job_file import (
+    get_file_path_pairs, get_cores_per_job, get_pipeline_command_line, write_launcher_job_file)
 
 
 def test_get_file_path_pairs():
@@ -46,6 +47,26 @@ def test_get_file_path_pairs_reverse_reads_exception():
                 reverse_read_file_paths=reverse_read_files))
 
 
+def test_get_pipeline_command_line():
+    command_line = get_pipeline_command_line(
+        forward_fp='/a/Test01_L001_R1_001.fastq',
+        work_dp_template='/b/work-{prefix}',
+        forward_primer='ACGT',
+        reverse_primer='TGCA',
+        prefix_regex=r'^(?P<prefix>Test\d+)',
+        phred=33)
+    assert '-w /b/work-Test01 ' in command_line
+
+    with pytest.raises(PipelineException):
+        get_pipeline_command_line(
+            forward_fp='/a/Sample01_L001_R1_001.fastq',
+            work_dp_template='/b/work-{prefix}',
+            forward_primer='ACGT',
+            reverse_primer='TGCA',
+            prefix_regex=r'^(?P<prefix>Test\d+)',
+            phred=33)
+
+
 def test_get_cores_per_job():
     one_node = {
         'slurm_job_num_nodes': 1,
@@ -0,0 +1,60 @@
+import os
+import tempfile
+
+import pytest
+
+from qc18SV4.exceptions import PipelineException
+from qc18SV4.write_slurm_array_job import SizeClass, parse_size_class, write_slurm_array_job
+
+
+def test_parse_size_class():
+    assert parse_size_class('small,1,2,4,01:30:00') == SizeClass('small', 2**30, 2, 4, '01:30:00')
+    assert parse_size_class('large,inf,8,16,24:00:00').max_input_bytes == float('inf')
+    with pytest.raises(PipelineException):
+        parse_size_class('small,1,2,4')
+    with pytest.raises(PipelineException):
+        parse_size_class('small,1,2,4,90')
+
+
+def test_write_slurm_array_job():
+    size_classes = [
+        SizeClass('small', 100, 1, 2, '00:30:00'),
+        SizeClass('medium', 1000, 2, 4, '01:00:00'),
+        SizeClass('large', float('inf'), 4, 8, '02:00:00'),
+    ]
+    with tempfile.TemporaryDirectory() as work_dir:
+        input_dir = os.path.join(work_dir, 'input')
+        os.mkdir(input_dir)
+        for prefix, size in (('a', 10), ('b', 20), ('c', 400)):
+            for read in ('R1', 'R2'):
+                with open(os.path.join(input_dir, '{}_L001_{}_001.fastq'.format(prefix, read)), 'wt') as f:
+                    f.write('A' * size)
+
+        output_dir = os.path.join(work_dir, 'jobs')
+        size_class_counts = write_slurm_array_job(
+            output_dp=output_dir,
+            input_dp=input_dir,
+            work_dp_template='work/{prefix}',
+            forward_primer='ACGT',
+            reverse_primer='TGCA',
+            prefix_regex='^(?P<prefix>[a-z]+)_L001_R[12]',
+            phred='33',
+            max_concurrent=5,
+            size_classes=size_classes)
+
+        # the empty large class has no script
+        assert [(c.name, n) for c, n in size_class_counts.items()] == [('small', 2), ('medium', 1)]
+        assert sorted(os.listdir(output_dir)) == [
+            'muscope-18SV4.medium.sh', 'muscope-18SV4.small.sh', 'samples.tsv', 'submit.sh']
+
+        with open(os.path.join(output_dir, 'samples.tsv'), 'rt') as f:
+            sample_lines = [line.rstrip('\n').split('\t') for line in f][1:]
+        assert [line[:3] for line in sample_lines] == [['small', '0', '20'], ['small', '1', '40'], ['medium', '0', '800']]
+        assert '-w work/c -c 2 ' in sample_lines[2][3]
+
+        with open(os.path.join(output_dir, 'muscope-18SV4.small.sh'), 'rt') as f:
+            script = f.read()
+        assert '#SBATCH --array=0-1%5\n' in script
+        assert '#SBATCH --cpus-per-task=1\n' in script
+        assert '#SBATCH --mem=2G\n' in script
+        assert '#SBATCH --time=00:30:00\n' in script